@@ -0,0 +1,115 @@
+import threading
+from streamers.protocol import FLAG_FEEDBACK
+
+# Closed-loop quality control for a client streamer. Frames go out with FLAG_FEEDBACK and
+# the streamer's feedback thread hands the server's FEEDBACK_ACKs to on_ack. Each ack gives the frame's
+# delivery latency (send start to ack arrival, both on the client clock) and goodput.
+# Settings follow AIMD on the smoothed latency. Above `target_latency`, quality and bitrate
+# are cut by `decrease`, and fps drops once those are at their minimum. Below `headroom` *
+# target they creep back up, fps first. After a cut the controller waits one latency
+# before cutting again, so frames already queued at the old settings don't count twice.
+# The streamer applies new settings on its own thread, see Streamer.adapt().
+class AbrController:
+    def __init__(self, streamer, target_latency=0.2, fps=10, min_quality=10, max_quality=95,
+                 min_bitrate=500, max_bitrate=25000, min_fps=2, decrease=0.8, headroom=0.7, alpha=0.3):
+        self.streamer = streamer
+        self.target_latency = target_latency
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.min_fps = min_fps
+        self.max_fps = fps
+        self.decrease = decrease
+        self.headroom = headroom
+        self.alpha = alpha
+        # Codecs without a quality (Basic, TileSpatial) or bitrate (everything but H.264) report 0
+        self.quality = streamer.quality
+        self.bitrate = streamer.bitrate
+        self.fps = fps
+        self.version = 0
+        self.lock = threading.Lock()
+        self.sent = {} # sequence number -> send start time
+        self.latency = None
+        self.throughput = None # kbps
+        self.hold_until = 0
+        self.acks = 0
+        # Called with (sequence number, ack arrival time) for every ack
+        self.listeners = []
+
+    def start(self):
+        self.streamer.controller = self
+        self.streamer.header_flags |= FLAG_FEEDBACK
+        self.streamer.start_feedback()
+        return self
+
+    # Detaches from the streamer, frames sent after this go out without FLAG_FEEDBACK
+    def stop(self):
+        self.streamer.header_flags &= ~FLAG_FEEDBACK
+        self.streamer.controller = None
+
+    def settings(self):
+        with self.lock:
+            return self.quality, self.bitrate, self.fps, self.version
+
+    def frame_sent(self, seq, start_time):
+        with self.lock:
+            self.sent[seq] = start_time
+
+    def log_fields(self):
+        with self.lock:
+            return {
+                'abr_quality': self.quality,
+                'abr_bitrate_kbps': self.bitrate,
+                'abr_fps': self.fps,
+                'abr_latency_ms': self.latency * 1000 if self.latency is not None else None,
+                'abr_throughput_kbps': self.throughput,
+            }
+
+    def on_ack(self, ack, now):
+        with self.lock:
+            start_time = self.sent.pop(ack.seq, None)
+            if start_time is None:
+                return
+            for seq in [seq for seq in self.sent if seq < ack.seq]: # acks come in order, these were lost
+                del self.sent[seq]
+
+            latency = now - start_time
+            throughput = ack.a * 8 / 1000 / latency
+            if self.latency is None:
+                self.latency, self.throughput = latency, throughput
+            else:
+                self.latency += self.alpha * (latency - self.latency)
+                self.throughput += self.alpha * (throughput - self.throughput)
+            self.acks += 1
+
+            if now < self.hold_until:
+                return
+            if self.latency > self.target_latency:
+                self.step_down()
+                self.hold_until = now + self.latency
+            elif self.latency < self.headroom * self.target_latency:
+                self.step_up()
+
+    def step_down(self):
+        settings = (self.quality, self.bitrate, self.fps)
+        if self.quality > self.min_quality:
+            self.quality = max(self.min_quality, int(self.quality * self.decrease))
+        elif self.bitrate > self.min_bitrate:
+            # No point asking for more than the link has been delivering
+            self.bitrate = int(max(self.min_bitrate, min(self.bitrate * self.decrease, 0.9 * self.throughput)))
+        elif self.fps > self.min_fps:
+            self.fps -= 1
+        if (self.quality, self.bitrate, self.fps) != settings:
+            self.version += 1
+
+    def step_up(self):
+        settings = (self.quality, self.bitrate, self.fps)
+        if self.fps < self.max_fps:
+            self.fps += 1
+        elif self.quality and self.quality < self.max_quality:
+            self.quality = min(self.max_quality, self.quality + 2)
+        elif self.bitrate and self.bitrate < self.max_bitrate:
+            self.bitrate = min(self.max_bitrate, self.bitrate + 250)
+        if (self.quality, self.bitrate, self.fps) != settings:
+            self.version += 1
@@ -0,0 +1,87 @@
+import os
+import re
+import numpy as np
+
+# Older logs wrote these as strings with a unit ("12.3 ms"), newer ones as plain numbers
+# under a name that carries the unit. Values are converted to the new name's unit.
+RENAMED = {
+    'frame_size': ('frame_size_kb', 'KB'),
+    'network_duration': ('network_duration_ms', 'ms'),
+    'bandwidth': ('bandwidth_mbps', 'Mbps'),
+    'Total bytes received': ('Total MB received', 'MB'),
+    'Overall Bandwidth': ('Overall Bandwidth Mbps', 'Mbps'),
+}
+UNITS = {
+    'B': 1, 'KB': 1e3, 'MB': 1e6, 'GB': 1e9,
+    'bps': 1, 'Kbps': 1e3, 'Mbps': 1e6, 'Gbps': 1e9,
+    's': 1, 'ms': 1e-3, 'us': 1e-6,
+}
+
+# <stream>_logs[_<client ip>[_<session id>]][_<tag>].<ext> or <stream>_<client ip>.<ext>, e.g.
+# mjpeg30_logs.txt (client), tiled_logs_127.0.0.1_3.ndjson (server), h264_25M_logs.json,
+# mjpeg50_logs_10.193.123.80_try2.txt, h264_10.193.123.80.txt
+LOG_NAME = re.compile(r'^(?P<stream>.+?)(?:_logs(?=[_.])|(?=_\d+\.\d+\.\d+\.\d+))(?:_(?P<client>\d+\.\d+\.\d+\.\d+)(?:_(?P<session>\d+))?)?(?:_(?P<tag>[^.]+))?\.[a-z]+$')
+
+def file_meta(path, root):
+    name = os.path.basename(path)
+    match = LOG_NAME.match(name)
+    stream = match['stream'] if match else os.path.splitext(name)[0]
+    return {
+        'path': path,
+        'experiment': os.path.relpath(os.path.dirname(path), root),
+        'stream': stream,
+        'codec': (re.match(r'h264|[a-z]+', stream) or [stream])[0],
+        'client': match['client'] if match and match['client'] else '',
+        'session': match['session'] if match and match['session'] else '',
+        'tag': match['tag'] if match and match['tag'] else '',
+    }
+
+# One column of raw log values as float64, NaN where a record doesn't have the field. Strings
+# are split into number and unit in one pass over the column and scaled to `unit`.
+# Returns None for columns that aren't numeric.
+def to_column(values, unit=None):
+    if all(isinstance(value, (int, float)) or value is None for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype=float)
+    present = np.array([value is not None for value in values])
+    text = np.array([str(value) for value in values])[present]
+    parts = np.char.partition(np.char.strip(text), ' ')
+    try:
+        numbers = parts[:, 0].astype(float)
+    except ValueError:
+        return None
+    units, inverse = np.unique(parts[:, 2], return_inverse=True)
+    if unit is not None:
+        scales = np.array([UNITS[u] / UNITS[unit] if u in UNITS else 1 for u in units])
+        numbers = numbers * scales[inverse]
+    column = np.full(len(values), np.nan)
+    column[present] = numbers
+    return column
+
+# Per-frame records (anything with a client send time) as numeric columns under their new
+# names, and every other record (run summaries, pipeline stats, session ids) merged into
+# one dict with the same renaming
+def columns_from_records(records):
+    frames = [record for record in records if 'client_send_start_time' in record]
+    keys = list(dict.fromkeys(key for record in frames for key in record))
+    columns = {}
+    for key in keys:
+        name, unit = RENAMED.get(key, (key, None))
+        column = to_column([record.get(key) for record in frames], unit)
+        if column is not None:
+            columns[name] = column
+
+    summary = {}
+    for record in records:
+        if 'client_send_start_time' in record:
+            continue
+        for key, value in record.items():
+            name, unit = RENAMED.get(key, (key, None))
+            if isinstance(value, str) and unit:
+                column = to_column([value], unit)
+                value = column[0] if column is not None else value
+            summary[name] = value
+    return columns, summary
+
+# Server logs have receive times, client logs only send times
+def log_side(columns):
+    return 'server' if 'server_recv_end_time' in columns else 'client'
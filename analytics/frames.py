@@ -0,0 +1,301 @@
+# Per-frame latency breakdown of a stream: joins the client's log with the server's on the
+# send start time the client put in each frame header (the server logs it back), so client
+# logs holding several runs still line up, and with the session ID the client logs after
+# its handshake where both sides have one. Each joined frame is split into
+#   encode   client_encode_duration, for tiled streams partly inside send
+#   send     client_send_duration, overlaps network and receive
+#   network  client send start to server receive start
+#   receive  server receive start to end
+#   decode   server receive end to server_decoded_time
+#   total    encode + client send start to decoded (or received, for logs without decode times)
+# on the server's clock, when the server log has a clock offset from time sync.
+# A stall is a frame whose total latency, or gap since the previous frame arrived, is more
+# than --stall-factor times the median of its chunk and at least --stall-ms. Its cause is
+# the stage (or the client's send interval) furthest above its own median.
+# Both logs are read in chunks of --chunk records, so multi-hour runs take bounded memory,
+# and percentiles come from fixed 0.1 ms histograms.
+# Run from the repository root:
+#   `python -m analytics.frames CLIENT_LOG SERVER_LOG [--csv frames.csv] [--top 20]`
+#   `python -m analytics.frames DIR` pairs every server log in DIR with its stream's client log
+import argparse
+import glob
+import heapq
+import json
+import os
+import numpy as np
+from analytics.fields import columns_from_records, file_meta
+from logger import iter_logs
+
+STAGES = ['encode', 'send', 'network', 'receive', 'decode', 'total']
+CLIENT_COLUMNS = ['frame', 'session', 'client_send_start_time', 'client_send_duration', 'client_encode_duration', 'client_encode_in_send_duration']
+LOG_EXTENSIONS = ('.json', '.txt', '.ndjson', '.pkl')
+
+# Running distribution of one stage in fixed-width bins, so percentiles over any number of
+# frames take the same memory
+class Distribution:
+    def __init__(self, low=-10_000, high=60_000, width=0.1):
+        self.low = low
+        self.width = width
+        self.counts = np.zeros(int((high - low) / width) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.max = -np.inf
+
+    def add(self, values):
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        bins = np.clip(((values - self.low) / self.width).astype(np.int64), 0, len(self.counts) - 1)
+        self.counts += np.bincount(bins, minlength=len(self.counts))
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.max = max(self.max, float(values.max()))
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        idx = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.count))
+        return min(self.low + (idx + 0.5) * self.width, self.max)
+
+    def summary(self):
+        if not self.count:
+            return None
+        return {
+            'frames': self.count,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': self.max,
+            'mean_ms': self.sum / self.count,
+        }
+
+# A log's frame records as columns, `size` at a time. Client records after a
+# {'session_id': ...} record get that session.
+def column_chunks(path, size):
+    session = None
+    for records in iter_logs(path, size):
+        for record in records:
+            if 'session_id' in record:
+                session = record['session_id']
+            elif session is not None and 'client_send_start_time' in record:
+                record['session'] = session
+        columns, _ = columns_from_records(records)
+        if columns:
+            yield columns
+
+def column(columns, key, rows=None):
+    values = columns.get(key)
+    if values is None:
+        return np.full(len(next(iter(columns.values()))) if rows is None else len(rows), np.nan)
+    return values if rows is None else values[rows]
+
+def concat_columns(a, b):
+    if a is None:
+        return b
+    return {key: np.concatenate([a[key], b[key]]) for key in a}
+
+def select(columns, rows):
+    return {key: values[rows] for key, values in columns.items()}
+
+# Stage durations in ms for matched client and server rows
+def stages(client, server):
+    offset = column(server, 'clock_offset_ms') / 1000
+    send_start = server['client_send_start_time'] - np.where(np.isnan(offset), 0, offset)
+    recv_start, recv_end = server['server_recv_start_time'], server['server_recv_end_time']
+    decoded = column(server, 'server_decoded_time')
+    encode = client['client_encode_duration'] * 1000
+    # Only the part of the encode before the send started adds to the total
+    before_send = encode - np.nan_to_num(client['client_encode_in_send_duration'] * 1000)
+    done = np.where(np.isnan(decoded), recv_end, decoded)
+    return {
+        'encode': encode,
+        'send': client['client_send_duration'] * 1000,
+        'network': (recv_start - send_start) * 1000,
+        'receive': (recv_end - recv_start) * 1000,
+        'decode': (decoded - recv_end) * 1000,
+        'total': np.nan_to_num(before_send) + (done - send_start) * 1000,
+    }
+
+# Frames whose total or arrival gap is well above the chunk's median, with the stage that
+# is furthest above its own median
+def find_stalls(values, gap, interval, factor, min_ms):
+    def above(x):
+        median = np.nanmedian(x) if np.any(~np.isnan(x)) else np.nan
+        return (x > max(min_ms, factor * median)) if not np.isnan(median) else np.zeros(len(x), dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        stalled = above(values['total']) | above(gap)
+        candidates = {name: values[name] for name in ('encode', 'network', 'receive', 'decode')}
+        candidates['interval'] = interval
+        names = list(candidates)
+        excess = np.stack([x - np.nanmedian(x) if np.any(~np.isnan(x)) else np.full(len(x), np.nan) for x in candidates.values()])
+        excess = np.where(np.isnan(excess), -np.inf, excess)
+    causes = np.array(names)[np.argmax(excess, axis=0)] if len(gap) else np.array([], dtype=str)
+    return stalled, causes
+
+# Joins one client log with one server log chunk by chunk, returns the stage summaries,
+# counts and the `top` worst stalls. Per-frame rows go to `csv_file` if given.
+def breakdown(client_path, server_path, chunk_size=65536, stall_factor=3.0, stall_ms=100.0, top=20, csv_file=None):
+    session = file_meta(server_path, os.path.dirname(server_path))['session']
+    session = float(session) if session else None
+    distributions = {stage: Distribution() for stage in STAGES}
+    gap_distribution = Distribution()
+    counts = {'server_frames': 0, 'matched': 0, 'lost': 0, 'server_only': 0, 'stalls': 0, 'clock_corrected': 0}
+    stall_causes = {}
+    worst = []
+    first_key = None
+    last_arrival, last_send = np.nan, np.nan
+    client_chunks = column_chunks(client_path, chunk_size)
+    buffered = None
+    client_done = False
+    if csv_file:
+        csv_file.write('seq,client_send_start_time,' + ','.join(f'{stage}_ms' for stage in STAGES) + ',gap_ms,stall\n')
+
+    for server in column_chunks(server_path, chunk_size):
+        keys = server['client_send_start_time']
+        high = np.nanmax(keys)
+        first_key = np.nanmin(keys) if first_key is None else first_key
+        # Client rows up to the last frame in this server chunk
+        while not client_done and (buffered is None or not len(buffered['client_send_start_time']) or buffered['client_send_start_time'].max() < high):
+            chunk = next(client_chunks, None)
+            if chunk is None:
+                client_done = True
+                break
+            chunk = {key: column(chunk, key) for key in CLIENT_COLUMNS}
+            if session is not None and not np.all(np.isnan(chunk['session'])):
+                chunk = select(chunk, chunk['session'] == session)
+            buffered = concat_columns(buffered, chunk)
+        if buffered is None:
+            buffered = {key: np.empty(0) for key in CLIENT_COLUMNS}
+
+        _, client_rows, server_rows = np.intersect1d(buffered['client_send_start_time'], keys, return_indices=True)
+        order = np.argsort(server_rows)
+        client_rows, server_rows = client_rows[order], server_rows[order]
+        client_keys = buffered['client_send_start_time']
+        in_run = (client_keys >= first_key) & (client_keys <= high)
+        counts['server_frames'] += len(keys)
+        counts['matched'] += len(server_rows)
+        counts['lost'] += int(in_run.sum()) - len(client_rows)
+        counts['server_only'] += len(keys) - len(server_rows)
+
+        client, matched = select(buffered, client_rows), select(server, server_rows)
+        buffered = select(buffered, client_keys > high)
+        if not len(server_rows):
+            continue
+        counts['clock_corrected'] += int(np.sum(~np.isnan(column(matched, 'clock_offset_ms'))))
+        values = stages(client, matched)
+        for stage in STAGES:
+            distributions[stage].add(values[stage])
+
+        # Gaps carry over from the previous chunk
+        arrival = matched['server_recv_end_time']
+        send_start = matched['client_send_start_time']
+        gap = np.diff(arrival, prepend=last_arrival) * 1000
+        interval = np.diff(send_start, prepend=last_send) * 1000
+        last_arrival, last_send = arrival[-1], send_start[-1]
+        gap_distribution.add(gap)
+
+        stalled, causes = find_stalls(values, gap, interval, stall_factor, stall_ms)
+        counts['stalls'] += int(stalled.sum())
+        seq = column(matched, 'seq') if 'seq' in matched else matched['frame']
+        for idx in np.flatnonzero(stalled):
+            stall_causes[causes[idx]] = stall_causes.get(causes[idx], 0) + 1
+            stall = {'seq': int(seq[idx]), 'client_send_start_time': float(send_start[idx]), 'gap_ms': float(gap[idx]), 'cause': str(causes[idx])}
+            stall.update({f'{stage}_ms': float(values[stage][idx]) for stage in STAGES})
+            entry = (np.nan_to_num(max(values['total'][idx], gap[idx]), nan=-np.inf), counts['stalls'], stall)
+            if len(worst) < top:
+                heapq.heappush(worst, entry)
+            elif top:
+                heapq.heappushpop(worst, entry)
+
+        if csv_file:
+            labels = np.where(stalled, causes, '')
+            for row in zip(seq, send_start, *(values[stage] for stage in STAGES), gap, labels):
+                csv_file.write(f'{row[0]:.0f},{row[1]:.6f},' + ','.join('' if np.isnan(x) else f'{x:.3f}' for x in row[2:-1]) + f',{row[-1]}\n')
+
+    return {
+        'client_log': client_path,
+        'server_log': server_path,
+        **counts,
+        'stages': {stage: distributions[stage].summary() for stage in STAGES},
+        'gap': gap_distribution.summary(),
+        'stall_causes': stall_causes,
+        'worst_stalls': [stall for _, _, stall in sorted(worst, key=lambda entry: entry[:2], reverse=True)],
+    }
+
+# Every server log in `directory` with the client log of the same stream, if there is exactly one
+def pairs(directory):
+    logs = {'client': {}, 'server': []}
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if not path.endswith(LOG_EXTENSIONS):
+            continue
+        meta = file_meta(path, directory)
+        if meta['client']:
+            logs['server'].append((meta['stream'], path))
+        else:
+            logs['client'].setdefault(meta['stream'], []).append(path)
+    for stream, server_path in logs['server']:
+        clients = logs['client'].get(stream, [])
+        if len(clients) == 1:
+            yield clients[0], server_path
+        else:
+            print(f'Skipping {server_path}: {len(clients)} client logs for {stream}')
+
+def fmt(value, width, precision=1):
+    return f'{value:>{width}.{precision}f}' if value is not None else f'{"-":>{width}}'
+
+def print_breakdown(result):
+    print(f"{result['server_log']} <- {result['client_log']}")
+    print(f"  {result['matched']} of {result['server_frames']} frames joined, {result['lost']} lost, {result['server_only']} without a client record, "
+          f"{result['clock_corrected']} on the server's clock")
+    print(f'  {"":<8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"max ms":>9} {"mean ms":>8}')
+    for name, summary in list(result['stages'].items()) + [('gap', result['gap'])]:
+        summary = summary or {}
+        print(f'  {name:<8} ' + ' '.join(fmt(summary.get(key), width) for key, width in
+                                        (('p50_ms', 8), ('p95_ms', 8), ('p99_ms', 8), ('max_ms', 9), ('mean_ms', 8))))
+    causes = ', '.join(f'{cause} {count}' for cause, count in sorted(result['stall_causes'].items(), key=lambda item: -item[1]))
+    print(f"  {result['stalls']} stalls" + (f' ({causes})' if causes else ''))
+    if result['worst_stalls']:
+        print(f'  {"seq":>8} {"total ms":>9} {"gap ms":>8} {"encode":>7} {"network":>8} {"receive":>8} {"decode":>7}  cause')
+        for stall in result['worst_stalls']:
+            print(f"  {stall['seq']:>8} {fmt(stall['total_ms'], 9)} {fmt(stall['gap_ms'], 8)} " + ' '.join(
+                fmt(None if np.isnan(stall[f'{stage}_ms']) else stall[f'{stage}_ms'], width) for stage, width in
+                (('encode', 7), ('network', 8), ('receive', 8), ('decode', 7))) + f"  {stall['cause']}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logs', nargs='+', help='CLIENT_LOG SERVER_LOG, or directories')
+    parser.add_argument('--chunk', type=int, default=65536, help='records read at a time')
+    parser.add_argument('--stall-factor', type=float, default=3.0)
+    parser.add_argument('--stall-ms', type=float, default=100.0)
+    parser.add_argument('--top', type=int, default=10, help='worst stalls to list')
+    parser.add_argument('--csv', help='write every joined frame to this file, only with CLIENT_LOG SERVER_LOG')
+    parser.add_argument('--json', help='write the summaries to this file')
+    args = parser.parse_args()
+
+    if all(os.path.isdir(path) for path in args.logs):
+        jobs = [pair for directory in args.logs for pair in pairs(directory)]
+    elif len(args.logs) == 2:
+        jobs = [tuple(args.logs)]
+    else:
+        raise SystemExit('Expected CLIENT_LOG SERVER_LOG or directories')
+    if args.csv and len(jobs) != 1:
+        raise SystemExit('--csv needs a single CLIENT_LOG SERVER_LOG pair')
+
+    results = []
+    csv_file = open(args.csv, 'w') if args.csv else None
+    for client_path, server_path in jobs:
+        result = breakdown(client_path, server_path, args.chunk, args.stall_factor, args.stall_ms, args.top, csv_file)
+        print_breakdown(result)
+        results.append(result)
+    if csv_file:
+        csv_file.close()
+        print(f'Saved frames to {args.csv}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Saved breakdown to {args.json}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+# Summarises every streaming log under the given directories, per log file or grouped by
+# stream or codec, and joins each server log with the client log of the same stream in
+# the same directory on the frame index. Logs are parsed once and cached by LogStore, so
+# reruns over the whole tree only load arrays.
+# Run from the repository root: `python -m analytics.report [dirs ...] [--by file|stream|codec] [--json out.json]`
+import argparse
+import json
+import time
+from collections import defaultdict
+import numpy as np
+from analytics.store import LogStore
+
+DEFAULT_ROOTS = ['localhost-experiments', 'firefighter-experiments', 'energy-experiments']
+
+def percentile(values, q):
+    values = values[~np.isnan(values)] if values is not None else ()
+    return float(np.percentile(values, q)) if len(values) else None
+
+def mean(values):
+    values = values[~np.isnan(values)] if values is not None else ()
+    return float(values.mean()) if len(values) else None
+
+def concat(logs, key):
+    columns = [log.get(key) for log in logs if log.get(key) is not None]
+    return np.concatenate(columns) if columns else None
+
+# Frames per second over each log's own time span. Logs whose spans overlap are clients
+# streaming at the same time and their rates add up, separate runs (e.g. a _try2 of the same
+# stream) are averaged.
+def fps(logs, start_key, end_key):
+    spans = []
+    for log in logs:
+        start, end = log.get(start_key), log.get(end_key)
+        if start is None or end is None or len(log) < 2:
+            continue
+        start, end = np.nanmin(start), np.nanmax(end)
+        spans.append((start, end, len(log) / (end - start) if end > start else 0))
+    runs = [] # [end, summed fps] of each set of overlapping logs
+    for start, end, rate in sorted(spans):
+        if runs and start < runs[-1][0]:
+            runs[-1][0] = max(runs[-1][0], end)
+            runs[-1][1] += rate
+        else:
+            runs.append([end, rate])
+    return sum(rate for _, rate in runs) / len(runs) if runs else 0
+
+def server_metrics(logs):
+    latency = concat(logs, 'network_duration_ms')
+    corrected = concat(logs, 'corrected_network_duration_ms')
+    recv = concat(logs, 'server_recv_duration')
+    return {
+        'frames': sum(len(log) for log in logs),
+        'fps': fps(logs, 'server_recv_start_time', 'server_recv_end_time'),
+        'latency_p50_ms': percentile(latency, 50),
+        'latency_p95_ms': percentile(latency, 95),
+        'latency_p99_ms': percentile(latency, 99),
+        'corrected_latency_p50_ms': percentile(corrected, 50),
+        'bandwidth_p50_mbps': percentile(concat(logs, 'bandwidth_mbps'), 50),
+        'frame_size_kb': mean(concat(logs, 'frame_size_kb')),
+        'recv_duration_ms': mean(recv * 1000) if recv is not None else None,
+    }
+
+def client_metrics(logs):
+    send = concat(logs, 'client_send_duration')
+    return {
+        'frames': sum(len(log) for log in logs),
+        'fps': fps(logs, 'client_send_start_time', 'client_send_end_time'),
+        'send_p50_ms': percentile(send * 1000, 50) if send is not None else None,
+        'send_p99_ms': percentile(send * 1000, 99) if send is not None else None,
+    }
+
+# Server frames are matched to client frames by the send start time the client put in each
+# frame header, which the server logs back, so a client log holding several runs still
+# lines up. Logs without it fall back to the sequence number (older servers only logged
+# their own frame count, which matches while nothing is dropped). Frames the client sent
+# outside the server log's run don't count as lost.
+def join(client, server):
+    if server.get('client_send_start_time') is not None:
+        client_idx, server_idx = client['client_send_start_time'], server['client_send_start_time']
+        run = (client_idx >= np.nanmin(server_idx)) & (client_idx <= np.nanmax(server_idx))
+    else:
+        client_idx, server_idx = client['frame'], server.get('seq') if server.get('seq') is not None else server['frame']
+        run = np.ones(len(client), dtype=bool)
+    _, client_rows, server_rows = np.intersect1d(client_idx, server_idx, return_indices=True)
+    sent = int(run.sum())
+    send_end = client['client_send_end_time'][client_rows]
+    recv_end = server['server_recv_end_time'][server_rows]
+    return {
+        'frames_sent': sent,
+        'frames_received': len(server),
+        'frames_matched': len(client_rows),
+        'loss': 1 - len(client_rows) / sent if sent else None,
+        'send_end_to_recv_end_p50_ms': percentile((recv_end - send_end) * 1000, 50),
+    }
+
+def group_key(log, by):
+    if by == 'file':
+        return (log.meta['experiment'], log.meta['stream'], log.meta['client'] + (f"_{log.meta['session']}" if log.meta['session'] else '') + (f"_{log.meta['tag']}" if log.meta['tag'] else ''))
+    if by == 'stream':
+        return (log.meta['experiment'], log.meta['stream'], '')
+    return ('', log.meta['codec'], '')
+
+def report(logs, by):
+    groups = defaultdict(lambda: {'server': [], 'client': []})
+    for log in logs:
+        if len(log):
+            groups[group_key(log, by)][log.side].append(log)
+
+    # Pairs of client and server logs of one stream in one directory
+    pairs = defaultdict(list)
+    by_stream = defaultdict(lambda: {'server': [], 'client': []})
+    for log in logs:
+        if len(log):
+            by_stream[(log.meta['experiment'], log.meta['stream'])][log.side].append(log)
+    for (experiment, stream), sides in by_stream.items():
+        if len(sides['client']) == 1:
+            for server in sides['server']:
+                pairs[group_key(server, by)].append(join(sides['client'][0], server))
+
+    rows = []
+    for key in sorted(groups):
+        experiment, name, client = key
+        row = {'experiment': experiment, 'name': name, 'client': client}
+        if groups[key]['server']:
+            row.update({f'server_{k}': v for k, v in server_metrics(groups[key]['server']).items()})
+        if groups[key]['client']:
+            row.update({f'client_{k}': v for k, v in client_metrics(groups[key]['client']).items()})
+        if pairs.get(key):
+            joined = pairs[key]
+            sent = sum(j['frames_sent'] for j in joined)
+            matched = sum(j['frames_matched'] for j in joined)
+            row['join_loss'] = 1 - matched / sent if sent else None
+            row['join_send_end_to_recv_end_p50_ms'] = float(np.median([j['send_end_to_recv_end_p50_ms'] for j in joined if j['send_end_to_recv_end_p50_ms'] is not None] or [np.nan]))
+        rows.append(row)
+    return rows
+
+def fmt(value, width, precision=1):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return f'{"-":>{width}}'
+    return f'{value:>{width}.{precision}f}' if isinstance(value, float) else f'{value:>{width}}'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('roots', nargs='*', default=DEFAULT_ROOTS, help='directories or log files')
+    parser.add_argument('--by', choices=['file', 'stream', 'codec'], default='stream')
+    parser.add_argument('--cache', default='.analytics_cache', help='where parsed logs are kept')
+    parser.add_argument('--json', help='write the rows to this file')
+    args = parser.parse_args()
+
+    start = time.time()
+    store = LogStore(args.cache)
+    logs = store.load_tree(args.roots)
+    rows = report(logs, args.by)
+    elapsed = time.time() - start
+
+    columns = [('server_frames', 'frames', 7, 0), ('server_fps', 'fps', 6, 1), ('server_latency_p50_ms', 'p50 ms', 8, 1),
+               ('server_latency_p99_ms', 'p99 ms', 8, 1), ('server_bandwidth_p50_mbps', 'Mbps', 8, 1), ('server_frame_size_kb', 'KB', 7, 1),
+               ('client_frames', 'sent', 6, 0), ('client_send_p50_ms', 'send ms', 8, 2), ('join_loss', 'loss', 6, 3)]
+    width = max([len(f"{row['experiment']}/{row['name']} {row['client']}".strip()) for row in rows] + [10])
+    print(f'{"":<{width}} ' + ' '.join(f'{title:>{w}}' for _, title, w, _ in columns))
+    for row in rows:
+        label = '/'.join(part for part in (row['experiment'], row['name']) if part) + (f' {row["client"]}' if row['client'] else '')
+        print(f'{label:<{width}} ' + ' '.join(fmt(row.get(key), w, p) for key, _, w, p in columns))
+    print(f'{len(logs)} logs ({store.parsed} parsed, {store.cached} from cache) in {elapsed:.2f} s')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+        print(f'Saved report to {args.json}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import glob
+import hashlib
+import json
+import os
+import numpy as np
+from analytics.fields import columns_from_records, file_meta, log_side
+from logger import read_logs
+
+LOG_EXTENSIONS = ('.json', '.txt', '.ndjson', '.pkl')
+
+# One parsed log file: `meta` from its path (experiment directory, stream, codec, client,
+# session), `side` 'client' or 'server', per-frame `columns` of float64 arrays and the
+# `summary` fields of its other records
+class Log:
+    def __init__(self, meta, columns, summary):
+        self.meta = meta
+        self.columns = columns
+        self.summary = summary
+        self.side = log_side(columns)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def get(self, key):
+        return self.columns.get(key)
+
+# Parses each log file once and keeps its columns in `cache_dir` as an .npz, keyed by the
+# file's path and checked against its mtime and size, so later runs only load arrays.
+# Files that turn out not to be logs are remembered too.
+class LogStore:
+    def __init__(self, cache_dir='.analytics_cache'):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.parsed = 0
+        self.cached = 0
+
+    def cache_path(self, path):
+        return os.path.join(self.cache_dir, hashlib.sha1(os.path.abspath(path).encode()).hexdigest() + '.npz')
+
+    def load(self, path, root):
+        meta = file_meta(path, root)
+        stat = os.stat(path)
+        version = [stat.st_mtime_ns, stat.st_size]
+        cache_path = self.cache_path(path)
+        if os.path.exists(cache_path):
+            with np.load(cache_path) as cached:
+                header = json.loads(str(cached['__header__']))
+                if header['version'] == version:
+                    self.cached += 1
+                    if header['summary'] is None:
+                        return None
+                    return Log(meta, {key: cached[key] for key in cached.files if key != '__header__'}, header['summary'])
+
+        self.parsed += 1
+        try:
+            records = read_logs(path)
+        except (ValueError, UnicodeDecodeError):
+            records = None
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            columns, summary = {}, None
+        else:
+            columns, summary = columns_from_records(records)
+            if not columns and not summary:
+                summary = None
+        header = json.dumps({'version': version, 'summary': summary}, default=float)
+        np.savez(cache_path, __header__=np.array(header), **columns)
+        return Log(meta, columns, summary) if summary is not None else None
+
+    # Every log under `roots`, in path order
+    def load_tree(self, roots):
+        logs = []
+        for root in roots:
+            paths = [root] if os.path.isfile(root) else sorted(glob.glob(os.path.join(root, '**', '*'), recursive=True))
+            # Experiments are named from the root's own directory down, e.g. localhost-experiments/1-bo
+            root_dir = os.path.dirname(os.path.dirname(root) if os.path.isfile(root) else os.path.normpath(root))
+            for path in paths:
+                if path.endswith(LOG_EXTENSIONS) and os.path.isfile(path):
+                    log = self.load(path, root_dir)
+                    if log is not None:
+                        logs.append(log)
+        return logs
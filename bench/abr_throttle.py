@@ -0,0 +1,138 @@
+# Fixed MJPEG quality against AbrController over a simulated link. A proxy on localhost
+# forwards the camera's frames to the asyncio ingest server at a bandwidth that changes
+# every --seconds (--mbps), acks flow back unthrottled. The camera's send buffer is kept
+# small so a slow link shows up as queueing delay, like a real uplink, instead of
+# disappearing into megabytes of kernel buffer. Reports per link phase the delivery
+# latency from the acks, mean JPEG quality, frames delivered per second and goodput.
+# Run from the repository root: `python -m bench.abr_throttle [--mbps 40,8,20] [--seconds 10] [--target 0.2]`
+import argparse
+import asyncio
+import socket
+import threading
+import time
+import numpy as np
+from abr import AbrController
+from bench.common import free_port, quiet, scratch_dir, synthetic_frame
+from ingest import serve_async
+from streamers.mjpeg import Mjpeg
+
+SEND_BUFFER = 256 * 1024
+
+# Forwards one connection at a time from `port` to `target_port`. The client to server
+# direction goes through a token bucket refilled at `mbps`, which can be changed while
+# running.
+class ThrottledProxy:
+    def __init__(self, port, target_port, mbps):
+        self.target_port = target_port
+        self.mbps = mbps
+        self.listener = socket.create_server(('localhost', port))
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+            server = socket.create_connection(('localhost', self.target_port))
+            threading.Thread(target=self.pump, args=(client, server, True), daemon=True).start()
+            threading.Thread(target=self.pump, args=(server, client, False), daemon=True).start()
+
+    def pump(self, src, dst, throttled):
+        tokens, last = 0, time.monotonic()
+        try:
+            while True:
+                data = src.recv(16 * 1024)
+                if not data:
+                    break
+                if throttled:
+                    # Wait until the link has had time to carry this chunk
+                    now = time.monotonic()
+                    tokens = min(tokens + (now - last) * self.mbps * 1e6 / 8, 64 * 1024)
+                    last = now
+                    tokens -= len(data)
+                    if tokens < 0:
+                        time.sleep(-tokens / (self.mbps * 1e6 / 8))
+                dst.sendall(data)
+        except OSError:
+            pass
+        for sock in (src, dst):
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+# Records every ack with the settings it was measured under
+class RecordingController(AbrController):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.samples = []
+
+    def on_ack(self, ack, now):
+        start_time = self.sent.get(ack.seq)
+        super().on_ack(ack, now)
+        if start_time is not None:
+            self.samples.append((now, now - start_time, self.quality, ack.a))
+
+def run(mode, proxy, port, schedule, seconds, target, quality, fps):
+    frames = [synthetic_frame(1920, 960, seed=seed) for seed in range(4)]
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+    sock.connect(('localhost', port))
+    streamer = Mjpeg(sock, qf=quality)
+    streamer.handshake(1920, 960, fps)
+    if mode == 'fixed':
+        controller = RecordingController(streamer, target, fps=fps, min_quality=quality, max_quality=quality, min_fps=fps)
+    else:
+        controller = RecordingController(streamer, target, fps=fps)
+    controller.start()
+
+    phases = []
+    start = time.time()
+    for mbps in schedule:
+        proxy.mbps = mbps
+        phase_start = time.time()
+        while time.time() - phase_start < seconds:
+            frame_start = time.time()
+            streamer.send_frame(frames[streamer.send_frame_idx % len(frames)])
+            time.sleep(max(0, 1.0 / controller.fps - (time.time() - frame_start)))
+        phases.append((mbps, phase_start - start, time.time() - start))
+    time.sleep(1) # let the last acks in
+    sock.close()
+
+    samples = np.array(controller.samples)
+    samples[:, 0] -= start
+    results = []
+    for mbps, phase_start, phase_end in phases:
+        phase = samples[(samples[:, 0] >= phase_start) & (samples[:, 0] < phase_end)]
+        if not len(phase):
+            results.append((mbps, np.nan, np.nan, np.nan, 0, 0))
+            continue
+        latency = phase[:, 1] * 1000
+        duration = phase_end - phase_start
+        results.append((mbps, latency.mean(), np.percentile(latency, 95), phase[:, 2].mean(), len(phase) / duration, phase[:, 3].sum() * 8 / 1e6 / duration))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mbps', default='40,8,20', help='link bandwidth of each phase')
+    parser.add_argument('--seconds', type=float, default=10, help='length of each phase')
+    parser.add_argument('--target', type=float, default=0.2, help='target latency in seconds')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG quality, fixed or starting')
+    parser.add_argument('--fps', type=int, default=10)
+    args = parser.parse_args()
+    schedule = [float(mbps) for mbps in args.mbps.split(',')]
+
+    server_port, proxy_port = free_port(), free_port()
+    started = threading.Event()
+    with scratch_dir(), quiet():
+        threading.Thread(target=asyncio.run, args=(serve_async('localhost', server_port, save_frames=False, started=started),), daemon=True).start()
+        started.wait()
+        proxy = ThrottledProxy(proxy_port, server_port, schedule[0])
+        results = {mode: run(mode, proxy, proxy_port, schedule, args.seconds, args.target, args.quality, args.fps) for mode in ['fixed', 'abr']}
+
+    print(f'{"mode":>6} {"link Mbps":>10} {"mean ms":>8} {"p95 ms":>7} {"quality":>8} {"fps":>5} {"Mbps":>6}')
+    for mode, phases in results.items():
+        for mbps, mean, p95, quality, fps, goodput in phases:
+            print(f'{mode:>6} {mbps:>10.0f} {mean:>8.0f} {p95:>7.0f} {quality:>8.1f} {fps:>5.1f} {goodput:>6.1f}')
+
+if __name__ == '__main__':
+    main()
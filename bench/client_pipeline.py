@@ -0,0 +1,69 @@
+# Serial capture/encode/send loop against ClientPipeline, at fixed JPEG quality over the
+# throttled localhost link from bench.abr_throttle. The link is slower than the camera's
+# frame rate needs. With the system's send buffer, the serial loop keeps handing frames to
+# the kernel and they queue there. The pipeline holds at most --in-flight unacked frames
+# and skips stale captures instead. Reports frames sent per second, frames dropped by each
+# stage, and capture to send / capture to ack latency.
+# With one CPU, encoding competes with the in-process server's decoding, so the overlap
+# of encode and send gains little frame rate here.
+# Run from the repository root: `python -m bench.client_pipeline [--mbps 30] [--seconds 15] [--in-flight 2] [--send-buffer 0]`
+import argparse
+import asyncio
+import socket
+import threading
+from abr import AbrController
+from bench.abr_throttle import ThrottledProxy
+from bench.common import free_port, quiet, scratch_dir, synthetic_frame
+from ingest import serve_async
+from pipeline import ClientPipeline
+from streamers.mjpeg import Mjpeg
+
+def run(pipelined, port, seconds, quality, fps, in_flight, send_buffer):
+    frames = [synthetic_frame(seed=seed) for seed in range(4)]
+    sock = socket.socket()
+    if send_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, send_buffer)
+    sock.connect(('localhost', port))
+    streamer = Mjpeg(sock, qf=quality)
+    streamer.handshake(frames[0].shape[1], frames[0].shape[0], fps)
+    # Fixed settings, the controller is only there for the acks
+    AbrController(streamer, fps=fps, min_quality=quality, max_quality=quality, min_fps=fps).start()
+
+    count = [0]
+    def read_frame():
+        count[0] += 1
+        return frames[count[0] % len(frames)]
+
+    pipeline = ClientPipeline(streamer, read_frame, fps=fps, pipelined=pipelined, max_in_flight=in_flight)
+    pipeline.run(seconds)
+    sock.close()
+    stats = pipeline.stats()
+    stats['Frames sent per second'] = stats['Frames sent'] / seconds
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mbps', type=float, default=30, help='link bandwidth')
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--in-flight', type=int, default=2, help='unacked frames the pipeline allows')
+    parser.add_argument('--send-buffer', type=int, default=0, help='SO_SNDBUF in bytes, 0 for the system default')
+    args = parser.parse_args()
+
+    server_port, proxy_port = free_port(), free_port()
+    started = threading.Event()
+    with scratch_dir(), quiet():
+        threading.Thread(target=asyncio.run, args=(serve_async('localhost', server_port, save_frames=False, started=started),), daemon=True).start()
+        started.wait()
+        ThrottledProxy(proxy_port, server_port, args.mbps)
+        results = {mode: run(mode == 'pipelined', proxy_port, args.seconds, args.quality, args.fps, args.in_flight, args.send_buffer) for mode in ['serial', 'pipelined']}
+
+    keys = ['Frames sent per second', 'Frames dropped before encode', 'Frames dropped before send',
+            'Mean capture to send ms', 'Mean capture to ack ms', 'P95 capture to ack ms']
+    print(f'{"":>30} {"serial":>10} {"pipelined":>10}')
+    for key in keys:
+        print(f'{key:>30} {results["serial"][key]:>10.1f} {results["pipelined"][key]:>10.1f}')
+
+if __name__ == '__main__':
+    main()
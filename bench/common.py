@@ -0,0 +1,61 @@
+import contextlib
+import io
+import numpy as np
+import os
+import socket
+import tempfile
+import threading
+import time
+
+VID_HEIGHT = 1920
+VID_WIDTH = 3840
+
+def synthetic_frame(width=VID_WIDTH, height=VID_HEIGHT, seed=0):
+    # Smooth gradients plus a little noise so codecs behave roughly like they do on real footage
+    rng = np.random.default_rng(seed)
+    ys, xs = np.indices((height, width), dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (xs / width * 255).astype(np.uint8)
+    frame[..., 1] = (ys / height * 255).astype(np.uint8)
+    frame[..., 2] = (128 + 127 * np.sin(xs / 40) * np.cos(ys / 40)).astype(np.uint8)
+    frame += rng.integers(0, 8, size=frame.shape, dtype=np.uint8)
+    return frame
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def connect(port, timeout=5):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return socket.create_connection(('localhost', port))
+        except OSError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+
+@contextlib.contextmanager
+def quiet():
+    # The streamers print on every frame, keep that out of the benchmark output
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+@contextlib.contextmanager
+def scratch_dir():
+    # Streamer loggers write into the working directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            yield tmp
+        finally:
+            os.chdir(cwd)
+
+def run_threads(targets):
+    threads = [threading.Thread(target=target, daemon=True) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
@@ -0,0 +1,68 @@
+# Aggregate decode throughput for `--cameras` concurrent 4K MJPEG streams, decoded on the
+# cameras' threads in the ingest process (as server.py does by default) against a
+# DecodePool with 1, 2, 4... worker processes up to the core count. Each camera thread
+# hands its payload over and waits for the decoded frame, like a connection handler.
+# Reports frames per second, the mean per-frame decode time and how many frames fell back
+# to decoding in process. Aggregate FPS should rise with the number of workers until it
+# runs out of cores.
+# Run from the repository root: `python -m bench.decode_scaling [--cameras 8] [--seconds 5] [--workers 1,2,4]`
+import argparse
+import os
+import time
+import numpy as np
+from bench.common import synthetic_frame, run_threads
+from decode_pool import DecodePool
+from streamers import mjpeg
+from streamers.protocol import FrameHeader, CODEC_MJPEG
+
+def run(decode, cameras, seconds, payloads, header):
+    counts = [0] * cameras
+    deadline = time.time() + seconds
+
+    def camera(idx):
+        def loop():
+            while time.time() < deadline:
+                frame = decode(header, payloads[counts[idx] % len(payloads)])
+                assert frame is not None and frame.shape == (header.height, header.width, 3)
+                counts[idx] += 1
+        return loop
+
+    start = time.time()
+    run_threads([camera(idx) for idx in range(cameras)])
+    return sum(counts) / (time.time() - start)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--quality', type=int, default=90)
+    parser.add_argument('--workers', default=None, help='comma separated worker counts, default powers of two up to the core count')
+    args = parser.parse_args()
+
+    cores = os.cpu_count()
+    workers = [int(n) for n in args.workers.split(',')] if args.workers else [2 ** i for i in range(cores.bit_length()) if 2 ** i <= cores]
+    streamer = mjpeg.Mjpeg(None, qf=args.quality)
+    frames = [synthetic_frame(seed=seed) for seed in range(4)]
+    payloads = [streamer.encode(frame) for frame in frames]
+    height, width = frames[0].shape[:2]
+    header = FrameHeader(CODEC_MJPEG, args.quality, 1, 1, 0, width, height, 0, 0.0, len(payloads[0]))
+    print(f'{cores} cores, {args.cameras} cameras, {np.mean([len(p) for p in payloads]) / 1000:.0f} KB frames')
+
+    # Same pixels either way
+    pool = DecodePool(1)
+    assert np.array_equal(pool.decode(streamer, header, payloads[0]), streamer.decode(payloads[0], header))
+    pool.close()
+
+    print(f'{"decoder":>12} {"frames/s":>10} {"decode ms":>10} {"in process":>11}')
+    fps = run(lambda header, payload: streamer.decode(payload, header), args.cameras, args.seconds, payloads, header)
+    print(f'{"threads":>12} {fps:>10.1f} {"":>10} {"":>11}')
+    for num_workers in workers:
+        # Each camera holds its last frame while the next one decodes
+        pool = DecodePool(num_workers, slots=2 * args.cameras + num_workers)
+        fps = run(lambda header, payload: pool.decode(streamer, header, payload), args.cameras, args.seconds, payloads, header)
+        stats = pool.stats()
+        pool.close()
+        print(f'{f"{num_workers} workers":>12} {fps:>10.1f} {stats["mean_decode_ms"]:>10.1f} {stats["frames_decoded_in_process"]:>11}')
+
+if __name__ == '__main__':
+    main()
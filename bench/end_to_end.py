@@ -0,0 +1,214 @@
+# End-to-end run of the whole streaming path on localhost. For every codec and client
+# count, N clients stream at --fps through ClientPipeline to the asyncio ingest server that
+# `server.py --async` runs. server.py itself also needs Flask and YOLO, and its ingest path
+# is the same. Frames are synthetic 3840x1920 ones, or the first --clip-frames of --clip,
+# and the server decodes them and drops them without saving.
+# Per row it reports:
+# - throughput: frames/s decoded by the server, over all clients
+# - latency p50/p99: client send start to frame decoded on the server, one clock
+# - cpu ms/frame: CPU time of the clients, server and decode workers per decoded frame
+# - KB/frame: compressed size from the server logs
+# - drops: frames the clients' pipelines skipped to keep up
+# With --json the rows are written with the commit and machine they came from. Passing an
+# earlier file as --baseline prints each metric's change against it, to compare commits.
+# Run from the repository root: `python -m bench.end_to_end [--codecs mjpeg50,tiled] [--clients 1,4] [--fps 10] [--seconds 10] [--json results.json] [--baseline old.json]`
+import argparse
+import asyncio
+import glob
+import json
+import os
+import resource
+import subprocess
+import threading
+import time
+import cv2
+import numpy as np
+import ingest
+from bench.common import VID_WIDTH, VID_HEIGHT, free_port, connect, quiet, scratch_dir, synthetic_frame, run_threads
+from decode_pool import DecodePool
+from logger import read_logs
+from pipeline import ClientPipeline
+from streamers import basic, mjpeg, tile_spatial, webp
+from streamers.protocol import FrameHeader
+
+CODECS = {
+    'basic': lambda sock, width, height, fps: basic.Basic(sock),
+    'mjpeg30': lambda sock, width, height, fps: mjpeg.Mjpeg(sock, qf=30),
+    'mjpeg50': lambda sock, width, height, fps: mjpeg.Mjpeg(sock, qf=50),
+    'mjpeg90': lambda sock, width, height, fps: mjpeg.Mjpeg(sock, qf=90),
+    'webp50': lambda sock, width, height, fps: webp.Webp(sock, qf=50),
+    'tiled': lambda sock, width, height, fps: tile_spatial.TileSpatial(sock),
+}
+if ingest.h264 is not None: # ffenc/ffdec extensions built on this machine
+    CODECS['h264'] = lambda sock, width, height, fps: ingest.h264.H264(sock, width, height, fps)
+
+METRICS = ['throughput_fps', 'latency_p50_ms', 'latency_p99_ms', 'cpu_ms_per_frame', 'kb_per_frame', 'frames_dropped']
+
+def load_frames(clip, clip_frames, width, height):
+    if not clip:
+        return [synthetic_frame(width, height, seed=seed) for seed in range(4)]
+    cap = cv2.VideoCapture(clip)
+    frames = []
+    while len(frames) < clip_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(cv2.resize(frame, (width, height)) if frame.shape[:2] != (height, width) else frame)
+    cap.release()
+    if not frames:
+        raise SystemExit(f'Could not read any frames from {clip}')
+    return frames
+
+# This process plus the DecodePool workers, which getrusage only counts once they exit
+def cpu_time(decode_pool=None):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    total = usage.ru_utime + usage.ru_stime
+    for process in decode_pool.processes if decode_pool else []:
+        with open(f'/proc/{process.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return total
+
+class Collector:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.latencies = []
+        self.camera_ids = set()
+        self.disconnected = 0
+
+    def on_frame(self, camera_id, frame, densities, timestamp):
+        now = time.time()
+        with self.lock:
+            self.latencies.append(now - timestamp)
+            self.camera_ids.add(camera_id)
+
+    def on_disconnect(self, camera_id):
+        with self.lock:
+            self.disconnected += 1
+
+def run(codec, num_clients, frames, fps, seconds, port, collector, decode_pool):
+    height, width = frames[0].shape[:2]
+    pipelines = []
+
+    def client():
+        sock = connect(port)
+        streamer = CODECS[codec](sock, width, height, fps)
+        streamer.handshake(width, height, fps)
+        count = [0]
+        def read_frame():
+            count[0] += 1
+            return frames[count[0] % len(frames)]
+        pipeline = ClientPipeline(streamer, read_frame, fps=fps)
+        pipelines.append(pipeline)
+        pipeline.run(seconds)
+        sock.close()
+
+    collector.reset()
+    cpu_start, start = cpu_time(decode_pool), time.time()
+    run_threads([client] * num_clients)
+    # Until the server has decoded everything that was sent and closed every session
+    while collector.disconnected < num_clients:
+        time.sleep(0.01)
+    elapsed, cpu = time.time() - start, cpu_time(decode_pool) - cpu_start
+
+    sizes = []
+    for camera_id in collector.camera_ids:
+        for log_path in glob.glob(f'*_logs_{camera_id}.ndjson'):
+            sizes += [record['frame_size_kb'] for record in read_logs(log_path) if 'frame_size_kb' in record]
+    latencies = np.array(collector.latencies) * 1000
+    num_frames = len(latencies)
+    return {
+        'codec': codec,
+        'clients': num_clients,
+        'target_fps': fps,
+        'frames': num_frames,
+        'throughput_fps': num_frames / elapsed,
+        'latency_p50_ms': float(np.percentile(latencies, 50)) if num_frames else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99)) if num_frames else None,
+        'cpu_ms_per_frame': cpu / num_frames * 1000 if num_frames else None,
+        'kb_per_frame': float(np.mean(sizes)) if sizes else None,
+        'frames_dropped': sum(p.to_encode.dropped + p.to_send.dropped for p in pipelines),
+    }
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def change(value, baseline):
+    if value is None or not baseline:
+        return ''
+    return f'{(value - baseline) / baseline * 100:+.0f}%'
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--codecs', default=','.join(CODECS), help=f'comma separated, from {",".join(CODECS)}')
+    parser.add_argument('--clients', default='1,4', help='comma separated client counts')
+    parser.add_argument('--fps', type=float, default=10, help='per-client frame rate')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--width', type=int, default=VID_WIDTH)
+    parser.add_argument('--height', type=int, default=VID_HEIGHT)
+    parser.add_argument('--clip', help='video file to replay instead of synthetic frames')
+    parser.add_argument('--clip-frames', type=int, default=30)
+    parser.add_argument('--decode-workers', type=int, default=0, help='decode MJPEG/WebP in a DecodePool with this many processes')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    args = parser.parse_args()
+
+    codecs = args.codecs.split(',')
+    for codec in codecs:
+        if codec not in CODECS:
+            raise SystemExit(f'Unknown or unavailable codec {codec}, expected one of {", ".join(CODECS)}')
+    frames = load_frames(args.clip, args.clip_frames, args.width, args.height)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {(row['codec'], row['clients']): row for row in json.load(f)['results']}
+
+    decode_pool = None
+    if args.decode_workers:
+        decode_pool = DecodePool(args.decode_workers)
+        # Waits for the workers to start up, so that doesn't count as latency
+        warmup = mjpeg.Mjpeg(None)
+        for _ in range(args.decode_workers):
+            decode_pool.decode(warmup, FrameHeader(warmup.codec, 0, 1, 1, 0, args.width, args.height, 0, 0.0, 0), warmup.encode(frames[0]))
+    collector = Collector()
+    port = free_port()
+    started = threading.Event()
+    results = []
+    print(f'{"codec":>8} {"clients":>8} {"frames/s":>9} {"p50 ms":>8} {"p99 ms":>8} {"cpu ms/frame":>13} {"KB/frame":>9} {"drops":>6}')
+    with scratch_dir():
+        with quiet():
+            threading.Thread(target=asyncio.run, args=(ingest.serve_async('localhost', port, on_frame=collector.on_frame, on_disconnect=collector.on_disconnect,
+                                                                          save_frames=False, started=started, decode_pool=decode_pool),), daemon=True).start()
+            started.wait()
+        for codec in codecs:
+            for num_clients in map(int, args.clients.split(',')):
+                with quiet():
+                    row = run(codec, num_clients, frames, args.fps, args.seconds, port, collector, decode_pool)
+                results.append(row)
+                fmt = lambda key, width, precision: f'{row[key]:>{width}.{precision}f}' if row[key] is not None else f'{"-":>{width}}'
+                print(f'{codec:>8} {num_clients:>8} {fmt("throughput_fps", 9, 1)} {fmt("latency_p50_ms", 8, 1)} {fmt("latency_p99_ms", 8, 1)} '
+                      f'{fmt("cpu_ms_per_frame", 13, 1)} {fmt("kb_per_frame", 9, 0)} {row["frames_dropped"]:>6}')
+                if (codec, num_clients) in baseline:
+                    print(f'{"vs base":>17} ' + ' '.join(f'{key}={change(row[key], baseline[(codec, num_clients)].get(key))}' for key in METRICS))
+    if decode_pool:
+        decode_pool.close()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'commit': commit(),
+                'time': time.time(),
+                'cores': os.cpu_count(),
+                'args': vars(args),
+                'results': results,
+            }, f, indent=2)
+        print(f'Saved results to {args.json}')
+
+if __name__ == '__main__':
+    main()
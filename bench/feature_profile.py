@@ -0,0 +1,49 @@
+# Cost of TileSpatial's compression profile per frame: the three calculate_*_density
+# functions (each resizing and converting the frame on its own) against the
+# fused calculate_compression_profile, plus the largest difference between the two.
+# Run from the repository root: `python -m bench.feature_profile [--grids 2x4,3x6,4x8] [--frames 20]`
+import argparse
+import statistics
+import time
+import numpy as np
+from bench.common import synthetic_frame
+from feature import calculate_compression_profile, calculate_edge_density, calculate_corner_density, calculate_contour_density
+
+# calculate_compression_profile before the feature maps shared one preprocessing pass
+def separate_profile(frame, num_rows, num_cols):
+    edge_density = calculate_edge_density(frame, num_rows, num_cols)
+    corner_density = calculate_corner_density(frame, num_rows, num_cols)
+    contour_density = calculate_contour_density(frame, num_rows, num_cols)
+    return np.mean(np.array([edge_density, corner_density, contour_density]), axis=0)
+
+def measure(profile, frame, num_rows, num_cols, num_frames):
+    profile(frame, num_rows, num_cols) # warm up
+    times = []
+    for _ in range(num_frames):
+        start = time.perf_counter()
+        result = profile(frame, num_rows, num_cols)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grids', default='2x4,3x6,4x8,7x9')
+    parser.add_argument('--frames', type=int, default=20)
+    args = parser.parse_args()
+
+    frames = [synthetic_frame(seed=seed) for seed in range(3)]
+    print(f'{"grid":>6} {"separate ms":>12} {"fused ms":>9} {"speedup":>8} {"max diff":>9}')
+    for grid in args.grids.split(','):
+        rows, cols = map(int, grid.split('x'))
+        separate_ms, fused_ms, max_diff = [], [], 0
+        for frame in frames:
+            ms, expected = measure(separate_profile, frame, rows, cols, args.frames)
+            separate_ms.append(ms)
+            ms, result = measure(calculate_compression_profile, frame, rows, cols, args.frames)
+            fused_ms.append(ms)
+            max_diff = max(max_diff, np.abs(result - expected).max())
+        separate, fused = statistics.median(separate_ms), statistics.median(fused_ms)
+        print(f'{grid:>6} {separate:>12.2f} {fused:>9.2f} {separate / fused:>8.2f} {max_diff:>9.1e}')
+
+if __name__ == '__main__':
+    main()
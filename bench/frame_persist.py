@@ -0,0 +1,86 @@
+# Server receive loop with frame saving for an MJPEG camera replayed over a socketpair:
+# the old synchronous cv2.imwrite per frame against FrameWriter re-encoding to JPEG, and
+# recording the received payloads ('raw' files or a 'segment') with or without decoding
+# them. "recv fps" is how fast the loop gets through the frames, "loop cpu ms" the CPU time
+# the receive thread spends per frame, "total s" includes waiting for the writers.
+# Run from the repository root: `python -m bench.frame_persist [--frames 60] [--workers 2]`
+import argparse
+import socket
+import threading
+import time
+import cv2
+from bench.common import quiet, scratch_dir, synthetic_frame
+from persist import FrameWriter, SegmentReader
+from streamers.framing import FrameSender
+from streamers.mjpeg import Mjpeg
+
+def sender(sock, payload, num_frames):
+    streamer = Mjpeg(sock, qf=90)
+    frame_sender = FrameSender(sock)
+    frame = synthetic_frame()
+    for seq in range(num_frames):
+        streamer.send_frame_idx = seq
+        frame_sender.send([streamer.pack_header(frame, time.time(), len(payload)), payload])
+
+def measure(mode, payload, num_frames, workers, policy, lazy):
+    send_sock, recv_sock = socket.socketpair()
+    thread = threading.Thread(target=sender, args=(send_sock, payload, num_frames), daemon=True)
+    thread.start()
+    streamer = Mjpeg(recv_sock)
+    frame_writer = None
+    if mode != 'imwrite':
+        frame_writer = FrameWriter(f'./{mode}_{policy}_{lazy}/', fmt=mode, workers=workers, policy=policy)
+
+    start = time.perf_counter()
+    start_cpu = time.thread_time()
+    for frame_idx in range(num_frames):
+        frame = streamer.get_lazy_frame() if lazy else streamer.get_frame()
+        if frame_writer:
+            frame_writer.submit(frame_idx, frame, streamer.last_header, streamer.last_payload, streamer.frame_reused)
+        else:
+            cv2.imwrite(f'./{frame_idx}.jpg', frame)
+    recv_time = time.perf_counter() - start
+    recv_cpu = time.thread_time() - start_cpu
+    stats = {}
+    if frame_writer:
+        frame_writer.close()
+        stats = frame_writer.stats()
+    total_time = time.perf_counter() - start
+
+    thread.join()
+    send_sock.close()
+    recv_sock.close()
+    if mode == 'segment':
+        reader = SegmentReader(f'./{mode}_{policy}_{lazy}/')
+        assert len(reader) == num_frames and reader.read(0)[1] == payload
+        reader.close()
+    return num_frames / recv_time, recv_cpu / num_frames, total_time, stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--quality', type=int, default=90)
+    args = parser.parse_args()
+
+    payload = Mjpeg(None, qf=args.quality).encode(synthetic_frame())
+    print(f'{"saving":>21} {"recv fps":>9} {"loop cpu ms":>12} {"total s":>8} {"written":>8} {"dropped":>8} {"max depth":>10} {"mean lat ms":>12}')
+    with scratch_dir():
+        configs = [
+            ('imwrite', '-', False),
+            ('jpg', 'block', False),
+            ('jpg', 'drop', False),
+            ('raw', 'block', False),
+            ('raw', 'block', True),
+            ('segment', 'block', True),
+        ]
+        for mode, policy, lazy in configs:
+            with quiet():
+                fps, cpu, total, stats = measure(mode, payload, args.frames, args.workers, policy, lazy)
+            name = f'{mode} {policy}' + (' lazy' if lazy else '')
+            print(f'{name:>21} {fps:>9.1f} {cpu * 1000:>12.1f} {total:>8.2f} {stats.get("Frames written", args.frames):>8} '
+                  f'{stats.get("Frames not written (queue full)", 0):>8} {stats.get("Max write queue depth", 0):>10} '
+                  f'{stats.get("Mean write latency", 0) * 1000:>12.1f}')
+
+if __name__ == '__main__':
+    main()
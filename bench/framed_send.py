@@ -0,0 +1,128 @@
+# Send-path benchmark: the old one-sendall-per-field framing against FrameSender's single
+# sendmsg, for a single-payload frame (MJPEG) and a 2x4 tiled frame. Latency is a
+# ping-pong over localhost TCP (send a frame, wait for the receiver's one byte reply),
+# which is where Nagle plus delayed ACKs show up.
+# Run from the repository root: `python -m bench.framed_send [--frames 200]`
+import argparse
+import socket
+import statistics
+import struct
+import threading
+import time
+from bench.common import synthetic_frame
+from streamers import mjpeg, tile_spatial
+from streamers.framing import FrameSender
+from streamers.protocol import FRAME_HEADER, TILE_HEADER, CODEC_MJPEG, CODEC_TILED
+
+class CountingSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+    def sendall(self, data):
+        self.calls += 1
+        return self.sock.sendall(data)
+
+    def sendmsg(self, buffers):
+        self.calls += 1
+        return self.sock.sendmsg(buffers)
+
+    def setsockopt(self, *args):
+        self.calls += 1
+        return self.sock.setsockopt(*args)
+
+def legacy_send(sock, payloads, tiled):
+    sock.sendall(struct.pack('!d', time.time()))
+    if tiled:
+        sock.sendall(struct.pack('B', 2))
+        sock.sendall(struct.pack('B', 4))
+        for payload in payloads:
+            sock.sendall(struct.pack('!I', len(payload)))
+            sock.sendall(payload)
+    else:
+        sock.sendall(struct.pack('!I', len(payloads[0])))
+        sock.sendall(payloads[0])
+
+def framed_send(sender, payloads, tiled):
+    if tiled:
+        buffers = [FRAME_HEADER.pack(CODEC_TILED, 0, 2, 4, 0, 3840, 1920, 0, time.time(), 0)]
+        for payload in payloads:
+            buffers += [TILE_HEADER.pack(len(payload)), payload]
+    else:
+        buffers = [FRAME_HEADER.pack(CODEC_MJPEG, 50, 1, 1, 0, 3840, 1920, 0, time.time(), len(payloads[0])), payloads[0]]
+    with sender.corked():
+        sender.send(buffers)
+
+def frame_size(method, payloads, tiled):
+    if method == 'legacy':
+        if tiled:
+            return 10 + sum(4 + len(payload) for payload in payloads)
+        return 12 + len(payloads[0])
+    if tiled:
+        return FRAME_HEADER.size + sum(TILE_HEADER.size + len(payload) for payload in payloads)
+    return FRAME_HEADER.size + len(payloads[0])
+
+def receiver(sock, nbytes, num_frames):
+    buffer = bytearray(nbytes)
+    view = memoryview(buffer)
+    for _ in range(num_frames):
+        received = 0
+        while received < nbytes:
+            received += sock.recv_into(view[received:], nbytes - received)
+        sock.sendall(b'\x01')
+
+def measure(method, payloads, tiled, num_frames, nodelay, cork=False):
+    server_socket = socket.create_server(('localhost', 0))
+    client_sock = socket.create_connection(server_socket.getsockname())
+    server_sock, _ = server_socket.accept()
+    thread = threading.Thread(target=receiver, args=(server_sock, frame_size(method, payloads, tiled), num_frames), daemon=True)
+    thread.start()
+
+    counting_sock = CountingSocket(client_sock)
+    sender = FrameSender(counting_sock, nodelay=nodelay, cork=cork)
+    counting_sock.calls = 0
+    latencies = []
+    for _ in range(num_frames):
+        start = time.perf_counter()
+        if method == 'legacy':
+            legacy_send(counting_sock, payloads, tiled)
+        else:
+            framed_send(sender, payloads, tiled)
+        client_sock.recv(1)
+        latencies.append(time.perf_counter() - start)
+
+    thread.join()
+    for sock in (client_sock, server_sock, server_socket):
+        sock.close()
+    return counting_sock.calls / num_frames, statistics.median(latencies) * 1000, max(latencies) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--quality', type=int, default=50)
+    args = parser.parse_args()
+
+    frame = synthetic_frame()
+    scenarios = {
+        'mjpeg': ([mjpeg.Mjpeg(None, qf=args.quality).encode(frame)], False),
+        'tiled 2x4': (tile_spatial.TileSpatial(None).encode_image(frame, [[args.quality] * 4] * 2), True),
+    }
+    configs = [
+        ('legacy', False, False),
+        ('legacy', True, False),
+        ('sendmsg', False, False),
+        ('sendmsg', True, False),
+        ('sendmsg', True, True),
+    ]
+
+    print(f'{"frame":>10} {"sender":>8} {"nodelay":>8} {"cork":>5} {"syscalls/frame":>15} {"p50 ms":>8} {"max ms":>8}')
+    for scenario, (payloads, tiled) in scenarios.items():
+        for method, nodelay, cork in configs:
+            syscalls, p50, worst = measure(method, payloads, tiled, args.frames, nodelay, cork)
+            print(f'{scenario:>10} {method:>8} {str(nodelay):>8} {str(cork):>5} {syscalls:>15.1f} {p50:>8.2f} {worst:>8.2f}')
+
+if __name__ == '__main__':
+    main()
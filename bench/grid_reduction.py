@@ -0,0 +1,64 @@
+# Per-tile density of one 960x480 feature map against grid size: the old slice and
+# count_nonzero loop from the calculate_*_density functions against feature.grid_mean.
+# The sweep stays on grids that divide 960x480, where the old loop covered every pixel
+# and both must agree exactly. Non-divisible grids are checked against a loop over the
+# same tile bounds.
+# Run from the repository root: `python -m bench.grid_reduction [--grids 2x4,4x8,8x16,16x32] [--repeats 50]`
+import argparse
+import statistics
+import time
+import numpy as np
+from bench.common import synthetic_frame
+from feature import edge_map, grid_bounds, grid_mean, preprocess
+
+# The tile loop each calculate_*_density function used to run
+def loop_density(mask, num_rows, num_cols):
+    height, width = mask.shape
+    tile_width = width // num_cols
+    tile_height = height // num_rows
+    density_matrix = np.zeros((num_rows, num_cols))
+    for i in range(num_rows):
+        for j in range(num_cols):
+            start_x, end_x = j * tile_width, min((j + 1) * tile_width, width)
+            start_y, end_y = i * tile_height, min((i + 1) * tile_height, height)
+            tile = mask[start_y:end_y, start_x:end_x]
+            density_matrix[i, j] = np.count_nonzero(tile) / (tile.size)
+    return density_matrix
+
+# Same loop over grid_bounds tiles, the reference for grids that don't divide the map
+def bounded_loop_density(mask, num_rows, num_cols):
+    ys = grid_bounds(mask.shape[0], num_rows)
+    xs = grid_bounds(mask.shape[1], num_cols)
+    return np.array([[np.count_nonzero(mask[ys[i]:ys[i + 1], xs[j]:xs[j + 1]]) / ((ys[i + 1] - ys[i]) * (xs[j + 1] - xs[j]))
+                      for j in range(num_cols)] for i in range(num_rows)])
+
+def measure(density, mask, num_rows, num_cols, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = density(mask, num_rows, num_cols)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000, result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grids', default='2x4,4x8,8x16,16x32')
+    parser.add_argument('--uneven', default='3x7,7x9,13x27')
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    mask = edge_map(preprocess(synthetic_frame())) != 0
+    print(f'{"grid":>6} {"loop ms":>8} {"grid_mean ms":>13} {"speedup":>8} {"max diff":>9}')
+    for grid in args.grids.split(','):
+        rows, cols = map(int, grid.split('x'))
+        loop_ms, expected = measure(loop_density, mask, rows, cols, args.repeats)
+        grid_ms, result = measure(grid_mean, mask, rows, cols, args.repeats)
+        print(f'{grid:>6} {loop_ms:>8.3f} {grid_ms:>13.3f} {loop_ms / grid_ms:>8.2f} {np.abs(result - expected).max():>9.1e}')
+
+    for grid in args.uneven.split(','):
+        rows, cols = map(int, grid.split('x'))
+        max_diff = np.abs(grid_mean(mask, rows, cols) - bounded_loop_density(mask, rows, cols)).max()
+        print(f'{grid:>6} uneven grid, max diff against a loop over the same tiles: {max_diff:.1e}')
+
+if __name__ == '__main__':
+    main()
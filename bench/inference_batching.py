@@ -0,0 +1,95 @@
+# Server-side object detection for N cameras at 10 fps: the old video_feed (a YOLO model
+# per viewer, predicting in a loop whether or not the frame changed) against
+# InferenceService batching new frames of every camera into one predict. Reports annotated
+# frames per second delivered to viewers, the predict calls behind them, and peak RSS,
+# each run in a fresh process. Needs ultralytics and the yolov8n.pt weights.
+# Run from the repository root: `python -m bench.inference_batching [--cameras 1,4,8] [--viewers 1] [--seconds 20]`
+import argparse
+import multiprocessing
+import resource
+import threading
+import time
+from ultralytics import YOLO
+from bench.common import quiet, run_threads, synthetic_frame
+from captures import FrameStore
+from inference import InferenceService
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000
+
+def cameras(store, frames, stop):
+    def camera(idx):
+        while not stop.is_set():
+            store[idx] = frames[idx]
+            time.sleep(0.1)
+    for idx in range(len(frames)):
+        threading.Thread(target=camera, args=(idx,), daemon=True).start()
+
+# What each /video_feed request used to do, minus the JPEG encode
+def per_viewer(frames, viewers, seconds):
+    store, stop = FrameStore(), threading.Event()
+    cameras(store, frames, stop)
+    delivered, predicts = [0], [0]
+
+    def viewer(idx):
+        model = YOLO('yolov8n.pt')
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            model.predict(store[idx], device='cpu', verbose=False)[0].plot()
+            delivered[0] += 1
+            predicts[0] += 1
+
+    store.wait(len(frames) - 1)
+    run_threads([lambda idx=idx: viewer(idx) for idx in range(len(frames)) for _ in range(viewers)])
+    stop.set()
+    return delivered[0] / seconds, predicts[0] / seconds, 1
+
+def shared(frames, viewers, seconds, max_batch):
+    store, stop = FrameStore(), threading.Event()
+    cameras(store, frames, stop)
+    service = InferenceService(store, max_batch=max_batch).start()
+    delivered = [0]
+
+    def viewer(idx):
+        service.subscribe(idx)
+        version = 0
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            result = service.wait_result(idx, version, timeout=1.0)
+            if result:
+                version = result[0]
+                delivered[0] += 1
+        service.unsubscribe(idx)
+
+    run_threads([lambda idx=idx: viewer(idx) for idx in range(len(frames)) for _ in range(viewers)])
+    stop.set()
+    stats = service.stats()
+    return delivered[0] / seconds, stats['inferences'] / seconds, stats['mean_batch_size']
+
+def run(mode, num_cameras, viewers, seconds, max_batch):
+    frames = [synthetic_frame(seed=seed) for seed in range(num_cameras)]
+    with quiet():
+        if mode == 'per viewer':
+            result = per_viewer(frames, viewers, seconds)
+        else:
+            result = shared(frames, viewers, seconds, max_batch)
+    return result + (peak_rss_mb(),)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cameras', default='1,4,8')
+    parser.add_argument('--viewers', type=int, default=1, help='viewers per camera')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--max-batch', type=int, default=8)
+    args = parser.parse_args()
+
+    print(f'{"cameras":>8} {"mode":>10} {"frames/s":>9} {"predicts/s":>11} {"batch":>6} {"peak RSS MB":>12}')
+    context = multiprocessing.get_context('spawn')
+    for num_cameras in map(int, args.cameras.split(',')):
+        for mode in ['per viewer', 'shared']:
+            with context.Pool(1) as pool:
+                delivered, predicts, batch, rss = pool.apply(run, (mode, num_cameras, args.viewers, args.seconds, args.max_batch))
+            print(f'{num_cameras:>8} {mode:>10} {delivered:>9.1f} {predicts:>11.1f} {batch:>6.1f} {rss:>12.0f}')
+
+if __name__ == '__main__':
+    main()
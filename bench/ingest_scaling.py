@@ -0,0 +1,129 @@
+# Load generator for the ingest server: N concurrent MJPEG cameras on localhost,
+# comparing the asyncio ingest mode against the thread-per-client loop in server.py.
+# Every client connects from localhost, each gets its own session.
+# Run from the repository root: `python -m bench.ingest_scaling [--clients 1,2,4,8,16,32]`
+import argparse
+import asyncio
+import socket
+import threading
+import time
+from collections import Counter
+from bench.common import VID_WIDTH, VID_HEIGHT, synthetic_frame, free_port, connect, quiet, scratch_dir, run_threads
+from ingest import accept_hello, create_streamer, register_session, serve_async, sessions
+from streamers import protocol
+from streamers.protocol import HELLO, FRAME_HEADER
+from streamers import mjpeg
+
+counter_lock = threading.Lock()
+
+def count(frames, key):
+    with counter_lock:
+        frames[key] += 1
+
+class ReplayMjpeg(mjpeg.Mjpeg):
+    # Sends the same pre-encoded frame so the load generator does not compete with the server for CPU
+    def __init__(self, sock, payload, qf):
+        super().__init__(sock, qf=qf)
+        self.payload = payload
+
+    def encode(self, frame):
+        return self.payload
+
+    def pack_header(self, frame, timestamp, length, rows=1, cols=1, flags=0):
+        return FRAME_HEADER.pack(self.codec, self.quality, rows, cols, flags, VID_WIDTH, VID_HEIGHT, self.send_frame_idx, timestamp, length)
+
+def start_async_server(port, frames):
+    started = threading.Event()
+
+    def on_frame(camera_id, frame, densities, timestamp):
+        count(frames, 'received')
+
+    def on_disconnect(camera_id):
+        count(frames, 'disconnected')
+
+    threading.Thread(target=asyncio.run, args=(serve_async('localhost', port, on_frame=on_frame, on_disconnect=on_disconnect, save_frames=False, started=started),), daemon=True).start()
+    started.wait()
+
+def start_threaded_server(port, frames):
+    server_socket = socket.socket()
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind(('localhost', port))
+    server_socket.listen(64)
+
+    def handle_client(client_socket, addr):
+        hello, status = accept_hello(protocol.recv_exactly(client_socket, HELLO.size))
+        session, reply = register_session(hello, status, addr)
+        client_socket.sendall(reply)
+        streamer, logger, _ = create_streamer(hello, client_socket, session)
+        streamer.sync_clock()
+        while True:
+            try:
+                if streamer.get_frame() is None:
+                    break
+                count(frames, 'received')
+            except (ConnectionResetError, BrokenPipeError):
+                break
+        sessions.unregister(session)
+        count(frames, 'disconnected')
+
+    def accept_loop():
+        while True:
+            client_socket, addr = server_socket.accept()
+            threading.Thread(target=handle_client, args=(client_socket, addr), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+# Returns frames received per second and the number of distinct sessions the clients got
+def run_step(port, frames, num_clients, payload, quality, duration, fps):
+    session_ids = []
+    def client():
+        sock = connect(port)
+        streamer = ReplayMjpeg(sock, payload, quality)
+        streamer.handshake(VID_WIDTH, VID_HEIGHT, fps)
+        session_ids.append(streamer.session_id)
+        deadline = time.time() + duration
+        while time.time() < deadline:
+            start_time = time.time()
+            streamer.send_frame(None)
+            if fps:
+                time.sleep(max(0, 1 / fps - (time.time() - start_time)))
+        sock.close()
+
+    received, disconnected = frames['received'], frames['disconnected']
+    start = time.time()
+    run_threads([client] * num_clients)
+    # Count until the server has drained every connection, not just until the clients stop
+    while frames['disconnected'] < disconnected + num_clients:
+        time.sleep(0.01)
+    return (frames['received'] - received) / (time.time() - start), len(set(session_ids))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', default='1,2,4,8,16,32')
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--fps', type=float, default=0, help='per-client frame rate, 0 for as fast as possible')
+    parser.add_argument('--quality', type=int, default=50)
+    parser.add_argument('--mode', choices=['async', 'threaded', 'both'], default='both')
+    args = parser.parse_args()
+
+    payload = mjpeg.Mjpeg(None, qf=args.quality).encode(synthetic_frame())
+    print(f'Frame size: {len(payload) / 1000:.1f} KB')
+
+    modes = ['async', 'threaded'] if args.mode == 'both' else [args.mode]
+    print(f'{"mode":>9} {"clients":>8} {"sessions":>9} {"frames/s":>10}')
+    with scratch_dir():
+        for mode in modes:
+            port = free_port()
+            frames = Counter()
+            with quiet():
+                if mode == 'async':
+                    start_async_server(port, frames)
+                else:
+                    start_threaded_server(port, frames)
+            for num_clients in map(int, args.clients.split(',')):
+                with quiet():
+                    fps, num_sessions = run_step(port, frames, num_clients, payload, args.quality, args.duration, args.fps)
+                print(f'{mode:>9} {num_clients:>8} {num_sessions:>9} {fps:>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Frame timing a consumer sees from the latest-frame store against JitterBuffer's paced
+# playout, for a 10 fps camera whose frames reach the server with a variable network
+# delay: `--base` ms plus exponential jitter, and every `--stall-every` seconds a stall
+# that releases the held frames in one burst. Reports the spread of the intervals between
+# frames as delivered and as played, frames the playout skipped or got late, and RSS at
+# the start and end of the run to show the buffer's memory staying flat.
+# Run from the repository root: `python -m bench.jitter_playout [--seconds 20] [--delay 0.1] [--capacity 8]`
+import argparse
+import resource
+import threading
+import time
+import numpy as np
+from bench.common import synthetic_frame
+from jitter import JitterBuffer
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1000
+
+def arrivals(num_frames, fps, base, jitter, stall_every, stall, seed=0):
+    rng = np.random.default_rng(seed)
+    captures = np.arange(num_frames) / fps
+    delays = base + rng.exponential(jitter, num_frames)
+    for stall_start in np.arange(stall_every, num_frames / fps, stall_every):
+        # Everything captured during the stall arrives when it ends
+        held = (captures >= stall_start) & (captures < stall_start + stall)
+        delays[held] = np.maximum(delays[held], stall_start + stall - captures[held] + base)
+    # TCP delivers in order
+    return captures, np.maximum.accumulate(captures + delays)
+
+def intervals(times):
+    gaps = np.diff(times) * 1000
+    return gaps.std(), gaps.max()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--fps', type=float, default=10)
+    parser.add_argument('--capacity', type=int, default=8)
+    parser.add_argument('--delay', type=float, default=0.1, help='playout delay in seconds')
+    parser.add_argument('--base', type=float, default=30, help='network delay in ms')
+    parser.add_argument('--jitter', type=float, default=20, help='mean extra delay in ms')
+    parser.add_argument('--stall-every', type=float, default=4)
+    parser.add_argument('--stall', type=float, default=0.3, help='stall length in seconds')
+    args = parser.parse_args()
+
+    num_frames = int(args.seconds * args.fps)
+    captures, arrival_offsets = arrivals(num_frames, args.fps, args.base / 1000, args.jitter / 1000, args.stall_every, args.stall)
+    frames = [synthetic_frame(1920, 960, seed=seed) for seed in range(4)]
+    buffer = JitterBuffer(args.capacity, args.delay)
+    start = time.time() + 0.1
+
+    def camera():
+        for idx, (capture, arrival) in enumerate(zip(captures, arrival_offsets)):
+            time.sleep(max(0, start + arrival - time.time()))
+            buffer.put(frames[idx % len(frames)], start + capture)
+
+    thread = threading.Thread(target=camera, daemon=True)
+    thread.start()
+    # Once the ring has wrapped
+    rss_start = []
+    threading.Timer(args.capacity / args.fps + 0.5, lambda: rss_start.append(rss_mb())).start()
+
+    played = []
+    timestamp = -np.inf
+    while thread.is_alive() or buffer.stats()['occupancy']:
+        result = buffer.next_frame(timestamp, timeout=1.0)
+        if result is None:
+            continue
+        timestamp = result[0]
+        played.append(time.time())
+    stats = buffer.stats()
+
+    delivered_std, delivered_max = intervals(start + arrival_offsets)
+    played_std, played_max = intervals(np.array(played))
+    print(f'{"":>10} {"interval std ms":>16} {"max interval ms":>16}')
+    print(f'{"delivered":>10} {delivered_std:>16.1f} {delivered_max:>16.1f}')
+    print(f'{"played":>10} {played_std:>16.1f} {played_max:>16.1f}')
+    print(f'frames {stats["frames"]}, played {stats["played"]}, skipped {stats["skipped"]}, '
+          f'overwritten unplayed {stats["overwritten_unplayed"]}, late {stats["late_frames"]} '
+          f'(mean {stats["mean_lateness_ms"]:.0f} ms, max {stats["max_lateness_ms"]:.0f} ms)')
+    print(f'peak RSS {rss_start[0]:.0f} MB once the buffer was full, {rss_mb():.0f} MB at the end')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Cost of Logger.log() on the frame path and the size of what ends up on disk: the old
+# in-memory list written with json.dump(indent=4) on flush against the streaming NDJSON
+# and columnar sinks. Records look like Streamer.log_frame's, and are read back with
+# read_logs to check nothing is lost. Bursts longer than the queue (4096 records) make
+# log() wait on the writer thread, which is what the default --records measures.
+# Run from the repository root: `python -m bench.logger_throughput [--records 100000]`
+import argparse
+import json
+import os
+import time
+from bench.common import quiet, scratch_dir
+from logger import Logger, read_logs
+
+# logger.Logger before records were streamed to disk
+class ListLogger:
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self.logs = []
+
+    def log(self, logs):
+        self.logs.append(logs)
+
+    def flush(self):
+        with open(self.log_path, 'a') as f:
+            json.dump(self.logs, f, indent=4)
+
+    def close(self):
+        self.flush()
+
+def record(idx):
+    now = time.time()
+    return {
+        'frame': idx,
+        'seq': idx,
+        'frame_size_kb': 305.283,
+        'client_send_start_time': now - 0.01,
+        'server_recv_start_time': now - 0.005,
+        'server_recv_end_time': now,
+        'server_recv_duration': 0.005,
+        'network_duration_ms': 10.0,
+        'bandwidth_mbps': 244.2,
+    }
+
+def measure(make_logger, log_path, num_records):
+    records = [record(idx) for idx in range(num_records)]
+    logger = make_logger(log_path)
+    start = time.perf_counter()
+    for r in records:
+        logger.log(r)
+    log_time = time.perf_counter() - start
+    start = time.perf_counter()
+    with quiet():
+        logger.close()
+    close_time = time.perf_counter() - start
+    assert len(read_logs(log_path)) == num_records
+    return log_time / num_records * 1_000_000, close_time * 1000, os.path.getsize(log_path) / 1_000_000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=100_000)
+    args = parser.parse_args()
+
+    loggers = [
+        ('json list', ListLogger),
+        ('ndjson', Logger),
+        ('columnar', lambda path: Logger(path, fmt='columnar')),
+    ]
+    print(f'{"logger":>10} {"us/log":>8} {"close ms":>9} {"file MB":>8}')
+    with scratch_dir():
+        for name, make_logger in loggers:
+            us, close_ms, size = measure(make_logger, f'{name.replace(" ", "_")}.log', args.records)
+            print(f'{name:>10} {us:>8.2f} {close_ms:>9.1f} {size:>8.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# Web viewer cost against the number of viewers of one camera: the old generator per
+# request (each one waiting for the frame and encoding its own JPEG) against a
+# BroadcastHub encoding once for everyone. Frames come from a FrameStore updated at 10
+# fps with a 1920x960 frame standing in for the annotated YOLO output. A fraction of the
+# viewers read slowly, to check they lose frames without slowing down the others.
+# Run from the repository root: `python -m bench.mjpeg_fanout [--viewers 1,10,50,100] [--seconds 5]`
+import argparse
+import threading
+import time
+import cv2
+from bench.common import run_threads, synthetic_frame
+from broadcast import Broadcaster, multipart_chunk
+from captures import FrameStore
+
+def camera(store, frame, stop):
+    while not stop.is_set():
+        store['camera'] = frame
+        time.sleep(0.1)
+
+# The /video_feed generator before the hub, with the frame store as its source
+def per_viewer_stream(store):
+    version = 0
+    while True:
+        result = store.wait('camera', version, timeout=1.0)
+        if result is None:
+            continue
+        version, frame = result
+        ret, jpeg = cv2.imencode('.jpg', frame)
+        if ret:
+            yield multipart_chunk(jpeg.tobytes())
+
+def measure(mode, num_viewers, slow_fraction, seconds):
+    store, stop = FrameStore(), threading.Event()
+    threading.Thread(target=camera, args=(store, synthetic_frame(1920, 960), stop), daemon=True).start()
+    broadcaster = Broadcaster(store.wait) if mode == 'hub' else None
+    num_slow = int(num_viewers * slow_fraction)
+    received = [0] * num_viewers
+
+    def viewer(idx):
+        stream = broadcaster.stream('camera') if broadcaster else per_viewer_stream(store)
+        deadline = time.time() + seconds
+        for _ in stream:
+            received[idx] += 1
+            if idx < num_slow:
+                time.sleep(0.5) # a viewer on a bad connection
+            if time.time() > deadline:
+                break
+        stream.close()
+
+    start_cpu = time.process_time()
+    run_threads([lambda idx=idx: viewer(idx) for idx in range(num_viewers)])
+    cpu = time.process_time() - start_cpu
+    stop.set()
+
+    fast = received[num_slow:]
+    return cpu / seconds, sum(fast) / len(fast) / seconds, (sum(received[:num_slow]) / num_slow / seconds) if num_slow else 0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--viewers', default='1,10,50,100')
+    parser.add_argument('--slow', type=float, default=0.1, help='fraction of slow viewers')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{"viewers":>8} {"mode":>11} {"cpu s/s":>8} {"fast fps":>9} {"slow fps":>9}')
+    for num_viewers in map(int, args.viewers.split(',')):
+        for mode in ['per viewer', 'hub']:
+            cpu, fast_fps, slow_fps = measure(mode, num_viewers, args.slow, args.seconds)
+            print(f'{num_viewers:>8} {mode:>11} {cpu:>8.2f} {fast_fps:>9.1f} {slow_fps:>9.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Client CPU for TileSpatial's compression profile on a mostly static 360 scene with one
+# object moving across it: recomputing the profile on every frame against ProfileCache.
+# Error is the difference in per-tile JPEG quality (after cap_compression_profile) from
+# the full recomputation of the same frame.
+# Run from the repository root: `python -m bench.profile_cache [--frames 60] [--refresh 30] [--threshold 4]`
+import argparse
+import time
+import cv2
+import numpy as np
+from bench.common import synthetic_frame
+from feature import ProfileCache, calculate_compression_profile
+from streamers.tile_spatial import TileSpatial
+
+def scene(num_frames, speed):
+    background = synthetic_frame()
+    rng = np.random.default_rng(1)
+    height, width = background.shape[:2]
+    for idx in range(num_frames):
+        frame = background.copy()
+        x = (200 + idx * speed) % width
+        cv2.rectangle(frame, (x, height // 3), (x + 300, height // 3 + 500), (30, 200, 90), -1)
+        cv2.circle(frame, (x + 150, height // 3 + 250), 120, (250, 250, 250), 8)
+        # Sensor noise, so static tiles are never bit-identical
+        frame += rng.integers(0, 3, size=(1, width, 3), dtype=np.uint8)
+        yield frame
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--speed', type=int, default=40, help='pixels the object moves per frame')
+    parser.add_argument('--refresh', type=int, default=30)
+    parser.add_argument('--threshold', type=float, default=4.0)
+    args = parser.parse_args()
+
+    cache = ProfileCache(2, 4, threshold=args.threshold, refresh_interval=args.refresh)
+    full_time, cached_time, errors = 0, 0, []
+    for frame in scene(args.frames, args.speed):
+        start = time.perf_counter()
+        expected = calculate_compression_profile(frame, 2, 4)
+        full_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        profile = cache.get(frame)
+        cached_time += time.perf_counter() - start
+
+        errors.append(np.abs(TileSpatial.cap_compression_profile(profile) - TileSpatial.cap_compression_profile(expected)))
+
+    errors = np.array(errors)
+    print(f'full profile:   {full_time / args.frames * 1000:.2f} ms/frame')
+    print(f'profile cache:  {cached_time / args.frames * 1000:.2f} ms/frame')
+    print(f'hit rate:       {cache.hit_rate:.2%}')
+    print(f'quality error:  mean {errors.mean():.2f}, max {errors.max()}')
+
+if __name__ == '__main__':
+    main()
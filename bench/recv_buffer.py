@@ -0,0 +1,112 @@
+# Microbenchmark of the receive path over a local socketpair: the old `self.buffer += data`
+# loop against RecvBuffer.recv_into, for a raw 3840x1920x3 Basic frame by default.
+# Run from the repository root: `python -m bench.recv_buffer [--frames 5] [--size BYTES]`
+import argparse
+import socket
+import struct
+import threading
+import time
+import tracemalloc
+from bench.common import VID_HEIGHT, VID_WIDTH
+from streamers.recv_buffer import RecvBuffer
+
+# The original framing: client send timestamp and payload length
+FRAME_HEADER = struct.Struct('!dI')
+
+class CountingSocket:
+    def __init__(self, sock):
+        self.sock = sock
+        self.calls = 0
+
+    def recv(self, bufsize):
+        self.calls += 1
+        return self.sock.recv(bufsize)
+
+    def recv_into(self, buffer, nbytes=0):
+        self.calls += 1
+        return self.sock.recv_into(buffer, nbytes)
+
+# The receive loop every streamer used before RecvBuffer
+class LegacyReceiver:
+    def __init__(self, sock):
+        self.sock = sock
+        self.buffer = b''
+        self.nallocs = 0
+
+    def get_payload(self):
+        client_send_start_time = struct.unpack('!d', self.sock.recv(8))[0]
+        data_length = struct.unpack('!I', self.sock.recv(4))[0]
+        while len(self.buffer) < data_length:
+            data = self.sock.recv(min(data_length - len(self.buffer), 40960))
+            if not data:
+                return None
+            self.buffer += data
+            self.nallocs += 2 # the chunk returned by recv and the concatenated copy
+        payload = self.buffer
+        self.buffer = b''
+        return payload
+
+class RecvIntoReceiver:
+    def __init__(self, sock):
+        self.recv_buffer = RecvBuffer(sock)
+
+    @property
+    def nallocs(self):
+        return self.recv_buffer.nallocs
+
+    def get_payload(self):
+        header = self.recv_buffer.recv_header(FRAME_HEADER)
+        if header is None:
+            return None
+        return self.recv_buffer.recv_payload(header[1])
+
+def sender(sock, payload, num_frames):
+    for _ in range(num_frames):
+        sock.sendall(FRAME_HEADER.pack(time.time(), len(payload)))
+        sock.sendall(payload)
+
+def measure(receiver_cls, payload, num_frames, trace=False):
+    send_sock, recv_sock = socket.socketpair()
+    counting_sock = CountingSocket(recv_sock)
+    receiver = receiver_cls(counting_sock)
+    thread = threading.Thread(target=sender, args=(send_sock, payload, num_frames), daemon=True)
+
+    if trace:
+        tracemalloc.start()
+    thread.start()
+    start = time.perf_counter()
+    for _ in range(num_frames):
+        receiver.get_payload()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    thread.join()
+    send_sock.close()
+    recv_sock.close()
+
+    return {
+        'MB/s': len(payload) * num_frames / elapsed / 1_000_000,
+        'recv calls/frame': counting_sock.calls / num_frames,
+        'allocs/frame': receiver.nallocs / num_frames,
+        'peak MB': peak / 1_000_000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=5)
+    parser.add_argument('--size', type=int, default=VID_HEIGHT * VID_WIDTH * 3)
+    args = parser.parse_args()
+
+    payload = bytes(args.size)
+    print(f'Payload: {args.size / 1_000_000:.1f} MB x {args.frames} frames')
+    print(f'{"receiver":>10} {"MB/s":>10} {"recv calls/frame":>17} {"allocs/frame":>13} {"peak MB":>9}')
+    for name, receiver_cls in [('legacy', LegacyReceiver), ('recv_into', RecvIntoReceiver)]:
+        result = measure(receiver_cls, payload, args.frames)
+        # Peak heap usage is taken in a separate pass since tracemalloc slows everything down
+        result['peak MB'] = measure(receiver_cls, payload, 1, trace=True)['peak MB']
+        print(f'{name:>10} {result["MB/s"]:>10.1f} {result["recv calls/frame"]:>17.1f} {result["allocs/frame"]:>13.1f} {result["peak MB"]:>9.1f}')
+
+if __name__ == '__main__':
+    main()
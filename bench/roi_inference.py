@@ -0,0 +1,77 @@
+# Server-side detection on whole 360 frames against InferenceService's ROI mode, which only
+# runs the model on the tiles whose feature density (the compression profile TileSpatial
+# sends with each frame) is at least a fraction of the densest tile. Reports predict time
+# per frame, the share of the frame the model saw, and how many of the whole-frame
+# detections the ROI run still finds (same class, IoU >= 0.5). Pass recorded frames with
+# --images for meaningful recall, the synthetic frame has nothing to detect.
+# Needs ultralytics and the yolov8n.pt weights. Without them, `--weights yolov8n.yaml` builds
+# an untrained model, which still gives the timings but no detections to compare.
+# Run from the repository root: `python -m bench.roi_inference [--images 'imgs/*.jpg'] [--fractions 0.1,0.25,0.5]`
+import argparse
+import glob
+import time
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from bench.common import synthetic_frame
+from feature import calculate_compression_profile
+from inference import merge_detections, roi_crops
+
+def iou(box, boxes):
+    x0 = np.maximum(box[0], boxes[:, 0])
+    y0 = np.maximum(box[1], boxes[:, 1])
+    x1 = np.minimum(box[2], boxes[:, 2])
+    y1 = np.minimum(box[3], boxes[:, 3])
+    overlap = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = lambda b: (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return overlap / (area(box) + area(boxes) - overlap)
+
+def matched(reference, detections, threshold=0.5):
+    found = 0
+    for box, cls in zip(reference[0], reference[2]):
+        same_class = detections[2] == cls
+        if same_class.any() and iou(box, detections[0][same_class]).max() >= threshold:
+            found += 1
+    return found
+
+def detect(model, frame, crops):
+    start = time.time()
+    results = model.predict([frame[y0:y1, x0:x1] for x0, y0, x1, y1 in crops], device='cpu', verbose=False)
+    detections = merge_detections(results, [(x0, y0) for x0, y0, _, _ in crops])
+    return detections, time.time() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', help='glob of recorded frames')
+    parser.add_argument('--fractions', default='0.1,0.25,0.5')
+    parser.add_argument('--margin', type=int, default=32)
+    parser.add_argument('--weights', default='yolov8n.pt')
+    args = parser.parse_args()
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(args.images))] if args.images else [synthetic_frame(seed=seed) for seed in range(4)]
+    model = YOLO(args.weights)
+    model.predict(frames[0], device='cpu', verbose=False) # warm up
+
+    full = []
+    for frame in frames:
+        full.append(detect(model, frame, [(0, 0, frame.shape[1], frame.shape[0])]))
+    densities = [calculate_compression_profile(frame, 2, 4) for frame in frames]
+    reference = sum(len(detections[0]) for detections, _ in full)
+
+    print(f'{"mode":>12} {"ms/frame":>9} {"area":>6} {"detections":>11} {"recall":>7}')
+    print(f'{"full frame":>12} {1000 * np.mean([t for _, t in full]):>9.1f} {1:>6.2f} {reference:>11} {1:>7.2f}')
+    for fraction in map(float, args.fractions.split(',')):
+        times, areas, count, found = [], [], 0, 0
+        for frame, frame_densities, (full_detections, _) in zip(frames, densities, full):
+            height, width = frame.shape[:2]
+            crops = roi_crops(frame.shape, frame_densities, fraction, args.margin) or [(0, 0, width, height)]
+            detections, elapsed = detect(model, frame, crops)
+            times.append(elapsed)
+            areas.append(sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in crops) / (width * height))
+            count += len(detections[0])
+            found += matched(full_detections, detections)
+        recall = found / reference if reference else 1
+        print(f'{f"roi {fraction}":>12} {1000 * np.mean(times):>9.1f} {np.mean(areas):>6.2f} {count:>11} {recall:>7.2f}')
+
+if __name__ == '__main__':
+    main()
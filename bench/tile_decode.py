@@ -0,0 +1,66 @@
+# Server-side TileSpatial receive latency per frame: the old serial decode followed by
+# np.hstack/np.vstack against decoding tiles on the pool as they arrive, straight into a
+# preallocated frame. Tiles are replayed over a local socketpair.
+# Run from the repository root: `python -m bench.tile_decode [--grids 2x4,4x8] [--frames 20]`
+import argparse
+import socket
+import statistics
+import threading
+import time
+import numpy as np
+from bench.common import synthetic_frame
+from streamers.framing import FrameSender
+from streamers.protocol import FRAME_HEADER, TILE_HEADER, CODEC_TILED
+from streamers.tile_spatial import TileSpatial
+
+# TileSpatial.get_frame before tiles were decoded in parallel
+def serial_get_frame(streamer):
+    header = streamer.read_header()
+    streamer.frame_data_length = 0
+    tiles = [streamer.decode_tile(streamer.receive_tile()) for _ in range(header.rows * header.cols)]
+    combined_rows = [np.hstack(tiles[i * header.cols:(i + 1) * header.cols]) for i in range(header.rows)]
+    return np.vstack(combined_rows)
+
+def sender(sock, tiles_data, rows, cols, width, height, num_frames):
+    frame_sender = FrameSender(sock)
+    for seq in range(num_frames):
+        buffers = [FRAME_HEADER.pack(CODEC_TILED, 0, rows, cols, 0, width, height, seq, time.time(), 0)]
+        for tile_data in tiles_data:
+            buffers += [TILE_HEADER.pack(len(tile_data)), tile_data]
+        frame_sender.send(buffers)
+
+def measure(get_frame, tiles_data, rows, cols, frame, num_frames):
+    send_sock, recv_sock = socket.socketpair()
+    height, width = frame.shape[:2]
+    thread = threading.Thread(target=sender, args=(send_sock, tiles_data, rows, cols, width, height, num_frames), daemon=True)
+    thread.start()
+    streamer = TileSpatial(recv_sock)
+    latencies = []
+    for _ in range(num_frames):
+        start = time.perf_counter()
+        out = get_frame(streamer)
+        latencies.append(time.perf_counter() - start)
+    thread.join()
+    send_sock.close()
+    recv_sock.close()
+    return statistics.median(latencies) * 1000, out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--grids', default='2x4,4x8')
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--quality', type=int, default=30)
+    args = parser.parse_args()
+
+    frame = synthetic_frame()
+    print(f'{"grid":>6} {"serial ms":>10} {"parallel ms":>12} {"speedup":>8}')
+    for grid in args.grids.split(','):
+        rows, cols = map(int, grid.split('x'))
+        tiles_data = TileSpatial(None).encode_image(frame, [[args.quality] * cols for _ in range(rows)])
+        serial_ms, serial_frame = measure(serial_get_frame, tiles_data, rows, cols, frame, args.frames)
+        parallel_ms, parallel_frame = measure(TileSpatial.get_frame, tiles_data, rows, cols, frame, args.frames)
+        assert np.array_equal(serial_frame, parallel_frame)
+        print(f'{grid:>6} {serial_ms:>10.1f} {parallel_ms:>12.1f} {serial_ms / parallel_ms:>8.2f}')
+
+if __name__ == '__main__':
+    main()
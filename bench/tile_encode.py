@@ -0,0 +1,43 @@
+# Tile encode time per frame for TileSpatial against the number of encode workers and
+# the tile grid size. Workers = 1 is the old serial encoder.
+# Run from the repository root: `python -m bench.tile_encode [--workers 1,2,4] [--grids 2x4,4x8]`
+import argparse
+import os
+import statistics
+import time
+from bench.common import synthetic_frame
+from streamers.tile_spatial import TileSpatial
+
+def measure(frame, workers, rows, cols, num_frames, quality):
+    streamer = TileSpatial(None, encode_workers=workers)
+    qualities = [[quality] * cols for _ in range(rows)]
+    streamer.encode_image(frame, qualities) # warm up the pool
+    times = []
+    for _ in range(num_frames):
+        start = time.perf_counter()
+        streamer.encode_image(frame, qualities)
+        times.append(time.perf_counter() - start)
+    streamer.encode_pool.shutdown()
+    return statistics.median(times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, 4, os.cpu_count()})))
+    parser.add_argument('--grids', default='2x4,4x8,8x16')
+    parser.add_argument('--frames', type=int, default=10)
+    parser.add_argument('--quality', type=int, default=30)
+    args = parser.parse_args()
+
+    frame = synthetic_frame()
+    print(f'{os.cpu_count()} CPUs')
+    print(f'{"grid":>6} {"workers":>8} {"ms/frame":>9} {"speedup":>8}')
+    for grid in args.grids.split(','):
+        rows, cols = map(int, grid.split('x'))
+        serial = None
+        for workers in map(int, args.workers.split(',')):
+            ms = measure(frame, workers, rows, cols, args.frames, args.quality)
+            serial = serial or ms
+            print(f'{grid:>6} {workers:>8} {ms:>9.1f} {serial / ms:>8.2f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+import queue
+import threading
+import cv2
+
+def multipart_chunk(jpeg):
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n\r\n')
+
+# Fans one camera's annotated frames out to every HTTP viewer. A single thread per camera
+# waits on `source` for a new frame, encodes it to JPEG once and puts the same bytes on
+# each viewer's bounded queue. A viewer that isn't keeping up loses its oldest queued
+# frame instead of holding up the others. stop() ends the thread and every viewer's stream.
+class BroadcastHub:
+    def __init__(self, camera_id, source, on_first=None, on_last=None, max_queue=2):
+        self.camera_id = camera_id
+        self.source = source
+        self.on_first = on_first
+        self.on_last = on_last
+        self.max_queue = max_queue
+        self.lock = threading.Lock()
+        self.clients = set()
+        self.stopped = threading.Event()
+        self.encodes = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def subscribe(self):
+        client = queue.Queue(maxsize=self.max_queue)
+        with self.lock:
+            self.clients.add(client)
+            if len(self.clients) == 1 and self.on_first:
+                self.on_first(self.camera_id)
+        return client
+
+    # Returns whether that was the last viewer
+    def unsubscribe(self, client):
+        with self.lock:
+            if client not in self.clients:
+                return not self.clients
+            self.clients.discard(client)
+            if not self.clients and self.on_last:
+                self.on_last(self.camera_id)
+            return not self.clients
+
+    def stop(self):
+        self.stopped.set()
+
+    # Frames queued beyond the first viewer of each encoded frame
+    def frames_shared(self):
+        with self.lock:
+            return self.delivered - self.encodes
+
+    # Frames for one subscribed viewer until the hub stops
+    def frames(self, client):
+        while not self.stopped.is_set():
+            try:
+                yield client.get(timeout=1.0)
+            except queue.Empty:
+                continue
+
+    def run(self):
+        version = 0
+        while not self.stopped.is_set():
+            result = self.source(self.camera_id, version, 1.0)
+            if result is None:
+                continue
+            version, frame = result
+            with self.lock:
+                clients = list(self.clients)
+            if not clients:
+                continue
+
+            ret, jpeg = cv2.imencode('.jpg', frame)
+            if not ret:
+                continue
+            chunk = multipart_chunk(jpeg.tobytes())
+
+            dropped = 0
+            for client in clients:
+                try:
+                    client.put_nowait(chunk)
+                except queue.Full:
+                    try:
+                        client.get_nowait()
+                    except queue.Empty:
+                        pass
+                    client.put_nowait(chunk)
+                    dropped += 1
+            with self.lock:
+                self.encodes += 1
+                self.delivered += len(clients)
+                self.dropped += dropped
+
+    def stats(self):
+        with self.lock:
+            return {
+                'viewers': len(self.clients),
+                'jpeg_encodes': self.encodes,
+                'frames_queued': self.delivered,
+                'frames_dropped': self.dropped,
+            }
+
+# One BroadcastHub per watched camera, created by its first viewer and stopped when its
+# last viewer leaves or the camera disconnects. `exists` says whether a camera is connected, stream() returns None
+# for cameras that aren't.
+class Broadcaster:
+    def __init__(self, source, on_first=None, on_last=None, max_queue=2, exists=None):
+        self.source = source
+        self.on_first = on_first
+        self.on_last = on_last
+        self.max_queue = max_queue
+        self.exists = exists
+        self.lock = threading.Lock()
+        self.hubs = {}
+        self.retired_shared = 0 # frames_shared of hubs already stopped
+
+    def subscribe(self, camera_id):
+        with self.lock:
+            if camera_id not in self.hubs:
+                self.hubs[camera_id] = BroadcastHub(camera_id, self.source, self.on_first, self.on_last, self.max_queue)
+            hub = self.hubs[camera_id]
+            return hub, hub.subscribe()
+
+    def unsubscribe(self, hub, client):
+        with self.lock:
+            if hub.unsubscribe(client) and self.hubs.get(hub.camera_id) is hub:
+                del self.hubs[hub.camera_id]
+                hub.stop()
+                self.retired_shared += hub.frames_shared()
+
+    # Stops a disconnected camera's hub, which ends its viewers' streams
+    def remove(self, camera_id):
+        with self.lock:
+            hub = self.hubs.pop(camera_id, None)
+            if hub:
+                hub.stop()
+                self.retired_shared += hub.frames_shared()
+
+    # Generator for a Flask multipart response, None if the camera isn't connected
+    def stream(self, camera_id):
+        if self.exists and not self.exists(camera_id):
+            return None
+        def generate():
+            hub, client = self.subscribe(camera_id)
+            try:
+                yield from hub.frames(client)
+            finally: # viewer disconnected
+                self.unsubscribe(hub, client)
+        return generate()
+
+    def stats(self):
+        with self.lock:
+            hubs = dict(self.hubs)
+        return {camera_id: hub.stats() for camera_id, hub in hubs.items()}
+
+    # Frames handed to a viewer that another viewer of the same camera also got, across
+    # every hub so far
+    def frames_shared(self):
+        with self.lock:
+            return self.retired_shared + sum(hub.frames_shared() for hub in self.hubs.values())
@@ -0,0 +1,81 @@
+import threading
+from jitter import JitterBuffer
+
+# Latest frame of every camera with a per-camera version that goes up by one on every
+# new frame. Consumers call wait() with the last version they handled and sleep on the
+# condition until something newer arrives, instead of polling the same frame again.
+# Supports the dict operations server.py used on the plain video_captures dict.
+# Frames are kept as they are, so they must not be modified after put(). Streamers with
+# frame_reused set hand out views into buffers they overwrite, callers copy those first.
+# With `jitter_frames` set, each camera also gets a JitterBuffer of that many frames for
+# paced playout, filled by put() calls that pass the frame's capture timestamp.
+class FrameStore:
+    def __init__(self, jitter_frames=0, jitter_delay=0.1):
+        self.jitter_frames = jitter_frames
+        self.jitter_delay = jitter_delay
+        self.jitter = {} # camera id -> JitterBuffer
+        self.cond = threading.Condition()
+        self.frames = {} # camera id -> (version, frame)
+        self.versions = {} # kept after a camera disconnects, so versions never go back
+        self.densities = {} # camera id -> per-tile feature densities of the latest frame, if it sent any
+
+    def put(self, camera_id, frame, densities=None, timestamp=None):
+        with self.cond:
+            version = self.versions.get(camera_id, 0) + 1
+            self.versions[camera_id] = version
+            self.frames[camera_id] = (version, frame)
+            self.densities[camera_id] = densities
+            self.cond.notify_all()
+            if self.jitter_frames and timestamp is not None and camera_id not in self.jitter:
+                self.jitter[camera_id] = JitterBuffer(self.jitter_frames, self.jitter_delay)
+            jitter = self.jitter.get(camera_id)
+        if jitter and timestamp is not None:
+            # Copies the frame, keep that out of the store's lock
+            jitter.put(frame, timestamp)
+        return version
+
+    def remove(self, camera_id):
+        with self.cond:
+            self.frames.pop(camera_id, None)
+            self.densities.pop(camera_id, None)
+            self.jitter.pop(camera_id, None)
+            self.cond.notify_all()
+
+    # (version, frame), or (0, None) if the camera isn't connected
+    def get(self, camera_id):
+        with self.cond:
+            return self.frames.get(camera_id, (0, None))
+
+    # Blocks until the camera has a frame newer than `version`, returns (version, frame) or
+    # None after `timeout` seconds
+    def wait(self, camera_id, version=0, timeout=None):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.frames.get(camera_id, (0,))[0] > version, timeout):
+                return None
+            return self.frames[camera_id]
+
+    # The camera's JitterBuffer, None if jitter buffering is off or it hasn't sent a frame
+    def jitter_buffer(self, camera_id):
+        with self.cond:
+            return self.jitter.get(camera_id)
+
+    def jitter_stats(self):
+        with self.cond:
+            buffers = dict(self.jitter)
+        return {camera_id: buffer.stats() for camera_id, buffer in buffers.items()}
+
+    def __setitem__(self, camera_id, frame):
+        self.put(camera_id, frame)
+
+    def __getitem__(self, camera_id):
+        return self.frames[camera_id][1]
+
+    def __delitem__(self, camera_id):
+        self.remove(camera_id)
+
+    def __contains__(self, camera_id):
+        return camera_id in self.frames
+
+    def keys(self):
+        with self.cond:
+            return list(self.frames)
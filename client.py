@@ -1,19 +1,29 @@
 import cv2
 import socket
 import numpy as np
-import struct
 import time
 from datetime import datetime
 import sys
 import os
 from streamers import mjpeg, basic, tile_spatial, webp
 from logger import Logger
+from abr import AbrController
+from pipeline import ClientPipeline
 
 mod_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'streamers', 'ffenc_uiuc'))
 if mod_dir not in sys.path:
     sys.path.append(mod_dir)
 from streamers.ffenc_uiuc import h264
 
+# Socket options for the frame senders, Nagle is off by default since each frame goes out in one sendmsg
+TCP_NODELAY = True
+TCP_CORK = False
+# Delivery latency the quality controller aims for in seconds, None keeps the settings fixed.
+# Set with --abr=<seconds> after the server IP, e.g. --abr=0.2
+ABR_TARGET_LATENCY = None
+# Capture, encode and send on separate threads, skipping stale frames. False runs them in turn.
+PIPELINED = True
+
 def stream_video(compression='none'):
     print(f'STARTING {compression.upper()} COMPRESSION TEST')
     if len(sys.argv) < 2:
@@ -40,82 +50,84 @@ def stream_video(compression='none'):
 
     try:
         target_fps = 10 # Thottle to set fps for energy consistency
-        # Calculate the time to wait between frames
-        frame_time = 1.0 / target_fps
-        frames_read = 0
+        pipeline = None
+        controller = None
         test_start_time = time.time()
 
         print(f'Streaming with {compression} compression')
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
         if compression == 'none':
-            logger = Logger(f'./basic_logs.json')
-            client_socket.sendall(struct.pack('B', 0x0))
-            streamer = basic.Basic(client_socket, logger=logger)
+            logger = Logger(f'./basic_logs.ndjson')
+            streamer = basic.Basic(client_socket, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'mjpeg-30':
-            logger = Logger(f'./mjpeg30_logs.json')
-            client_socket.sendall(struct.pack('B', 0x1))
-            streamer = mjpeg.Mjpeg(client_socket, qf=30, logger=logger)
+            logger = Logger(f'./mjpeg30_logs.ndjson')
+            streamer = mjpeg.Mjpeg(client_socket, qf=30, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'mjpeg-50':
-            logger = Logger(f'./mjpeg50_logs.json')
-            client_socket.sendall(struct.pack('B', 0x2))
-            streamer = mjpeg.Mjpeg(client_socket, qf=50, logger=logger)
+            logger = Logger(f'./mjpeg50_logs.ndjson')
+            streamer = mjpeg.Mjpeg(client_socket, qf=50, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'mjpeg-90':
-            logger = Logger(f'./mjpeg90_logs.json')
-            client_socket.sendall(struct.pack('B', 0x3))
-            streamer = mjpeg.Mjpeg(client_socket, qf=90, logger=logger)
+            logger = Logger(f'./mjpeg90_logs.ndjson')
+            streamer = mjpeg.Mjpeg(client_socket, qf=90, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'webp-30':
-            logger = Logger(f'./webp30_logs.json')
-            client_socket.sendall(struct.pack('B', 0x4))
-            streamer = webp.Webp(client_socket, qf=30, logger=logger)
+            logger = Logger(f'./webp30_logs.ndjson')
+            streamer = webp.Webp(client_socket, qf=30, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'webp-50':
-            logger = Logger(f'./webp50_logs.json')
-            client_socket.sendall(struct.pack('B', 0x5))
-            streamer = webp.Webp(client_socket, qf=50, logger=logger)
+            logger = Logger(f'./webp50_logs.ndjson')
+            streamer = webp.Webp(client_socket, qf=50, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'webp-90':
-            logger = Logger(f'./webp90_logs.json')
-            client_socket.sendall(struct.pack('B', 0x6))
-            streamer = webp.Webp(client_socket, qf=90, logger=logger)
+            logger = Logger(f'./webp90_logs.ndjson')
+            streamer = webp.Webp(client_socket, qf=90, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'tiled-spatial':
-            logger = Logger(f'./tiled_logs.json')
-            client_socket.sendall(struct.pack('B', 0x7))
-            streamer = tile_spatial.TileSpatial(client_socket, logger=logger)
+            logger = Logger(f'./tiled_logs.ndjson')
+            streamer = tile_spatial.TileSpatial(client_socket, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         elif compression == 'h264':
             bitrate = '1_5ghz'
-            logger = Logger(f'./h264_{bitrate}_logs.json')
-            client_socket.sendall(struct.pack('B', 0x8))
-            fps = cap.get(cv2.CAP_PROP_FPS)
-            width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-            height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-            streamer = h264.H264(client_socket, width, height, fps, logger=logger)
+            logger = Logger(f'./h264_{bitrate}_logs.ndjson')
+            streamer = h264.H264(client_socket, width, height, fps, logger=logger, nodelay=TCP_NODELAY, cork=TCP_CORK)
         else:
             print('Unsupported compression algorithm!')
             return
 
-        while True:
-            start_time = time.time()
-            ret, frame = cap.read()
-            frames_read += 1
-            if not ret:
+        try:
+            streamer.handshake(width, height, fps)
+        except ConnectionError as e:
+            print(f'Handshake failed: {e}')
+            return
+        # The server names its log for this stream after the session
+        print(f'Session ID: {streamer.session_id}')
+        logger.log({'session_id': streamer.session_id})
+
+        if ABR_TARGET_LATENCY:
+            controller = AbrController(streamer, ABR_TARGET_LATENCY, fps=target_fps).start()
+
+        def read_frame():
+            while True:
+                ret, frame = cap.read()
+                if ret:
+                    return frame
                 # print("Failed to capture frame")
-                # print(f'Actual frame rate: {frames_read / (time.time() - test_start_time)}')
                 _ = cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
                 print('Restarting video...')
-                continue
-
-            streamer.send_frame(frame)
-            print(frame.nbytes)
 
-            # Calculate elapsed time and sleep if necessary
-            elapsed_time = time.time() - start_time
-            time_to_wait = frame_time - elapsed_time
-            if time_to_wait > 0:
-                time.sleep(time_to_wait)
+        pipeline = ClientPipeline(streamer, read_frame, fps=target_fps, pipelined=PIPELINED)
+        pipeline.run()
     finally:
-        print(f'Actual frame rate: {frames_read / (time.time() - test_start_time)}')
-        logger.flush()
+        if controller:
+            controller.stop()
+            logger.log(controller.log_fields())
+        if pipeline:
+            print(f'Actual frame rate: {pipeline.captured / (time.time() - test_start_time)}')
+            logger.log(pipeline.stats())
+        logger.close()
         cap.release()
         client_socket.close()
 
 if __name__ == '__main__':
+    for arg in sys.argv[2:]:
+        if arg.startswith('--abr='):
+            ABR_TARGET_LATENCY = float(arg.split('=', 1)[1])
     # 'none'
     # 'mjpeg-30'
     # 'mjpeg-50'
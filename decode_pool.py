@@ -0,0 +1,172 @@
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+import numpy as np
+from streamers import mjpeg, webp
+from streamers.protocol import CODEC_MJPEG, CODEC_WEBP
+
+# Codecs the workers decode. Basic frames need no decoding, and the H.264 and TileSpatial
+# decoders keep state per connection, so those stay in the ingest process.
+DECODERS = {
+    CODEC_MJPEG: mjpeg.Mjpeg,
+    CODEC_WEBP: webp.Webp,
+}
+
+# `num_slots` fixed-size slots in one shared memory block. Each slot holds a compressed
+# payload on its way to a worker, then the frame the worker decoded from it.
+class FrameRing:
+    def __init__(self, num_slots, payload_bytes, frame_bytes, name=None):
+        self.num_slots = num_slots
+        self.payload_bytes = payload_bytes
+        self.frame_bytes = frame_bytes
+        self.slot_bytes = payload_bytes + frame_bytes
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * self.slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+    # What a worker needs to attach to the same block
+    def layout(self):
+        return self.num_slots, self.payload_bytes, self.frame_bytes, self.shm.name
+
+    def payload(self, slot, nbytes):
+        start = slot * self.slot_bytes
+        return self.shm.buf[start:start + nbytes]
+
+    def frame(self, slot, shape):
+        return np.ndarray(shape, np.uint8, self.shm.buf, slot * self.slot_bytes + self.payload_bytes)
+
+    def close(self):
+        try:
+            self.shm.close()
+        except BufferError: # frames still referenced, the block goes away with the process
+            pass
+
+def decode_worker(layout, tasks, results):
+    ring = FrameRing(*layout[:3], name=layout[3])
+    decoders = {}
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        slot, header, nbytes = task
+        if header.codec not in decoders:
+            decoders[header.codec] = DECODERS[header.codec](None)
+        start_time = time.time()
+        frame = decoders[header.codec].decode(ring.payload(slot, nbytes), header)
+        if frame is None or frame.nbytes > ring.frame_bytes:
+            results.put((slot, None, time.time() - start_time))
+            continue
+        np.copyto(ring.frame(slot, frame.shape), frame)
+        results.put((slot, frame.shape, time.time() - start_time))
+    ring.close()
+
+# Decodes MJPEG and WebP frames in `workers` processes, so decoding 4K frames from many
+# cameras isn't limited by the ingest process. submit() copies the payload into a free
+# ring slot, a worker decodes it into the same slot, and the returned future resolves to a
+# numpy array over the slot. Only slot numbers, frame headers and shapes go through the
+# queues. The slot is freed once nothing references the frame any more.
+# A slot takes `max_payload` plus a decoded frame (26 MB at 4K). Anything that queues frames
+# has to copy them or it ties up slots: the FrameWriter gets copies (its queue holds up to 16
+# frames per camera), the jitter buffer copies on put. A camera then holds about three
+# slots, the frame being decoded, its latest frame in the FrameStore and the one inference
+# is working on, so `slots` should be at least three per camera. When every slot is held
+# for `acquire_timeout` seconds, or the payload or frame doesn't fit in a slot, the frame is
+# decoded in the calling process instead.
+class DecodePool:
+    def __init__(self, workers=None, slots=None, max_width=3840, max_height=1920, max_payload=4_000_000, acquire_timeout=0.1):
+        self.workers = workers or os.cpu_count()
+        self.ring = FrameRing(slots or 2 * self.workers + 8, max_payload, max_width * max_height * 3)
+        self.acquire_timeout = acquire_timeout
+        self.free = queue.Queue()
+        for slot in range(self.ring.num_slots):
+            self.free.put(slot)
+        self.pending = {} # slot -> future
+        self.lock = threading.Lock()
+        self.decoded = 0
+        self.fallback = 0
+        self.decode_time = 0
+        # Spawned, not forked, the ingest process has threads running
+        context = multiprocessing.get_context('spawn')
+        self.tasks = context.Queue()
+        self.results = context.Queue()
+        self.processes = [context.Process(target=decode_worker, args=(self.ring.layout(), self.tasks, self.results), daemon=True)
+                          for _ in range(self.workers)]
+        for process in self.processes:
+            process.start()
+        threading.Thread(target=self.collect, daemon=True).start()
+
+    def accepts(self, streamer):
+        return streamer.codec in DECODERS
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def submit(self, streamer, header, payload):
+        nbytes = memoryview(payload).nbytes
+        slot = None
+        if nbytes <= self.ring.payload_bytes and header.width * header.height * 3 <= self.ring.frame_bytes:
+            try:
+                slot = self.free.get(timeout=self.acquire_timeout)
+            except queue.Empty:
+                pass
+        future = Future()
+        if slot is None:
+            with self.lock:
+                self.fallback += 1
+            future.set_result(streamer.decode(payload, header))
+            return future
+        self.ring.payload(slot, nbytes)[:] = payload
+        with self.lock:
+            self.pending[slot] = future
+        self.tasks.put((slot, header, nbytes))
+        return future
+
+    def decode(self, streamer, header, payload):
+        return self.submit(streamer, header, payload).result()
+
+    def collect(self):
+        while True:
+            try:
+                result = self.results.get()
+            except (EOFError, OSError): # pool closed
+                return
+            self.finish(*result)
+
+    # A separate call so this thread doesn't keep the last frame, and its slot, alive
+    def finish(self, slot, shape, decode_time):
+        with self.lock:
+            future = self.pending.pop(slot)
+            self.decoded += 1
+            self.decode_time += decode_time
+        if shape is None:
+            self.release(slot)
+            future.set_result(None)
+            return
+        frame = self.ring.frame(slot, shape)
+        weakref.finalize(frame, self.release, slot)
+        future.set_result(frame)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'slots': self.ring.num_slots,
+                'slots_free': self.free.qsize(),
+                'frames_decoded': self.decoded,
+                'frames_decoded_in_process': self.fallback,
+                'mean_decode_ms': self.decode_time / self.decoded * 1000 if self.decoded else 0,
+            }
+
+    def close(self):
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.ring.close()
+        self.ring.shm.unlink()
@@ -4,138 +4,175 @@ import numpy as np
 WIDTH = 960
 HEIGHT = 480
 
+# Resizes and converts the frame once and derives all three feature maps from the same
+# grayscale image, instead of calculate_edge/corner/contour_density each redoing it
 def calculate_compression_profile(frame, num_rows, num_cols):
-    edge_density = calculate_edge_density(frame, num_rows, num_cols)
-    corner_density = calculate_corner_density(frame, num_rows, num_cols)
-    contour_density = calculate_contour_density(frame, num_rows, num_cols)
-
-    combined_density = np.array([edge_density, corner_density, contour_density])
-    average_density = np.mean(combined_density, axis=0)
-
-    return average_density
-
-def calculate_edge_density(image, num_rows, num_cols):
+    return profile_from_maps(*feature_maps(preprocess(frame)), num_rows, num_cols)
+
+# The three maps are binary, so the mean of their per-tile densities is the per-tile mean
+# of their summed masks divided by three. Corners are cut at 1% of the strongest corner in
+# the whole image.
+def profile_from_maps(counts, corners, num_rows, num_cols):
+    features = counts + (corners > 0.01 * corners.max())
+    return grid_mean(features, num_rows, num_cols) / 3
+
+# The number of edge and contour maps each pixel is set in, and the Harris response
+# before thresholding, so the threshold can be taken over the whole image later
+def feature_maps(gray):
+    counts = (edge_map(gray) != 0).astype(np.uint8)
+    counts += contour_map(gray) != 0
+    return counts, corner_response(gray)
+
+# Feature maps for a single tile, computed from the tile's share of the 960x480 working
+# image plus a margin so features on the tile border see roughly the same neighbourhood.
+# Returns the tile's (y, x) slices of the working image and its maps over them.
+def tile_feature_maps(frame, num_rows, num_cols, row, col, margin=8):
+    ys = grid_bounds(HEIGHT, num_rows)
+    xs = grid_bounds(WIDTH, num_cols)
+    y0, y1 = max(ys[row] - margin, 0), min(ys[row + 1] + margin, HEIGHT)
+    x0, x1 = max(xs[col] - margin, 0), min(xs[col + 1] + margin, WIDTH)
+
+    scale_y, scale_x = frame.shape[0] / HEIGHT, frame.shape[1] / WIDTH
+    crop = frame[round(y0 * scale_y):round(y1 * scale_y), round(x0 * scale_x):round(x1 * scale_x)]
+    gray = cv2.cvtColor(cv2.resize(crop, (x1 - x0, y1 - y0)), cv2.COLOR_BGR2GRAY)
+
+    counts, corners = feature_maps(gray)
+    inner = (slice(ys[row] - y0, ys[row + 1] - y0), slice(xs[col] - x0, xs[col + 1] - x0))
+    return (slice(ys[row], ys[row + 1]), slice(xs[col], xs[col + 1])), counts[inner], corners[inner]
+
+def preprocess(frame):
     # Resize
-    image = cv2.resize(image, (WIDTH, HEIGHT))
+    image = cv2.resize(frame, (WIDTH, HEIGHT))
 
     # Convert image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
+def edge_map(gray):
     # Apply Canny Edge Detector
-    edges = cv2.Canny(gray, 100, 200)
-
-    # Get dimensions of the image
-    height, width = edges.shape
-
-    # Size of each tile
-    tile_width = width // num_cols
-    tile_height = height // num_rows
-
-    # Initialize the matrix to store edge densities
-    edge_density_matrix = np.zeros((num_rows, num_cols))
-
-    # Process each tile
-    for i in range(num_rows):
-        for j in range(num_cols):
-            # Calculate tile boundaries
-            start_x, end_x = j * tile_width, min((j + 1) * tile_width, width)
-            start_y, end_y = i * tile_height, min((i + 1) * tile_height, height)
-
-            # Extract tile
-            tile = edges[start_y:end_y, start_x:end_x]
-
-            # Calculate edge density
-            edge_density = np.count_nonzero(tile) / (tile.size)
-            edge_density_matrix[i, j] = edge_density
+    return cv2.Canny(gray, 100, 200)
 
-    return edge_density_matrix
-
-def calculate_corner_density(image, num_rows, num_cols):
-    # Resize
-    image = cv2.resize(image, (WIDTH, HEIGHT))
-
-    # Convert image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def corner_response(gray):
+    # Apply Harris Corner Detector
+    corners = cv2.cornerHarris(np.float32(gray), 2, 3, 0.04)
+    return cv2.dilate(corners, None)
 
+def corner_response(gray):
     # Apply Harris Corner Detector
-    gray = np.float32(gray)
-    corners = cv2.cornerHarris(gray, 2, 3, 0.04)
+    corners = cv2.cornerHarris(np.float32(gray), 2, 3, 0.04)
+    return cv2.dilate(corners, None)
+
+def corner_map(gray):
+    corners = corner_response(gray)
 
     # Threshold for an optimal value, it may vary depending on the image
-    corners = cv2.dilate(corners, None)
     ret, corners = cv2.threshold(corners, 0.01 * corners.max(), 255, 0)
-    corners = np.uint8(corners)
-
-    # Get dimensions of the image
-    height, width = corners.shape
-
-    # Size of each tile
-    tile_width = width // num_cols
-    tile_height = height // num_rows
-
-    # Initialize the matrix to store corner densities
-    corner_density_matrix = np.zeros((num_rows, num_cols))
-
-    # Process each tile
-    for i in range(num_rows):
-        for j in range(num_cols):
-            # Calculate tile boundaries
-            start_x, end_x = j * tile_width, min((j + 1) * tile_width, width)
-            start_y, end_y = i * tile_height, min((i + 1) * tile_height, height)
-
-            # Extract tile
-            tile = corners[start_y:end_y, start_x:end_x]
-
-            # Calculate corner density
-            corner_density = np.count_nonzero(tile) / (tile.size)
-            corner_density_matrix[i, j] = corner_density
-
-    return corner_density_matrix
-
-def calculate_contour_density(image, num_rows, num_cols):
-    # Resize
-    image = cv2.resize(image, (WIDTH, HEIGHT))
-
-    # Convert image to grayscale
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return np.uint8(corners)
 
+def contour_map(gray):
     # Apply threshold to find contours
     ret, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
 
     # Find contours
     contours, hierarchy = cv2.findContours(thresh, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
 
-    # Create an empty image to draw contours
+    # Draw contours on an empty image
     contour_img = np.zeros_like(gray)
-
-    # Draw contours
     cv2.drawContours(contour_img, contours, -1, (255, 255, 255), 1)
+    return contour_img
+
+# Tile boundaries along one axis. When the length doesn't divide evenly the leftover
+# pixels are spread over the tiles instead of being dropped from the last one.
+def grid_bounds(length, num):
+    return np.arange(num + 1) * length // num
+
+# Mean of a single-channel image over each tile of a num_rows x num_cols grid. Tile sums
+# come from four lookups into the integral image, so the cost is one pass over the image
+# whatever the grid size.
+def grid_mean(image, num_rows, num_cols):
+    if image.dtype == bool:
+        image = image.view(np.uint8)
+    integral = cv2.integral(image)
+
+    ys = grid_bounds(image.shape[0], num_rows)
+    xs = grid_bounds(image.shape[1], num_cols)
+    corners = integral[np.ix_(ys, xs)]
+    sums = corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+
+    return sums / np.outer(np.diff(ys), np.diff(xs))
+
+# Reuses the compression profile across frames. Every frame is compared against a small
+# thumbnail of what each tile looked like when it was last profiled, and only tiles whose
+# mean absolute difference is above `threshold` get their feature maps recomputed. The
+# maps of the whole working image are kept, so the profile is always cut at the corner
+# threshold of the whole image, as calculate_compression_profile does, and recomputed
+# tiles are scored on the same scale as reused ones. Everything is recomputed every
+# `refresh_interval` frames.
+class ProfileCache:
+    def __init__(self, num_rows, num_cols, threshold=4.0, refresh_interval=30, thumbnail_step=16):
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.thumbnail_step = thumbnail_step
+        self.counts = None # edge and contour maps of the working image, see feature_maps
+        self.corners = None # Harris response of the working image
+        self.reference = None
+        self.age = np.zeros((num_rows, num_cols), dtype=int) # frames since each tile was profiled
+        self.frames_since_refresh = 0
+        self.tiles_reused = 0
+        self.tiles_computed = 0
+        self.last_computed = 0
+
+    @property
+    def hit_rate(self):
+        total = self.tiles_reused + self.tiles_computed
+        return self.tiles_reused / total if total else 0
+
+    @property
+    def staleness(self):
+        return int(self.age.max())
+
+    def thumbnail(self, frame):
+        # Strided subsample, a cheap stand-in for a proper resize of the 4K frame
+        step = self.thumbnail_step
+        return cv2.cvtColor(np.ascontiguousarray(frame[::step, ::step]), cv2.COLOR_BGR2GRAY)
+
+    def get(self, frame):
+        thumbnail = self.thumbnail(frame)
+        if self.counts is None or self.frames_since_refresh >= self.refresh_interval or thumbnail.shape != self.reference.shape:
+            self.counts, self.corners = feature_maps(preprocess(frame))
+            self.reference = thumbnail
+            self.frames_since_refresh = 0
+            changed = np.ones((self.num_rows, self.num_cols), dtype=bool)
+        else:
+            changed = grid_mean(cv2.absdiff(thumbnail, self.reference), self.num_rows, self.num_cols) > self.threshold
+            ys = grid_bounds(thumbnail.shape[0], self.num_rows)
+            xs = grid_bounds(thumbnail.shape[1], self.num_cols)
+            for i, j in zip(*np.nonzero(changed)):
+                tile, counts, corners = tile_feature_maps(frame, self.num_rows, self.num_cols, i, j)
+                self.counts[tile], self.corners[tile] = counts, corners
+                self.reference[ys[i]:ys[i + 1], xs[j]:xs[j + 1]] = thumbnail[ys[i]:ys[i + 1], xs[j]:xs[j + 1]]
+
+        self.age += 1
+        self.age[changed] = 0
+        self.frames_since_refresh += 1
+        self.last_computed = int(np.count_nonzero(changed))
+        self.tiles_computed += self.last_computed
+        self.tiles_reused += changed.size - self.last_computed
+        # A new array every call, the caller may still be sending the last one
+        return profile_from_maps(self.counts, self.corners, self.num_rows, self.num_cols)
 
-    # Get dimensions of the image
-    height, width = contour_img.shape
-
-    # Size of each tile
-    tile_width = width // num_cols
-    tile_height = height // num_rows
-
-    # Initialize the matrix to store contour densities
-    contour_density_matrix = np.zeros((num_rows, num_cols))
-
-    # Process each tile
-    for i in range(num_rows):
-        for j in range(num_cols):
-            # Calculate tile boundaries
-            start_x, end_x = j * tile_width, min((j + 1) * tile_width, width)
-            start_y, end_y = i * tile_height, min((i + 1) * tile_height, height)
-
-            # Extract tile
-            tile = contour_img[start_y:end_y, start_x:end_x]
+def calculate_edge_density(image, num_rows, num_cols):
+    edges = edge_map(preprocess(image))
+    return grid_mean(edges != 0, num_rows, num_cols)
 
-            # Calculate contour density
-            contour_density = np.count_nonzero(tile) / (tile.size)
-            contour_density_matrix[i, j] = contour_density
+def calculate_corner_density(image, num_rows, num_cols):
+    corners = corner_map(preprocess(image))
+    return grid_mean(corners != 0, num_rows, num_cols)
 
-    return contour_density_matrix
+def calculate_contour_density(image, num_rows, num_cols):
+    contour_img = contour_map(preprocess(image))
+    return grid_mean(contour_img != 0, num_rows, num_cols)
 
 
 def label_edges(image_path, output_path):
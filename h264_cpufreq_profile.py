@@ -6,13 +6,14 @@ import time
 import json
 import socket
 from datetime import datetime
-import struct
 from collections import defaultdict
 
 mod_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'streamers', 'ffenc_uiuc'))
 if mod_dir not in sys.path:
     sys.path.append(mod_dir)
 from streamers.ffenc_uiuc import ffenc
+from streamers.framing import FrameSender
+from streamers import protocol
 
 # Scaling governor must be set to userspace
 # `sh -c 'sudo cpufreq-set -g userspace'`
@@ -39,6 +40,10 @@ def profile(sock=None, cycles=1, replay_forever=False):
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     encoder = ffenc.ffenc(width, height, fps)
+    sender = None
+    if sock:
+        protocol.send_hello(sock, protocol.CODEC_H264, 0, fps, width, height) # Tell server we are streaming with h264
+        sender = FrameSender(sock)
 
     # FREQS = [15 * 10**5, 16 * 10**5, 17 * 10**5, 18 * 10**5, 19 * 10**5, 20 * 10**5,
     #          21 * 10**5, 22 * 10**5, 23 * 10**5, 24 * 10**5] # In KHz
@@ -78,11 +83,10 @@ def profile(sock=None, cycles=1, replay_forever=False):
                     total_frames += 1
                     
                     out = encoder.process_frame(frame)
-                    if sock:
+                    if sender:
                         start_time = time.time()
-                        sock.sendall(struct.pack('!d', start_time))
-                        sock.sendall(struct.pack('!I', out.shape[0]))
-                        sock.sendall(out.tobytes())
+                        header = protocol.FRAME_HEADER.pack(protocol.CODEC_H264, 0, 1, 1, 0, width, height, total_frames - 1, start_time, out.shape[0])
+                        sender.send([header, out])
                 except:
                     break
         
@@ -139,5 +143,4 @@ if __name__ == '__main__':
     # profile(cycles=10)
 
     if client_socket:
-        client_socket.sendall(struct.pack('B', 0x8)) # Tell server we are streaming with h264
         profile(sock=client_socket, replay_forever=True)
\ No newline at end of file
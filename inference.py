@@ -0,0 +1,292 @@
+import threading
+import time
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from feature import grid_bounds
+from streamers.base import pixels
+
+# Pixels the model runs on for an image: predict letterboxes it to `imgsz` on its long side,
+# rounded up to the stride, so a square crop costs more than a whole 2:1 frame
+def model_input_pixels(width, height, imgsz=640, stride=32):
+    scale = imgsz / max(width, height)
+    return -(-int(width * scale) // stride) * stride * (-(-int(height * scale) // stride) * stride)
+
+# Pixel boxes (x0, y0, x1, y1) to run detection on for a frame with the given per-tile
+# feature densities: tiles with at least `fraction` of the highest density, grouped into
+# rectangles of tiles (runs in a row, then runs in neighbouring rows that share columns),
+# each grown by `margin` so objects on a tile edge aren't cut off. None if no tile has any
+# features, if the crops would cover more than `max_area` of the frame or if they would
+# cost the model more than the whole frame does, the frame is then inferred whole in one pass.
+def roi_crops(shape, densities, fraction=0.25, margin=32, max_area=0.6, imgsz=640):
+    height, width = shape[:2]
+    num_rows, num_cols = densities.shape
+    if densities.max() <= 0:
+        return None
+    selected = densities >= fraction * densities.max()
+    # Tile rectangles (col0, row0, col1, row1), end exclusive
+    rects = []
+    for row in range(num_rows):
+        col = 0
+        while col < num_cols:
+            if not selected[row, col]:
+                col += 1
+                continue
+            start = col
+            while col < num_cols and selected[row, col]:
+                col += 1
+            rects.append((start, row, col, row + 1))
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                # Touching vertically and sharing columns, or touching horizontally and sharing rows
+                if (a[1] <= b[3] and b[1] <= a[3] and a[0] < b[2] and b[0] < a[2]) or \
+                        (a[0] <= b[2] and b[0] <= a[2] and a[1] < b[3] and b[1] < a[3]):
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    ys = grid_bounds(height, num_rows)
+    xs = grid_bounds(width, num_cols)
+    crops = [(max(int(xs[col0]) - margin, 0), max(int(ys[row0]) - margin, 0),
+              min(int(xs[col1]) + margin, width), min(int(ys[row1]) + margin, height))
+             for col0, row0, col1, row1 in rects]
+    if sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in crops) > max_area * width * height:
+        return None
+    if sum(model_input_pixels(x1 - x0, y1 - y0, imgsz) for x0, y0, x1, y1 in crops) >= model_input_pixels(width, height, imgsz):
+        return None
+    return crops
+
+# Boxes of the crop results moved back into frame coordinates, with duplicates from
+# overlapping margins removed by per-class NMS. Returns (boxes xyxy, scores, classes).
+def merge_detections(results, offsets, iou=0.5):
+    boxes, scores, classes = [np.zeros((0, 4))], [np.zeros(0)], [np.zeros(0, int)]
+    for result, (x, y) in zip(results, offsets):
+        boxes.append(result.boxes.xyxy.cpu().numpy() + [x, y, x, y])
+        scores.append(result.boxes.conf.cpu().numpy())
+        classes.append(result.boxes.cls.cpu().numpy().astype(int))
+    boxes, scores, classes = np.concatenate(boxes), np.concatenate(scores), np.concatenate(classes)
+    if len(offsets) > 1 and len(boxes):
+        xywh = np.hstack([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]])
+        keep = np.array(cv2.dnn.NMSBoxesBatched(xywh.tolist(), scores.tolist(), classes.tolist(), 0, iou), int).flatten()
+        boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+    return boxes, scores, classes
+
+EMPTY_DETECTIONS = (np.zeros((0, 4)), np.zeros(0), np.zeros(0, int))
+
+def draw_detections(frame, detections, names):
+    annotated = frame.copy()
+    for (x0, y0, x1, y1), score, cls in zip(*detections):
+        cv2.rectangle(annotated, (int(x0), int(y0)), (int(x1), int(y1)), (0, 255, 0), 2)
+        cv2.putText(annotated, f'{names[cls]} {score:.2f}', (int(x0), max(int(y0) - 4, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+    return annotated
+
+# One YOLO model shared by every camera and viewer. A single worker thread waits on the
+# FrameStore until a camera that has viewers has a frame it hasn't run on yet, collects the
+# new frames of every such camera into a batch (waiting at most `max_wait` seconds for more
+# cameras once the first one is ready) and runs one predict call for the whole batch.
+# Frames that were replaced before the worker got to them are never inferred. Viewers wait
+# on wait_result() for a newer annotated frame than the one they last showed, so every
+# viewer of a camera gets the same cached result.
+# Frames that came with per-tile feature densities (TileSpatial cameras) are only inferred
+# on their feature-dense tiles when `roi` is set: the crops from roi_crops() go into the
+# batch as separate images and their boxes are mapped back onto the frame.
+class InferenceService:
+    def __init__(self, store, model=None, weights='yolov8n.pt', max_batch=8, max_wait=0.02, device='cpu', roi=True, roi_fraction=0.25, roi_margin=32, roi_max_area=0.6):
+        self.store = store
+        self.model = model
+        self.weights = weights
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.device = device
+        self.roi = roi
+        self.roi_fraction = roi_fraction
+        self.roi_margin = roi_margin
+        self.roi_max_area = roi_max_area
+        # Shares the store's condition, so one wait covers new frames, new viewers and new results
+        self.cond = store.cond
+        self.inferred = {} # camera id -> version of the last frame inferred
+        self.results = {} # camera id -> (version, annotated frame, (boxes, scores, classes))
+        self.subscribers = {}
+        self.inferences = 0
+        self.batches = 0
+        self.inference_time = 0
+        self.frames_skipped = 0
+        self.roi_frames = 0
+        self.roi_area = 0
+        self.failed_batches = 0
+        self.frames_not_decoded = 0
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def load_model(self):
+        if self.model is None:
+            self.model = YOLO(self.weights)
+        return self.model
+
+    def subscribe(self, camera_id):
+        with self.cond:
+            self.subscribers[camera_id] = self.subscribers.get(camera_id, 0) + 1
+            self.cond.notify_all()
+
+    def unsubscribe(self, camera_id):
+        with self.cond:
+            self.subscribers[camera_id] -= 1
+            if self.subscribers[camera_id] == 0:
+                del self.subscribers[camera_id]
+                self.inferred.pop(camera_id, None) # frames nobody watched don't count as skipped
+
+    # Drops a disconnected camera's last result, viewers unsubscribe as their streams end
+    def remove(self, camera_id):
+        with self.cond:
+            self.results.pop(camera_id, None)
+            self.inferred.pop(camera_id, None)
+
+    # Blocks until the camera has a result newer than `version`, returns (version,
+    # annotated frame), or None after `timeout` seconds
+    def wait_result(self, camera_id, version=0, timeout=None):
+        with self.cond:
+            ready = self.cond.wait_for(lambda: self.results.get(camera_id, (0,))[0] > version, timeout)
+            if not ready:
+                return None
+            version, annotated, _ = self.results[camera_id]
+            return version, annotated
+
+    def ready_cameras(self):
+        ready = []
+        for camera_id in self.subscribers:
+            version, frame = self.store.frames.get(camera_id, (0, None))
+            if version > self.inferred.get(camera_id, 0):
+                ready.append((camera_id, version, frame, self.store.densities.get(camera_id)))
+        return ready
+
+    def next_batch(self):
+        with self.cond:
+            ready = self.cond.wait_for(self.ready_cameras)
+            deadline = time.time() + self.max_wait
+            while len(ready) < min(self.max_batch, len(self.subscribers)):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+                ready = self.ready_cameras()
+            batch = ready[:self.max_batch]
+            for camera_id, version, _, _ in batch:
+                if camera_id in self.inferred:
+                    self.frames_skipped += version - self.inferred[camera_id] - 1
+                self.inferred[camera_id] = version
+            return batch
+
+    # Runs one batch, returns (annotated frame, detections) per camera in the batch, None
+    # for frames that couldn't be decoded
+    def infer(self, batch):
+        model = self.load_model()
+        start = time.time()
+        frames, images, offsets, roi_frames, roi_area = [], [], [], [], 0
+        for _, _, frame, densities in batch:
+            frame = pixels(frame)
+            frames.append(frame)
+            if frame is None:
+                continue
+            crops = roi_crops(frame.shape, densities, self.roi_fraction, self.roi_margin, self.roi_max_area) if self.roi and densities is not None else None
+            roi_frames.append(crops is not None)
+            if crops is None:
+                crops = [(0, 0, frame.shape[1], frame.shape[0])]
+            else:
+                roi_area += sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in crops) / (frame.shape[0] * frame.shape[1])
+            images += [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in crops]
+            offsets.append([(x0, y0) for x0, y0, _, _ in crops])
+        results = model.predict(images, device=self.device, verbose=False) if images else []
+
+        outputs = []
+        idx = 0
+        decoded = iter(zip(offsets, roi_frames))
+        for frame in frames:
+            if frame is None:
+                outputs.append(None)
+                continue
+            frame_offsets, is_roi = next(decoded)
+            frame_results = results[idx:idx + len(frame_offsets)]
+            idx += len(frame_offsets)
+            detections = merge_detections(frame_results, frame_offsets)
+            if not is_roi:
+                annotated = frame_results[0].plot() # Visualize the results on the frame
+            else:
+                annotated = draw_detections(frame, detections, model.names)
+            outputs.append((annotated, detections))
+        inference_time = time.time() - start
+        print(f'Pred time: {inference_time} for {len(batch)} frames ({len(images)} images)')
+
+        with self.cond:
+            self.roi_frames += sum(roi_frames)
+            self.roi_area += roi_area
+            self.inferences += len(offsets)
+            self.batches += 1
+            self.inference_time += inference_time
+        return outputs
+
+    # A batch that fails (missing weights, a predict error) is logged and its cameras get
+    # their frames without detections, so viewers waiting on them keep going and the
+    # worker moves on to the next batch
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                outputs = self.infer(batch)
+            except Exception as e:
+                print(f'Inference failed for {len(batch)} frames: {e!r}')
+                outputs = []
+                for _, _, frame, _ in batch:
+                    try:
+                        frame = pixels(frame)
+                    except Exception:
+                        frame = None
+                    outputs.append((frame, EMPTY_DETECTIONS) if frame is not None else None)
+                with self.cond:
+                    self.failed_batches += 1
+
+            with self.cond:
+                for (camera_id, _, _, _), output in zip(batch, outputs):
+                    if output is None: # nothing to show, the next frame will be tried
+                        self.frames_not_decoded += 1
+                        continue
+                    if camera_id not in self.store.frames: # disconnected while in the batch
+                        continue
+                    version = self.results.get(camera_id, (0,))[0] + 1
+                    self.results[camera_id] = (version, output[0], output[1])
+                self.cond.notify_all()
+
+    # Frames skipped are frames replaced by a newer one before the worker got to them.
+    # `frames_shared` is how many extra viewers got a result someone else also got (see
+    # Broadcaster.frames_shared), each of which the old per-viewer video_feed would have
+    # inferred again. The CPU saved is estimated from the mean inference time per frame.
+    # roi_area_fraction is the mean share of a frame's pixels that went through the model
+    # for frames inferred on their tiles.
+    def stats(self, frames_shared=0):
+        with self.cond:
+            time_per_inference = self.inference_time / self.inferences if self.inferences else 0
+            return {
+                'inferences': self.inferences,
+                'batches': self.batches,
+                'mean_batch_size': self.inferences / self.batches if self.batches else 0,
+                'inferences_per_sec': 1 / time_per_inference if time_per_inference else 0,
+                'frames_skipped': self.frames_skipped,
+                'inferences_avoided': frames_shared,
+                'cpu_saved_sec': frames_shared * time_per_inference,
+                'roi_frames': self.roi_frames,
+                'roi_area_fraction': self.roi_area / self.roi_frames if self.roi_frames else 1,
+                'failed_batches': self.failed_batches,
+                'frames_not_decoded': self.frames_not_decoded,
+            }
@@ -0,0 +1,174 @@
+import asyncio
+import os
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from streamers import mjpeg, basic, tile_spatial, webp
+from streamers import protocol
+from streamers.protocol import HELLO, CODEC_BASIC, CODEC_MJPEG, CODEC_WEBP, CODEC_TILED, CODEC_H264, CODEC_NAMES, STATUS_OK, STATUS_BAD_VERSION, STATUS_BAD_CODEC
+from logger import Logger
+from persist import FrameWriter
+from sessions import SessionRegistry
+
+mod_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'streamers', 'ffenc_uiuc'))
+if mod_dir not in sys.path:
+    sys.path.append(mod_dir)
+try:
+    from streamers.ffenc_uiuc import h264
+except ImportError: # ffenc/ffdec extensions not built on this machine
+    h264 = None
+
+# Every connection of this process, from either ingest loop
+sessions = SessionRegistry()
+
+def stream_name(hello):
+    if hello.codec in (CODEC_MJPEG, CODEC_WEBP):
+        return f'{CODEC_NAMES[hello.codec]}{hello.quality}'
+    if hello.codec == CODEC_H264 and hello.bitrate:
+        return f'h264_{hello.bitrate // 1000}M'
+    return CODEC_NAMES[hello.codec]
+
+def create_streamer(hello, client_socket, session):
+    logger = Logger(f'./{session.name}_logs_{session.camera_id}.ndjson')
+    IMGS_PATH = f'./received_imgs_{session.name}_{session.camera_id}/'
+
+    if hello.codec == CODEC_BASIC:
+        streamer = basic.Basic(client_socket, logger=logger)
+    elif hello.codec == CODEC_MJPEG:
+        streamer = mjpeg.Mjpeg(client_socket, qf=hello.quality, logger=logger)
+    elif hello.codec == CODEC_WEBP:
+        streamer = webp.Webp(client_socket, qf=hello.quality, logger=logger)
+    elif hello.codec == CODEC_TILED:
+        streamer = tile_spatial.TileSpatial(client_socket, logger=logger)
+    elif hello.codec == CODEC_H264:
+        streamer = h264.H264(client_socket, logger=logger)
+
+    return streamer, logger, IMGS_PATH
+
+def accept_hello(data):
+    hello, status = protocol.parse_hello(data)
+    if status is None:
+        print('Client did not send a protocol handshake')
+    elif status == STATUS_BAD_VERSION:
+        print(f'Client speaks protocol version {hello.version}, expected {protocol.PROTOCOL_VERSION}')
+    elif status == STATUS_BAD_CODEC or (hello.codec == CODEC_H264 and h264 is None):
+        print('Unsupported compression algorithm!')
+        status = STATUS_BAD_CODEC
+    else:
+        print(f'codec: {CODEC_NAMES[hello.codec]}, quality: {hello.quality}, resolution: {hello.width}x{hello.height}')
+    return hello, status
+
+# Registers an accepted HELLO, returns the session (None if rejected) and the WELCOME to send
+def register_session(hello, status, addr):
+    session = sessions.register(addr, stream_name(hello), hello) if status == STATUS_OK else None
+    if session:
+        print(f'Session {session.id}: {session.camera_id}')
+    return session, protocol.pack_welcome(status, session.id if session else 0)
+
+def log_summary(streamer, logger, frame_idx, total_time, writer=None):
+    streamer.flush_frame_log()
+    summary = {
+        'Frames read': frame_idx,
+        'Total time': total_time,
+        'Total MB received': streamer.nbytes_received / 1_000_000,
+        'Overall FPS': frame_idx / total_time,
+        'Overall Bandwidth Mbps': (streamer.nbytes_received * 8 / 1_000_000) / total_time,
+        'Frames dropped': streamer.frames_dropped,
+        'Frames reordered': streamer.frames_reordered
+    }
+    if writer:
+        summary.update(writer.stats())
+    logger.log(summary)
+    logger.close()
+
+# One coroutine per camera replaces the thread-per-client handle_client. Socket reads
+# are awaited on the event loop, decoding and disk writes run on the shared executor.
+# Each connection awaits its own frame before reading the next one, so the executor
+# never holds more than one pending decode per camera.
+async def handle_client_async(reader, writer, executor, on_frame=None, on_disconnect=None, save_frames=True, frame_format='jpg', frame_policy='block', lazy_decode=False, decode_pool=None):
+    addr = writer.get_extra_info('peername')
+    loop = asyncio.get_running_loop()
+
+    try:
+        hello, status = accept_hello(await reader.readexactly(HELLO.size))
+    except asyncio.IncompleteReadError:
+        writer.close()
+        return
+    session, reply = register_session(hello, status, addr)
+    if status is not None:
+        writer.write(reply)
+        await writer.drain()
+    if status != STATUS_OK:
+        writer.close()
+        return
+
+    streamer, logger, IMGS_PATH = create_streamer(hello, None, session)
+    streamer.feedback = writer.write
+    try:
+        await streamer.sync_clock_async(reader)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        print("Client disconnected during time sync")
+        sessions.unregister(session)
+        logger.close()
+        writer.close()
+        return
+
+    frame_writer = None
+    if save_frames:
+        frame_writer = FrameWriter(IMGS_PATH, fmt=frame_format, policy=frame_policy)
+        session.writer = frame_writer
+
+    # Pool frames hold a shared memory slot, the writer's queue gets copies
+    pooled = not lazy_decode and decode_pool is not None and decode_pool.accepts(streamer)
+    total_start_time = time.time()
+    frame_idx = 0
+    # Whatever ends the loop, the session, the camera's state, the writer and the log are cleaned up
+    try:
+        while True:
+            try:
+                if lazy_decode:
+                    frame = await streamer.get_lazy_frame_async(reader, executor)
+                elif pooled:
+                    received = await streamer.get_payload_async(reader)
+                    frame = await loop.run_in_executor(executor, decode_pool.decode, streamer, *received) if received else None
+                    streamer.frame_decoded()
+                else:
+                    frame = await streamer.get_frame_async(reader, executor)
+                if frame is None:
+                    raise ConnectionResetError
+                if streamer.frame_reused and not lazy_decode: # the streamer's buffers get overwritten, one copy for every consumer
+                    frame = await loop.run_in_executor(executor, frame.copy)
+                if on_frame:
+                    on_frame(session.camera_id, frame, streamer.last_densities, streamer.last_header.timestamp)
+                if frame_writer:
+                    # submit() can block on a full queue, keep that off the event loop
+                    await loop.run_in_executor(executor, frame_writer.submit, frame_idx, frame, streamer.last_header, streamer.last_payload, pooled)
+                frame_idx += 1
+            except (ConnectionResetError, BrokenPipeError, struct.error):
+                print("Client disconnected or error occurred")
+                break
+            except Exception as e: # e.g. a corrupt frame, drop the client rather than the coroutine
+                print(f'Error on frame {frame_idx} from {session.camera_id}: {e!r}')
+                break
+    finally:
+        if on_disconnect:
+            on_disconnect(session.camera_id)
+        sessions.unregister(session)
+        writer.close()
+        total_time = time.time() - total_start_time
+        if frame_writer:
+            await loop.run_in_executor(executor, frame_writer.close)
+        await loop.run_in_executor(executor, log_summary, streamer, logger, frame_idx, total_time, frame_writer)
+
+async def serve_async(host, port, max_workers=None, on_frame=None, on_disconnect=None, save_frames=True, started=None, frame_format='jpg', frame_policy='block', lazy_decode=False, decode_pool=None):
+    executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+
+    async def handler(reader, writer):
+        await handle_client_async(reader, writer, executor, on_frame, on_disconnect, save_frames, frame_format, frame_policy, lazy_decode, decode_pool)
+
+    server = await asyncio.start_server(handler, host, port, reuse_address=True)
+    if started:
+        started.set()
+    async with server:
+        await server.serve_forever()
@@ -0,0 +1,123 @@
+import threading
+import time
+import numpy as np
+from streamers.base import pixels
+
+# The last `capacity` decoded frames of one camera with their capture timestamps (the
+# client's send start time from the frame header), in one array allocated on the first
+# frame. Memory stays flat however bursty the camera is, and a frame size change
+# reallocates. put() copies each frame into the next slot.
+# next_frame() plays frames out at the rate they were captured: a frame is released
+# `delay` seconds after the fastest delivery seen so far would have brought it. If the
+# consumer falls behind, it skips to the newest frame that is due. Each consumer passes
+# the timestamp of the last frame it got, so several can play the same buffer.
+# frame_at() returns the frame that was current at a capture time.
+# The client and server clocks are assumed not to drift during a session, the offset
+# between them only ever goes down.
+class JitterBuffer:
+    def __init__(self, capacity=8, delay=0.1):
+        self.capacity = capacity
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.frames = None
+        self.timestamps = np.full(capacity, np.nan)
+        self.count = 0 # frames put since the buffer was allocated
+        self.received = 0
+        self.offset = None # smallest arrival time - capture time seen
+        self.played_timestamp = -np.inf
+        self.played = 0
+        self.skipped = 0
+        self.overwritten = 0
+        self.late = 0
+        self.total_lateness = 0
+        self.max_lateness = 0
+
+    def release_time(self, timestamp):
+        return timestamp + self.offset + self.delay
+
+    # Slots from oldest to newest
+    def slots(self):
+        num_frames = min(self.count, self.capacity)
+        return (self.count - num_frames + np.arange(num_frames)) % self.capacity
+
+    def put(self, frame, timestamp, arrival_time=None):
+        frame = pixels(frame)
+        arrival_time = time.time() if arrival_time is None else arrival_time
+        with self.cond:
+            if self.frames is None or self.frames.shape[1:] != frame.shape:
+                self.frames = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+                self.frames.fill(0) # commit every page now rather than as the slots first fill
+                self.timestamps[:] = np.nan
+                self.count = 0
+            slot = self.count % self.capacity
+            if self.timestamps[slot] > self.played_timestamp: # never played, the consumers are too slow
+                self.overwritten += 1
+            np.copyto(self.frames[slot], frame)
+            self.timestamps[slot] = timestamp
+            self.count += 1
+            self.received += 1
+
+            self.offset = arrival_time - timestamp if self.offset is None else min(self.offset, arrival_time - timestamp)
+            lateness = arrival_time - self.release_time(timestamp)
+            if lateness > 0:
+                self.late += 1
+                self.total_lateness += lateness
+                self.max_lateness = max(self.max_lateness, lateness)
+            self.cond.notify_all()
+
+    # Blocks until the next frame captured after `after` is due, returns (capture
+    # timestamp, frame copy), or None after `timeout` seconds
+    def next_frame(self, after=-np.inf, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.cond:
+            while True:
+                now = time.time()
+                due, num_due, upcoming = None, 0, None
+                for slot in self.slots():
+                    timestamp = self.timestamps[slot]
+                    if timestamp <= after:
+                        continue
+                    if self.release_time(timestamp) > now:
+                        upcoming = self.release_time(timestamp)
+                        break
+                    due, num_due = slot, num_due + 1
+                if due is not None:
+                    self.skipped += num_due - 1
+                    self.played += 1
+                    self.played_timestamp = max(self.played_timestamp, self.timestamps[due])
+                    return self.timestamps[due], self.frames[due].copy()
+
+                wait = upcoming - now if upcoming is not None else None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.cond.wait(wait)
+
+    # The newest frame captured at or before `timestamp` as (capture timestamp, frame copy),
+    # or None if it is older than the buffer
+    def frame_at(self, timestamp):
+        with self.cond:
+            slots = self.slots()
+            idx = np.searchsorted(self.timestamps[slots], timestamp, side='right') - 1
+            if idx < 0:
+                return None
+            slot = slots[idx]
+            return self.timestamps[slot], self.frames[slot].copy()
+
+    # Occupancy is frames buffered that no consumer has played yet. Lateness is how long
+    # after its release time a frame arrived.
+    def stats(self):
+        with self.cond:
+            slots = self.slots()
+            return {
+                'capacity': self.capacity,
+                'occupancy': int(np.sum(self.timestamps[slots] > self.played_timestamp)),
+                'frames': self.received,
+                'played': self.played,
+                'skipped': self.skipped,
+                'overwritten_unplayed': self.overwritten,
+                'late_frames': self.late,
+                'mean_lateness_ms': self.total_lateness / self.late * 1000 if self.late else 0,
+                'max_lateness_ms': self.max_lateness * 1000,
+            }
@@ -1,14 +1,225 @@
 import json
+import os
+import pickle
+import queue
+import threading
+import time
+import numpy as np
 
-class Logger:
+# Newline-delimited JSON, one record per line. Appending to an existing file keeps it valid.
+class NdjsonSink:
     def __init__(self, log_path):
+        self.f = open(log_path, 'a')
+
+    def write(self, record):
+        self.f.write(json.dumps(record, default=to_builtin) + '\n')
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+# Compact binary output: records are buffered into chunks of `chunk_size` rows and each
+# chunk is appended as one pickled dict of columns. Numeric columns become numpy arrays
+# (NaN where a record doesn't have the field), anything else stays a list.
+class ColumnarSink:
+    def __init__(self, log_path, chunk_size=1024):
+        self.f = open(log_path, 'ab')
+        self.chunk_size = chunk_size
+        self.rows = []
+
+    def write(self, record):
+        self.rows.append(record)
+        if len(self.rows) >= self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if not self.rows:
+            return
+        # Taken off first, so a chunk that can't be pickled isn't retried on every write
+        rows, self.rows = self.rows, []
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        columns = {}
+        for key in keys:
+            values = [row.get(key) for row in rows]
+            if all(isinstance(value, (int, float, np.number)) and not isinstance(value, bool) for value in values if value is not None):
+                columns[key] = np.array([np.nan if value is None else value for value in values])
+            else:
+                columns[key] = values
+        pickle.dump({'rows': len(rows), 'columns': columns}, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def flush(self):
+        self.write_chunk()
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+SINKS = {
+    'ndjson': NdjsonSink,
+    'columnar': ColumnarSink,
+}
+
+def to_builtin(value):
+    # numpy scalars and arrays that end up in a log record
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Cannot log {type(value).__name__}')
+
+# log() only pushes the record onto a bounded queue, a background thread writes records
+# to the sink as they arrive and fsyncs at least every `fsync_interval` seconds, so a
+# crash loses at most that much. When the queue is full log() blocks, or drops the
+# record and counts it if `block` is False. A record the sink can't write is counted and
+# skipped, the thread must keep draining or log(), flush() and close() would wait forever.
+class Logger:
+    def __init__(self, log_path, fmt='ndjson', max_queue=4096, block=True, fsync_interval=5.0):
         self.log_path = log_path
-        self.logs = []
-    
+        self.sink = SINKS[fmt](log_path)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.block = block
+        self.fsync_interval = fsync_interval
+        self.dropped = 0
+        self.failed = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
     def log(self, logs):
-        self.logs.append(logs)
-    
+        try:
+            self.queue.put(logs, block=self.block)
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        last_sync = time.monotonic()
+        while True:
+            try:
+                items = [self.queue.get(timeout=self.fsync_interval)]
+            except queue.Empty:
+                items = []
+            # Take whatever else is already queued so a burst costs one wakeup
+            while items and len(items) < 512:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in items:
+                if isinstance(item, threading.Event): # flush() or close() waiting on us
+                    self.sync()
+                    last_sync = time.monotonic()
+                    item.set()
+                    if self.closed:
+                        self.sink.close()
+                        return
+                else:
+                    try:
+                        self.sink.write(item)
+                    except Exception as e:
+                        print(f'Failed to write log record to {self.log_path}: {e!r}')
+                        self.failed += 1
+
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                self.sync()
+                last_sync = time.monotonic()
+
+    # The columnar sink pickles its buffered chunk here, which can fail the same way
+    def sync(self):
+        try:
+            self.sink.flush()
+        except Exception as e:
+            print(f'Failed to flush log records to {self.log_path}: {e!r}')
+            self.failed += 1
+
     def flush(self):
-        with open(self.log_path, 'a') as f:
-            json.dump(self.logs, f, indent=4)
-        print(f'Saved logs to {self.log_path}')
\ No newline at end of file
+        if self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        if self.dropped:
+            print(f'Dropped {self.dropped} log records, queue was full')
+        if self.failed:
+            print(f'Failed to write {self.failed} log records')
+        print(f'Saved logs to {self.log_path}')
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+        self.thread.join()
+
+# Reads back any log file this Logger (or the old json.dump one) wrote as a list of dicts
+def read_logs(log_path):
+    return [record for chunk in iter_logs(log_path) for record in chunk]
+
+# The same records in lists of up to `chunk_size`, so a multi-hour log never has to be in
+# memory at once. Old JSON array logs are small and are read whole.
+def iter_logs(log_path, chunk_size=65536):
+    with open(log_path, 'rb') as f:
+        head = f.read(1)
+        f.seek(0)
+        if head == b'\x80': # pickle, columnar chunks
+            records = []
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    break
+                columns = chunk['columns']
+                for i in range(chunk['rows']):
+                    record = {}
+                    for key, values in columns.items():
+                        value = values[i]
+                        if isinstance(value, np.generic):
+                            if np.isnan(value):
+                                continue
+                            value = value.item()
+                        elif value is None:
+                            continue
+                        record[key] = value
+                    records.append(record)
+                if len(records) >= chunk_size:
+                    yield records
+                    records = []
+            if records:
+                yield records
+            return
+
+        line = f.readline()
+        while line and not line.strip():
+            line = f.readline()
+        if line.lstrip().startswith(b'['):
+            # Old format, a JSON array per run, possibly several appended to the same file
+            text = (line + f.read()).decode()
+            decoder = json.JSONDecoder()
+            records, idx = [], 0
+            while idx < len(text):
+                if text[idx].isspace():
+                    idx += 1
+                    continue
+                run, idx = decoder.raw_decode(text, idx)
+                records += run
+            for start in range(0, len(records), chunk_size):
+                yield records[start:start + chunk_size]
+            return
+
+        records = []
+        while line:
+            if line.strip():
+                records.append(json.loads(line))
+                if len(records) >= chunk_size:
+                    yield records
+                    records = []
+            line = f.readline()
+        if records:
+            yield records
@@ -0,0 +1,197 @@
+import os
+import queue
+import struct
+import threading
+import time
+import cv2
+import numpy as np
+from streamers.base import LazyFrame, pixels
+from streamers.protocol import CODEC_MJPEG, CODEC_WEBP, CODEC_H264, FRAME_HEADER, FrameHeader
+
+# File extension for each codec whose payload can be written to disk as received
+RAW_EXTENSIONS = {
+    CODEC_MJPEG: '.jpg',
+    CODEC_WEBP: '.webp',
+    CODEC_H264: '.h264',
+}
+
+FORMATS = ('jpg', 'png', 'npy', 'raw', 'segment')
+POLICIES = ('block', 'drop')
+
+SEGMENT_FILE = 'frames.seg'
+INDEX_FILE = 'frames.idx'
+# Frame index, offset of the frame header in the segment file, payload length
+INDEX_ENTRY = struct.Struct('!IQI')
+
+# Append-only recording of compressed frames. Each frame goes into the segment file as its
+# FRAME_HEADER followed by the payload, exactly as it came off the wire, and gets an entry
+# in the index file so single frames can be found without scanning.
+class SegmentWriter:
+    def __init__(self, imgs_path):
+        self.segment = open(os.path.join(imgs_path, SEGMENT_FILE), 'ab')
+        self.index = open(os.path.join(imgs_path, INDEX_FILE), 'ab')
+        self.offset = self.segment.tell()
+
+    def append(self, frame_idx, header, payload):
+        self.segment.write(FRAME_HEADER.pack(*header))
+        self.segment.write(payload)
+        self.index.write(INDEX_ENTRY.pack(frame_idx, self.offset, len(payload)))
+        self.offset += FRAME_HEADER.size + len(payload)
+
+    def close(self):
+        self.segment.close()
+        self.index.close()
+
+class SegmentReader:
+    def __init__(self, imgs_path):
+        with open(os.path.join(imgs_path, INDEX_FILE), 'rb') as f:
+            self.entries = {frame_idx: (offset, length) for frame_idx, offset, length in INDEX_ENTRY.iter_unpack(f.read())}
+        self.segment = open(os.path.join(imgs_path, SEGMENT_FILE), 'rb')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def frame_indices(self):
+        return sorted(self.entries)
+
+    def read(self, frame_idx):
+        offset, length = self.entries[frame_idx]
+        self.segment.seek(offset)
+        header = FrameHeader._make(FRAME_HEADER.unpack(self.segment.read(FRAME_HEADER.size)))
+        return header, self.segment.read(length)
+
+    # Pixels for one frame. H.264 frames can't be decoded on their own, decode those in
+    # order with the codec's streamer instead.
+    def decode(self, frame_idx):
+        header, payload = self.read(frame_idx)
+        if header.codec not in (CODEC_MJPEG, CODEC_WEBP):
+            raise ValueError(f'Frame {frame_idx} can only be decoded as part of its stream')
+        return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+
+    def close(self):
+        self.segment.close()
+
+# Saves received frames off the receive path. submit() puts the frame on a bounded queue
+# and a pool of writer threads encodes and writes it. When the queue is full, 'block'
+# makes submit() wait (backing up the camera's TCP connection), 'drop' skips the frame.
+# With fmt='raw' the compressed payload is written as received for MJPEG, WebP and H.264,
+# one file per frame, and with fmt='segment' it is appended to a SegmentWriter. Other
+# codecs fall back to re-encoding as JPEG. Frames can be LazyFrames, they are decoded by
+# the writer thread if the format needs pixels.
+class FrameWriter:
+    def __init__(self, imgs_path, fmt='jpg', workers=2, max_queue=16, policy='block'):
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown frame format {fmt}, expected one of {FORMATS}')
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown queue policy {policy}, expected one of {POLICIES}')
+        self.imgs_path = imgs_path
+        self.fmt = fmt
+        self.policy = policy
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+        self.total_latency = 0
+        self.max_latency = 0
+        os.makedirs(imgs_path, exist_ok=True)
+        self.segment = None
+        if fmt == 'segment':
+            # Appends have to happen in order
+            workers = 1
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    # `frame` must not be modified after this call unless `copy` is set, streamers that
+    # hand out views into reused buffers (Basic, TileSpatial) set frame_reused for this.
+    # `payload` is copied unless it already is bytes (get_lazy_frame's copy, or a payload
+    # read by asyncio), since otherwise it usually is a view into a receive slot.
+    def submit(self, frame_idx, frame, header=None, payload=None, copy=False):
+        if self.fmt in ('raw', 'segment') and header is not None and payload is not None and header.codec in RAW_EXTENSIONS:
+            if not isinstance(payload, bytes):
+                payload = bytes(payload)
+            item = (frame_idx, header, payload, time.time())
+        else:
+            if copy and not isinstance(frame, LazyFrame):
+                frame = frame.copy()
+            item = (frame_idx, None, frame, time.time())
+
+        try:
+            self.queue.put(item, block=self.policy == 'block')
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def write(self, frame_idx, header, data):
+        if header is not None:
+            if self.fmt == 'segment':
+                if self.segment is None:
+                    self.segment = SegmentWriter(self.imgs_path)
+                self.segment.append(frame_idx, header, data)
+            else:
+                with open(f'{self.imgs_path}{frame_idx}{RAW_EXTENSIONS[header.codec]}', 'wb') as f:
+                    f.write(data)
+            return True
+        data = pixels(data)
+        if data is None: # a LazyFrame whose payload didn't decode
+            return False
+        if self.fmt == 'npy':
+            np.save(f'{self.imgs_path}{frame_idx}.npy', data)
+            return True
+        extension = '.png' if self.fmt == 'png' else '.jpg'
+        return cv2.imwrite(f'{self.imgs_path}{frame_idx}{extension}', data)
+
+    # A frame that fails to decode, encode or write is counted, it must not take the thread
+    # down, or submit() and close() would wait on the queue forever
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            frame_idx, header, data, submit_time = item
+            try:
+                ret = self.write(frame_idx, header, data)
+            except Exception as e:
+                print(e)
+                ret = False
+            latency = time.time() - submit_time
+            with self.lock:
+                if ret:
+                    self.written += 1
+                else:
+                    self.failed += 1
+                    print(f'Failed to write frame {frame_idx} to {self.imgs_path}')
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    # Waits for everything already queued to be written
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.segment:
+            self.segment.close()
+
+    def stats(self):
+        with self.lock:
+            completed = self.written + self.failed
+            return {
+                'Frames written': self.written,
+                'Frames not written (queue full)': self.dropped,
+                'Frame write failures': self.failed,
+                'Write queue depth': self.queue.qsize(),
+                'Max write queue depth': self.max_depth,
+                'Mean write latency': self.total_latency / completed if completed else 0,
+                'Max write latency': self.max_latency,
+            }
@@ -0,0 +1,162 @@
+import threading
+import time
+import numpy as np
+
+# Single-slot handoff between two pipeline stages. put() replaces an item the consumer
+# hasn't taken yet and counts it as dropped, so the consumer always gets the newest one.
+# With overwrite=False put() waits for the slot to be empty instead.
+class Mailbox:
+    def __init__(self, overwrite=True):
+        self.cond = threading.Condition()
+        self.overwrite = overwrite
+        self.item = None
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        with self.cond:
+            if not self.overwrite:
+                self.cond.wait_for(lambda: self.item is None or self.closed)
+            if self.item is not None:
+                self.dropped += 1
+            self.item = item
+            self.cond.notify_all()
+
+    def wait_empty(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.item is None or self.closed)
+
+    # The newest item, or None once the mailbox is closed and empty
+    def get(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.item is not None or self.closed)
+            item, self.item = self.item, None
+            self.cond.notify_all()
+            return item
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+# Capture, encode and send on their own threads, connected by Mailboxes, so encoding frame
+# N+1 overlaps with sending frame N and a slow send never holds up the next capture. The
+# encoder starts on the newest capture as soon as the sender has taken its last frame, so
+# at most one encoded frame waits, and captures it never got to are dropped.
+# With an AbrController on the streamer, the acks also bound the frames in flight to
+# `max_in_flight`: the encoder waits for room before taking a capture, so frames wait as raw
+# captures that newer ones replace, not in the socket buffer. The acks also give the
+# capture to ack latency, an upper bound on capture to receive. With pipelined=False every
+# frame is captured, encoded and sent on the calling thread, like the old client loop.
+# `read_frame` returns the next camera frame. Capture is paced to `fps`, or to the
+# controller's fps.
+class ClientPipeline:
+    def __init__(self, streamer, read_frame, fps=10, pipelined=True, max_in_flight=2, ack_timeout=1.0):
+        self.streamer = streamer
+        self.read_frame = read_frame
+        self.target_fps = fps
+        self.pipelined = pipelined
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self.to_encode = Mailbox()
+        # Stateful encoders (H.264) can't skip a frame once it is encoded
+        self.to_send = Mailbox(overwrite=not streamer.stateful_encoder)
+        self.stop = threading.Event()
+        self.lock = threading.Condition()
+        self.captured = 0
+        self.sent = 0
+        self.pending = {} # sequence number -> capture time, until the frame is acked
+        self.capture_to_send = []
+        self.capture_to_ack = []
+        if streamer.controller:
+            streamer.controller.listeners.append(self.frame_acked)
+
+    @property
+    def fps(self):
+        controller = self.streamer.controller
+        return controller.fps if controller else self.target_fps
+
+    def capture(self):
+        frame = self.read_frame()
+        self.captured += 1
+        return self.streamer.now(), frame # on the clock the frames are stamped with
+
+    def capture_loop(self):
+        while not self.stop.is_set():
+            start_time = time.time()
+            self.to_encode.put(self.capture())
+            time.sleep(max(0, 1.0 / self.fps - (time.time() - start_time)))
+        self.to_encode.close()
+
+    def wait_for_window(self):
+        if not self.streamer.controller:
+            return
+        with self.lock:
+            # A lost ack only stalls the pipeline for ack_timeout
+            if not self.lock.wait_for(lambda: len(self.pending) < self.max_in_flight, self.ack_timeout):
+                self.pending.clear()
+
+    def encode_loop(self):
+        while True:
+            self.to_send.wait_empty()
+            self.wait_for_window()
+            item = self.to_encode.get()
+            if item is None:
+                break
+            capture_time, frame = item
+            encode_start = time.time()
+            frame, frame_data = self.streamer.encode_frame(frame)
+            self.to_send.put((capture_time, frame, frame_data, time.time() - encode_start))
+        self.to_send.close()
+
+    def send(self, capture_time, frame, frame_data, encode_duration=None):
+        with self.lock:
+            if self.streamer.controller:
+                self.pending[self.streamer.send_frame_idx] = capture_time
+            self.capture_to_send.append(self.streamer.now() - capture_time)
+        self.streamer.send_encoded(frame, frame_data, capture_time, encode_duration)
+        self.sent += 1
+
+    def frame_acked(self, seq, ack_time):
+        with self.lock:
+            capture_time = self.pending.pop(seq, None)
+            if capture_time is not None:
+                self.capture_to_ack.append(ack_time - capture_time)
+                self.lock.notify_all()
+
+    # Streams until `seconds` have passed, or forever
+    def run(self, seconds=None):
+        deadline = time.time() + seconds if seconds else None
+        if not self.pipelined:
+            while not deadline or time.time() < deadline:
+                start_time = time.time()
+                capture_time, frame = self.capture()
+                encode_start = time.time()
+                frame, frame_data = self.streamer.encode_frame(frame)
+                self.send(capture_time, frame, frame_data, time.time() - encode_start)
+                time.sleep(max(0, 1.0 / self.fps - (time.time() - start_time)))
+            return
+
+        threading.Thread(target=self.capture_loop, daemon=True).start()
+        threading.Thread(target=self.encode_loop, daemon=True).start()
+        while True:
+            item = self.to_send.get()
+            if item is None:
+                break
+            self.send(*item)
+            if deadline and time.time() >= deadline:
+                self.stop.set()
+
+    def stats(self):
+        with self.lock:
+            capture_to_send = np.array(self.capture_to_send) * 1000
+            capture_to_ack = np.array(self.capture_to_ack) * 1000
+        return {
+            'Frames captured': self.captured,
+            'Frames dropped before encode': self.to_encode.dropped,
+            'Frames dropped before send': self.to_send.dropped,
+            'Frames sent': self.sent,
+            'Mean capture to send ms': capture_to_send.mean() if len(capture_to_send) else None,
+            'Mean capture to ack ms': capture_to_ack.mean() if len(capture_to_ack) else None,
+            'P95 capture to ack ms': np.percentile(capture_to_ack, 95) if len(capture_to_ack) else None,
+        }
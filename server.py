@@ -1,144 +1,200 @@
 from flask import Flask, Response, url_for
+import asyncio
 import cv2
+import json
 import numpy as np
 import socket
 import struct
 import threading
 import time  # Import time for recording frame times
-from ultralytics import YOLO
-from streamers import mjpeg, basic, tile_spatial, webp
-from logger import Logger
-import os
+from broadcast import Broadcaster, multipart_chunk
+from captures import FrameStore
+from decode_pool import DecodePool
+from ingest import accept_hello, create_streamer, log_summary, register_session, serve_async, sessions
+from inference import InferenceService
+from persist import FrameWriter
+from streamers import protocol
+from streamers.protocol import HELLO, STATUS_OK
 import sys
 
-mod_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), 'streamers', 'ffenc_uiuc'))
-if mod_dir not in sys.path:
-    sys.path.append(mod_dir)
-from streamers.ffenc_uiuc import h264
-
 app = Flask(__name__)
 
-# Global variable to hold the latest image and frame times
-video_captures = {}
+# How received frames are saved: 'jpg', 'png', 'npy', or 'raw' to write MJPEG/WebP/H.264
+# payloads as received. With 'drop' frames are skipped when the writers fall behind.
+FRAME_FORMAT = 'jpg'
+FRAME_POLICY = 'block'
+# Record without decoding: with FRAME_FORMAT 'raw' or 'segment', MJPEG and WebP frames
+# are only decoded when the web viewer asks for them
+LAZY_DECODE = False
+# Decoded frames kept per camera for paced playout (jitter.JitterBuffer), 0 to keep only
+# the latest frame. Each slot holds a full frame, 8 frames of 3840x1920 take 177 MB.
+JITTER_FRAMES = 0
+# Decode MJPEG and WebP frames in this many worker processes, frames come back through
+# DECODE_SLOTS shared memory slots of 26 MB, about three per camera, see DecodePool.
+# 0 decodes on the client threads.
+DECODE_WORKERS = 0
+DECODE_SLOTS = 32
+
+# Global variable to hold the latest image of every camera, versioned so consumers can
+# wait for a new frame instead of reprocessing the last one
+video_captures = FrameStore(jitter_frames=JITTER_FRAMES)
+
+# One model for every camera and viewer, frames from all cameras are batched
+inference_service = InferenceService(video_captures)
+
+# Each camera's annotated frames are JPEG encoded once and sent to all of its viewers
+broadcaster = Broadcaster(inference_service.wait_result, on_first=inference_service.subscribe, on_last=inference_service.unsubscribe,
+                          exists=video_captures.__contains__)
+
+# Started in main() with DECODE_WORKERS
+decode_pool = None
+
+# Forgets everything kept for a camera, so reconnects don't pile up hubs and frames
+def camera_disconnected(camera_id):
+    video_captures.remove(camera_id)
+    inference_service.remove(camera_id)
+    broadcaster.remove(camera_id)
 
 def handle_client(client_socket, addr):
     global video_captures
-    client_ip = addr[0]
-
-    compression_alg = struct.unpack('B', client_socket.recv(1))[0]
-    print(f'compression_alg: {compression_alg}')
-
-    IMGS_PATH = f'./received_imgs_{compression_alg}_{client_ip}/'
-
-    if compression_alg == 0x0:
-        logger = Logger(f'./basic_logs_{client_ip}.json')
-        streamer = basic.Basic(client_socket, logger=logger)
-    elif compression_alg == 0x1:
-        logger = Logger(f'./mjpeg30_logs_{client_ip}.json')
-        streamer = mjpeg.Mjpeg(client_socket, logger=logger)
-    elif compression_alg == 0x2:
-        logger = Logger(f'./mjpeg50_logs_{client_ip}.json')
-        streamer = mjpeg.Mjpeg(client_socket, logger=logger)
-    elif compression_alg == 0x3:
-        logger = Logger(f'./mjpeg90_logs_{client_ip}.json')
-        streamer = mjpeg.Mjpeg(client_socket, logger=logger)
-    elif compression_alg == 0x4:
-        logger = Logger(f'./webp30_logs_{client_ip}.json')
-        streamer = webp.Webp(client_socket, logger=logger)
-    elif compression_alg == 0x5:
-        logger = Logger(f'./webp50_logs_{client_ip}.json')
-        streamer = webp.Webp(client_socket, logger=logger)
-    elif compression_alg == 0x6:
-        logger = Logger(f'./webp90_logs_{client_ip}.json')
-        streamer = webp.Webp(client_socket, logger=logger)
-    elif compression_alg == 0x7:
-        logger = Logger(f'./tiled_logs_{client_ip}.json')
-        streamer = tile_spatial.TileSpatial(client_socket, logger=logger)
-    elif compression_alg == 0x8:
-        bitrate = '25M'
-        logger = Logger(f'./h264_{bitrate}_logs_{client_ip}.json')
-        IMGS_PATH = f'./received_imgs_{compression_alg}_{bitrate}_{client_ip}/'
-        streamer = h264.H264(client_socket, logger=logger)
-    else:
-        print('Unsupported compression algorithm!')
+
+    try:
+        hello, status = accept_hello(protocol.recv_exactly(client_socket, HELLO.size))
+    except ConnectionResetError:
         return
-    
-    os.makedirs(IMGS_PATH, exist_ok=True)
+    session, reply = register_session(hello, status, addr)
+    if status is not None:
+        client_socket.sendall(reply)
+    if status != STATUS_OK:
+        client_socket.close()
+        return
+    camera_id = session.camera_id
+
+    streamer, logger, IMGS_PATH = create_streamer(hello, client_socket, session)
+    try:
+        streamer.sync_clock()
+    except (ConnectionError, struct.error):
+        print("Client disconnected during time sync")
+        sessions.unregister(session)
+        logger.close()
+        client_socket.close()
+        return
+    frame_writer = FrameWriter(IMGS_PATH, fmt=FRAME_FORMAT, policy=FRAME_POLICY)
+    session.writer = frame_writer # queue depth, drops and write latency show up in /stats
 
+    # Pool frames hold a shared memory slot, the writer's queue gets copies
+    pooled = not LAZY_DECODE and decode_pool is not None and decode_pool.accepts(streamer)
     total_start_time = time.time()
     frame_idx = 0
-    while True:
-        try:
-            frame = streamer.get_frame()
-            if frame is None:
-                raise ConnectionResetError
-            video_captures[client_ip] = frame
-            img_name = IMGS_PATH + str(frame_idx) + '.jpg'
-            ret = cv2.imwrite(img_name, frame)
-            frame_idx += 1
-            if ret == False:
-                print(f'Failed to write image to {img_name}')
-                if client_ip in video_captures:
-                    del video_captures[client_ip]
+    # Whatever ends the loop, the session, the camera's state, the writer and the log are cleaned up
+    try:
+        while True:
+            try:
+                if LAZY_DECODE:
+                    frame = streamer.get_lazy_frame()
+                elif pooled:
+                    received = streamer.get_payload()
+                    frame = decode_pool.decode(streamer, *received) if received else None
+                    streamer.frame_decoded()
+                else:
+                    frame = streamer.get_frame()
+                if frame is None:
+                    raise ConnectionResetError
+                if streamer.frame_reused and not LAZY_DECODE: # the streamer's buffers get overwritten, one copy for every consumer
+                    frame = frame.copy()
+                video_captures.put(camera_id, frame, streamer.last_densities, streamer.last_header.timestamp)
+                frame_writer.submit(frame_idx, frame, streamer.last_header, streamer.last_payload, pooled)
+                frame_idx += 1
+            except (ConnectionResetError, BrokenPipeError, struct.error):
+                print("Client disconnected or error occurred")
                 break
-        except (ConnectionResetError, BrokenPipeError, struct.error):
-            print("Client disconnected or error occurred")
-            if client_ip in video_captures:
-                del video_captures[client_ip]
-            break
-    total_end_time = time.time()
-    total_time = total_end_time - total_start_time
-    logger.log({
-        'Frames read': frame_idx,
-        'Total time': total_time,
-        'Total bytes received': f'{streamer.nbytes_received / 1_000_000} MB',
-        'Overall FPS': frame_idx / total_time,
-        'Overall Bandwidth': f'{(streamer.nbytes_received * 8 / 1_000_000) / total_time} Mbps'
-    })
-    logger.flush()
-
-def video_feed(camera_id):
-    global video_captures
-    yolov8n_model = YOLO('yolov8n.pt')  # pretrained YOLOv8n model
-    while True:
-        if camera_id in video_captures:
-            orig_img = video_captures[camera_id]
-            start = time.time()
-            results = yolov8n_model.predict(orig_img, verbose=False)
-            print(f"Pred time: {time.time() - start}")
-            annotated_frame = results[0].plot() # Visualize the results on the frame
-            # compute_time = results[0].speed['preprocess'] + results[0].speed['inference'] + results[0].speed['postprocess']
-            ret, jpeg = cv2.imencode('.jpg', annotated_frame)
-            if ret:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n\r\n')
+            except Exception as e: # e.g. a corrupt frame, drop the client rather than the thread
+                print(f'Error on frame {frame_idx} from {camera_id}: {e!r}')
+                break
+    finally:
+        camera_disconnected(camera_id)
+        sessions.unregister(session)
+        client_socket.close()
+        total_end_time = time.time()
+        total_time = total_end_time - total_start_time
+        frame_writer.close()
+        log_summary(streamer, logger, frame_idx, total_time, frame_writer)
 
 @app.route(f'/video_feed/<string:camera_id>')
 def video_feed_route(camera_id):
-    return Response(video_feed(camera_id),
+    stream = broadcaster.stream(camera_id)
+    if stream is None:
+        return Response(f'No camera {camera_id}', status=404)
+    return Response(stream,
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+# The camera's frames without detections, played out at the rate they were captured.
+# Needs JITTER_FRAMES.
+@app.route(f'/playout/<string:camera_id>')
+def playout(camera_id):
+    def generate():
+        timestamp = -np.inf
+        while True:
+            buffer = video_captures.jitter_buffer(camera_id)
+            if buffer is None:
+                time.sleep(1.0)
+                continue
+            result = buffer.next_frame(timestamp, timeout=1.0)
+            if result is None:
+                continue
+            timestamp, frame = result
+            ret, jpeg = cv2.imencode('.jpg', frame)
+            if ret:
+                yield multipart_chunk(jpeg.tobytes())
+    return Response(generate(),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/stats')
+def stats():
+    stats = {
+        'inference': inference_service.stats(broadcaster.frames_shared()),
+        'viewers': broadcaster.stats(),
+        'jitter': video_captures.jitter_stats(),
+        'sessions': sessions.stats(),
+    }
+    if decode_pool:
+        stats['decode'] = decode_pool.stats()
+    return Response(json.dumps(stats), mimetype='application/json')
+
 @app.route('/')
 def index():
     global video_captures
     links = ''
     for camera_id in video_captures.keys():
-        links += f'<p><a href="{url_for("video_feed_route", camera_id=camera_id)}">{camera_id}</a></p>'
+        session = sessions.get(camera_id)
+        label = f'{camera_id} ({session.name}, {session.width}x{session.height})' if session else camera_id
+        links += f'<p><a href="{url_for("video_feed_route", camera_id=camera_id)}">{label}</a></p>'
     return links
 
 def main():
+    global decode_pool
     HOST_PUBLIC = '0.0.0.0'
     HOST_LOCAL = 'localhost'
     SOCKET_PORT = 8010
     WEB_PORT = 8080
+    inference_service.start()
+    if DECODE_WORKERS:
+        decode_pool = DecodePool(DECODE_WORKERS, DECODE_SLOTS)
+    threading.Thread(target=app.run, kwargs={'host':HOST_PUBLIC, 'port':WEB_PORT}).start()
+
+    if '--async' in sys.argv:
+        def on_frame(camera_id, frame, densities, timestamp):
+            video_captures.put(camera_id, frame, densities, timestamp)
+
+        asyncio.run(serve_async(HOST_PUBLIC, SOCKET_PORT, on_frame=on_frame, on_disconnect=camera_disconnected, frame_format=FRAME_FORMAT, frame_policy=FRAME_POLICY, lazy_decode=LAZY_DECODE, decode_pool=decode_pool))
+        return
+
     server_socket = socket.socket()
     server_socket.bind((HOST_PUBLIC, SOCKET_PORT))
     server_socket.listen(1)
     # So we don't have to wait when restarting the server
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
-    threading.Thread(target=app.run, kwargs={'host':HOST_PUBLIC, 'port':WEB_PORT}).start()
-
     while True:
         client_socket, addr = server_socket.accept()
         threading.Thread(target=handle_client, kwargs={'client_socket':client_socket, 'addr': addr}).start()
@@ -0,0 +1,68 @@
+import itertools
+import threading
+import time
+
+# One connected stream. `camera_id` keys its frames in the FrameStore, its viewer URLs,
+# and its log file and frame directory, so several cameras on one host stay apart.
+class Session:
+    __slots__ = ('id', 'client_ip', 'port', 'name', 'width', 'height', 'fps', 'start_time', 'camera_id', 'writer')
+
+    def __init__(self, session_id, addr, name, hello):
+        self.id = session_id
+        self.client_ip, self.port = addr[:2]
+        self.name = name
+        self.width = hello.width
+        self.height = hello.height
+        self.fps = hello.fps
+        self.start_time = time.time()
+        self.camera_id = f'{self.client_ip}_{session_id}'
+        self.writer = None # the FrameWriter saving this session's frames, if any
+
+    def stats(self):
+        return {
+            'session_id': self.id,
+            'client': f'{self.client_ip}:{self.port}',
+            'stream': self.name,
+            'resolution': f'{self.width}x{self.height}',
+            'fps': self.fps,
+            'connected_s': time.time() - self.start_time,
+            'writer': self.writer.stats() if self.writer else None,
+        }
+
+# Hands out session IDs, which the server sends back in WELCOME, and tracks the connected
+# sessions. Writers copy the table under a lock and swap it in, so lookups from the web and
+# inference threads read the current table without locking.
+class SessionRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1) # 0 means no session, WELCOME for a rejected HELLO
+        self.sessions = {} # camera id -> Session, replaced on every change, never mutated
+
+    def register(self, addr, name, hello):
+        with self.lock:
+            session = Session(next(self.ids), addr, name, hello)
+            sessions = dict(self.sessions)
+            sessions[session.camera_id] = session
+            self.sessions = sessions
+        return session
+
+    def unregister(self, session):
+        with self.lock:
+            sessions = dict(self.sessions)
+            sessions.pop(session.camera_id, None)
+            self.sessions = sessions
+
+    def get(self, camera_id):
+        return self.sessions.get(camera_id)
+
+    def __contains__(self, camera_id):
+        return camera_id in self.sessions
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def camera_ids(self):
+        return list(self.sessions)
+
+    def stats(self):
+        return {camera_id: session.stats() for camera_id, session in self.sessions.items()}
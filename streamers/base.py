@@ -0,0 +1,396 @@
+import asyncio
+import select
+import threading
+import time
+from datetime import datetime
+from streamers.clock import ClockSync
+from streamers.framing import FrameSender
+from streamers.recv_buffer import RecvBuffer
+from streamers import protocol
+from streamers.protocol import (FRAME_HEADER, FrameHeader, FEEDBACK, Feedback, FEEDBACK_ACK, FEEDBACK_TIME_SYNC,
+                                FLAG_FEEDBACK, FLAG_TIME_SYNC, TIME_SYNC_REPLY)
+
+# Framing, handshake and logging shared by every streamer. Subclasses set `codec` and
+# implement encode/decode, TileSpatial also overrides the send and receive paths.
+class Streamer:
+    codec = None
+    # Whether get_frame returns views into buffers that later frames overwrite
+    frame_reused = False
+    # Whether frames can be decoded out of order, or not at all, see get_lazy_frame
+    lazy_decode = True
+    # Whether each encoded frame depends on the previous one, so none may be skipped after encoding
+    stateful_encoder = False
+
+    def __init__(self, sock, logger=None, nodelay=True, cork=False, pool_size=2):
+        self.sock = sock
+        self.logger = logger
+        self.sender = FrameSender(sock, nodelay, cork)
+        self.recv_buffer = RecvBuffer(sock, pool_size)
+        self.send_frame_idx = 0
+        self.recv_frame_idx = 0
+        self.nbytes_received = 0
+        self.expected_seq = 0
+        self.frames_dropped = 0
+        self.frames_reordered = 0
+        # Header and compressed payload of the last frame received, for passthrough recording
+        self.last_header = None
+        self.last_payload = None
+        # Per-tile feature densities sent with the last frame (FLAG_TILE_DENSITIES), or None
+        self.last_densities = None
+        # Where FEEDBACK messages for frames with FLAG_FEEDBACK go, the asyncio server
+        # replaces it with the connection's StreamWriter.write
+        self.feedback = sock.sendall if sock is not None else None
+        # Set by an AbrController on the sending side, see abr.py
+        self.controller = None
+        self.settings_version = 0
+        self.header_flags = 0
+        # Receiving side: the client's clock offset, see sync_clock
+        self.clock = ClockSync()
+        # Sending side: frames and time sync replies share the socket
+        self.send_lock = threading.Lock()
+        self.feedback_thread = None
+        # Sending side: the clock frame and time sync timestamps come from, tests swap in a
+        # skewed one to stand in for a client whose clock is off
+        self.now = time.time
+        # Sending side: the ID the server gave this connection in WELCOME
+        self.session_id = None
+        # Receiving side: the last frame's log record, held back until the next receive so
+        # frame_decoded can add when the frame was decoded
+        self.frame_log = None
+
+    @property
+    def quality(self):
+        return 0
+
+    @property
+    def bitrate(self):
+        return 0
+
+    def handshake(self, width, height, fps):
+        welcome = protocol.send_hello(self.sock, self.codec, self.quality, fps, width, height, self.bitrate, self.now)
+        self.session_id = welcome.session_id
+        self.start_feedback()
+        return welcome
+
+    # Reads the server's FEEDBACK messages on a thread for as long as the socket is open:
+    # acks go to the controller, time sync probes are answered right away
+    def start_feedback(self):
+        if self.feedback_thread is None:
+            self.feedback_thread = threading.Thread(target=self.read_feedback, daemon=True)
+            self.feedback_thread.start()
+
+    # Polls with a short select rather than blocking in recv, which would keep the socket
+    # open past the sender's sock.close(), so the server would not see the disconnect
+    def read_feedback(self):
+        data = b''
+        while True:
+            try:
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+                if not readable:
+                    continue
+                chunk = self.sock.recv(4096)
+            except TimeoutError: # the sender handles its own timeouts
+                continue
+            except (OSError, ValueError): # socket closed by the sender
+                return
+            if not chunk:
+                return
+            data += chunk
+            while len(data) >= FEEDBACK.size:
+                message = Feedback._make(FEEDBACK.unpack_from(data))
+                data = data[FEEDBACK.size:]
+                now = self.now()
+                if message.kind == FEEDBACK_TIME_SYNC:
+                    with self.send_lock:
+                        self.sender.send([protocol.pack_time_sync_reply(self.codec, message, now, self.now())])
+                elif message.kind == FEEDBACK_ACK and self.controller:
+                    self.controller.on_ack(message, now)
+                    for listener in self.controller.listeners:
+                        listener(message.seq, now)
+
+    # Server side of the handshake's time sync: `rounds` probes, each answered before the
+    # next goes out, so no frame delays the replies
+    def sync_clock(self, rounds=protocol.TIME_SYNC_ROUNDS):
+        for _ in range(rounds):
+            self.feedback(self.clock.probe())
+            header = FrameHeader._make(FRAME_HEADER.unpack(protocol.recv_exactly(self.sock, FRAME_HEADER.size)))
+            self.time_sync_reply(header, protocol.recv_exactly(self.sock, header.length), time.time())
+
+    async def sync_clock_async(self, reader, rounds=protocol.TIME_SYNC_ROUNDS):
+        for _ in range(rounds):
+            self.feedback(self.clock.probe())
+            header = FrameHeader._make(FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size)))
+            self.time_sync_reply(header, await reader.readexactly(header.length), time.time())
+
+    def time_sync_reply(self, header, payload, receive_time):
+        if not header.flags & FLAG_TIME_SYNC:
+            raise ConnectionError('Client did not answer the time sync probe')
+        t1, t2 = TIME_SYNC_REPLY.unpack(payload)
+        self.clock.add(t1, t2, header.timestamp, receive_time)
+
+    def encode(self, frame):
+        raise NotImplementedError
+
+    def decode(self, data, header):
+        raise NotImplementedError
+
+    # New encoder settings from the AbrController, codecs without the knob ignore it
+    def change_settings(self, quality, bitrate, fps):
+        pass
+
+    # Picks up settings the controller changed since the last frame. Called on the sending
+    # thread so the encoder is never reconfigured in the middle of a frame.
+    def adapt(self):
+        controller = self.controller
+        if controller and controller.version != self.settings_version:
+            quality, bitrate, fps, self.settings_version = controller.settings()
+            self.change_settings(quality, bitrate, fps)
+
+    def pack_header(self, frame, timestamp, length, rows=1, cols=1, flags=0):
+        height, width = frame.shape[:2]
+        if self.controller: # before the frame goes out, its ack can beat log_send
+            self.controller.frame_sent(self.send_frame_idx, timestamp)
+        return FRAME_HEADER.pack(self.codec, self.quality, rows, cols, flags | self.header_flags, width, height, self.send_frame_idx, timestamp, length)
+
+    def send_frame(self, frame, capture_time=None):
+        encode_start = time.time()
+        frame, frame_data = self.encode_frame(frame)
+        self.send_encoded(frame, frame_data, capture_time, time.time() - encode_start)
+
+    # Encoding and sending are split so a pipelined client can encode the next frame while
+    # this one is still going out. Returns the arguments for send_encoded.
+    def encode_frame(self, frame):
+        self.adapt()
+        return frame, self.encode(frame)
+
+    def send_encoded(self, frame, frame_data, capture_time=None, encode_duration=None):
+        try:
+            frame_data_len = memoryview(frame_data).nbytes
+
+            print(f'Frame size: {frame_data_len} bytes')
+            start_time = self.now()
+
+            with self.send_lock:
+                self.sender.send([self.pack_header(frame, start_time, frame_data_len), frame_data])
+            end_time = self.now()
+
+            self.log_send(start_time, end_time, capture_time=capture_time, encode_duration=encode_duration)
+        except TimeoutError:
+            self.log_timeout()
+
+    def log_send(self, start_time, end_time, extra=None, capture_time=None, encode_duration=None):
+        log = {}
+
+        log['frame'] = self.send_frame_idx
+        if capture_time is not None:
+            log['client_capture_time'] = capture_time
+            log['capture_to_send_duration'] = start_time - capture_time
+        if encode_duration is not None:
+            log['client_encode_duration'] = encode_duration
+        log['client_send_start_time'] = start_time
+        log['client_send_end_time'] = end_time
+        log['client_send_duration'] = end_time - start_time
+        if extra:
+            log.update(extra)
+        if self.controller:
+            log.update(self.controller.log_fields())
+
+        if self.logger:
+            self.logger.log(log)
+        self.send_frame_idx += 1
+
+    def log_timeout(self):
+        print("Unable to send frame, connection timed out...")
+        if self.logger:
+            datetime_obj = datetime.fromtimestamp(time.time())
+            readable_time = datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
+            self.logger.log({
+                'Connection timed out': readable_time
+            })
+
+    def track_sequence(self, seq):
+        if seq > self.expected_seq:
+            self.frames_dropped += seq - self.expected_seq
+        elif seq < self.expected_seq:
+            self.frames_reordered += 1
+        self.expected_seq = max(self.expected_seq, seq + 1)
+
+    def log_frame(self, header, data_length, server_recv_start_time, server_recv_end_time):
+        self.nbytes_received += data_length
+        self.track_sequence(header.seq)
+
+        log = {}
+
+        client_send_start_time = header.timestamp
+        network_duration = server_recv_end_time - client_send_start_time
+        bandwidth = data_length / network_duration
+
+        log['frame'] = self.recv_frame_idx
+        log['seq'] = header.seq
+        log['quality'] = header.quality
+        log['frame_size_kb'] = data_length / 1000
+        log['client_send_start_time'] = client_send_start_time
+        log['server_recv_start_time'] = server_recv_start_time
+        log['server_recv_end_time'] = server_recv_end_time
+        log['server_recv_duration'] = server_recv_end_time - server_recv_start_time
+        log['network_duration_ms'] = network_duration * 1000
+        log['bandwidth_mbps'] = (bandwidth * 8) / (1000 * 1000)
+        # The same on the server's clock, once the client answered a time sync probe
+        if self.clock.offset is not None:
+            corrected_duration = server_recv_end_time - self.clock.to_server_time(client_send_start_time)
+            log['clock_offset_ms'] = self.clock.offset * 1000
+            log['clock_sync_delay_ms'] = self.clock.delay * 1000
+            log['corrected_network_duration_ms'] = corrected_duration * 1000
+            log['corrected_bandwidth_mbps'] = data_length * 8 / corrected_duration / (1000 * 1000) if corrected_duration > 0 else None
+
+        self.flush_frame_log()
+        self.frame_log = log
+        self.recv_frame_idx += 1
+
+        if self.feedback:
+            now = time.time()
+            if header.flags & FLAG_FEEDBACK:
+                self.feedback(FEEDBACK.pack(FEEDBACK_ACK, header.seq, data_length, server_recv_end_time - server_recv_start_time, now))
+            if self.clock.due(now):
+                self.feedback(self.clock.probe(now))
+
+    # The receiver calls this once it has the frame's pixels
+    def frame_decoded(self):
+        if self.frame_log is not None:
+            self.frame_log['server_decoded_time'] = time.time()
+
+    # Called before each receive, by then the previous frame has been decoded or never will be
+    def flush_frame_log(self):
+        if self.frame_log is not None and self.logger:
+            self.logger.log(self.frame_log)
+        self.frame_log = None
+
+    # Time sync replies to the periodic probes arrive between frames and are consumed here
+    def read_header(self):
+        while True:
+            header = self.recv_buffer.recv_header(FRAME_HEADER)
+            if header is None: # socket closed
+                return None
+            header = FrameHeader._make(header)
+            if not header.flags & FLAG_TIME_SYNC:
+                return header
+            receive_time = time.time()
+            payload = self.recv_buffer.recv_payload(header.length)
+            if payload is None:
+                return None
+            self.time_sync_reply(header, payload, receive_time)
+
+    # Raises asyncio.IncompleteReadError once the socket is closed
+    async def read_header_async(self, reader):
+        while True:
+            header = FrameHeader._make(FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size)))
+            if not header.flags & FLAG_TIME_SYNC:
+                return header
+            receive_time = time.time()
+            self.time_sync_reply(header, await reader.readexactly(header.length), receive_time)
+
+    # Receives the next frame without decoding it, returns (header, payload) where the
+    # payload is a view into a receive slot that later frames overwrite
+    def get_payload(self):
+        self.flush_frame_log()
+        header = self.read_header()
+        if header is None:
+            return None
+
+        server_recv_start_time = time.time()
+
+        data = self.recv_buffer.recv_payload(header.length)
+        if data is None: # socket closed
+            return None
+
+        server_recv_end_time = time.time()
+        self.last_header, self.last_payload = header, data
+
+        self.log_frame(header, header.length, server_recv_start_time, server_recv_end_time)
+
+        return header, data
+
+    def get_frame(self):
+        received = self.get_payload()
+        if received is None:
+            return None
+        header, data = received
+        frame = self.decode(data, header)
+        self.frame_decoded()
+        return frame
+
+    # For a server that only records: the frame is decoded the first time someone asks
+    # for its pixels. Falls back to decoding now for stateful decoders, which have to see
+    # every frame in order.
+    def get_lazy_frame(self):
+        if not self.lazy_decode:
+            return self.get_frame()
+        received = self.get_payload()
+        if received is None:
+            return None
+        header, data = received
+        self.last_payload = bytes(data)
+        return LazyFrame(self, header, self.last_payload)
+
+    async def get_payload_async(self, reader):
+        self.flush_frame_log()
+        try:
+            header = await self.read_header_async(reader)
+            server_recv_start_time = time.time()
+            data = await reader.readexactly(header.length)
+        except asyncio.IncompleteReadError: # socket closed
+            return None
+
+        server_recv_end_time = time.time()
+        self.last_header, self.last_payload = header, data
+
+        self.log_frame(header, header.length, server_recv_start_time, server_recv_end_time)
+
+        return header, data
+
+    # Non-blocking variant for the asyncio ingest server, decoding runs on `executor`.
+    # Each connection awaits its decode before reading the next frame, so stateful
+    # decoders (H.264) still see frames in order.
+    async def get_frame_async(self, reader, executor=None):
+        received = await self.get_payload_async(reader)
+        if received is None:
+            return None
+        header, data = received
+        frame = await asyncio.get_running_loop().run_in_executor(executor, self.decode, data, header)
+        self.frame_decoded()
+        return frame
+
+    async def get_lazy_frame_async(self, reader, executor=None):
+        if not self.lazy_decode:
+            return await self.get_frame_async(reader, executor)
+        received = await self.get_payload_async(reader)
+        if received is None:
+            return None
+        header, data = received
+        return LazyFrame(self, header, data)
+
+# A received frame that hasn't been decoded yet. pixels() decodes it once and caches the
+# result, so the web viewer and the frame writer can share it.
+class LazyFrame:
+    def __init__(self, streamer, header, payload):
+        self.streamer = streamer
+        self.header = header
+        self.payload = payload
+        self.frame = None
+        self.lock = threading.Lock()
+
+    @property
+    def shape(self):
+        return (self.header.height, self.header.width, 3)
+
+    def pixels(self):
+        with self.lock:
+            if self.frame is None:
+                self.frame = self.streamer.decode(self.payload, self.header)
+            return self.frame
+
+# Decoded pixels for either a LazyFrame or an already decoded frame
+def pixels(frame):
+    if isinstance(frame, LazyFrame):
+        return frame.pixels()
+    return frame
@@ -0,0 +1,41 @@
+import time
+from collections import deque
+from streamers.protocol import FEEDBACK, FEEDBACK_TIME_SYNC
+
+# Server-side estimate of how far a client's clock is ahead of the server's, NTP style.
+# The server stamps each FEEDBACK_TIME_SYNC probe with its send time t1, the client replies
+# with its receive time t2 and reply send time t3, and the server notes the arrival t4.
+# One round gives offset ((t2 - t1) + (t3 - t4)) / 2 and round-trip delay
+# (t4 - t1) - (t3 - t2). The offset is only exact if both directions took equally long, and
+# a round queued behind a frame has a long delay and a lopsided split, so the estimate is
+# the offset of the lowest-delay round among the last `window`.
+class ClockSync:
+    def __init__(self, window=8, interval=10.0):
+        self.samples = deque(maxlen=window) # (delay, offset)
+        self.interval = interval
+        self.offset = None
+        self.delay = None
+        self.rounds = 0
+        self.last_probe = 0
+        self.seq = 0
+
+    # A FEEDBACK_TIME_SYNC probe stamped with `now`
+    def probe(self, now=None):
+        now = time.time() if now is None else now
+        self.last_probe = now
+        self.seq += 1
+        return FEEDBACK.pack(FEEDBACK_TIME_SYNC, self.seq, now, self.offset or 0, self.delay or 0)
+
+    # Only clients that answered the handshake rounds get periodic probes
+    def due(self, now):
+        return self.rounds > 0 and now - self.last_probe >= self.interval
+
+    def add(self, t1, t2, t3, t4):
+        delay = (t4 - t1) - (t3 - t2)
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        self.samples.append((delay, offset))
+        self.delay, self.offset = min(self.samples)
+        self.rounds += 1
+
+    def to_server_time(self, client_time):
+        return client_time - self.offset
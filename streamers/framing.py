@@ -0,0 +1,40 @@
+import contextlib
+import socket
+
+# Linux only, other platforms fall back to plain sends
+TCP_CORK = getattr(socket, 'TCP_CORK', None)
+# Most kernels reject sendmsg calls with more buffers than this
+IOV_MAX = 1024
+
+# Writes a frame's header and payload buffers with a single scatter-gather sendmsg call
+# instead of one sendall per piece. sendmsg may stop short on a full socket buffer, in
+# which case the remaining buffers are resent from where it left off.
+class FrameSender:
+    def __init__(self, sock, nodelay=True, cork=False):
+        self.sock = sock
+        self.cork = cork and TCP_CORK is not None
+        self.nsyscalls = 0
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(nodelay))
+
+    def send(self, buffers):
+        buffers = [view for view in (memoryview(buffer).cast('B') for buffer in buffers) if view.nbytes]
+        while buffers:
+            nbytes = self.sock.sendmsg(buffers[:IOV_MAX])
+            self.nsyscalls += 1
+            while buffers and nbytes >= len(buffers[0]):
+                nbytes -= len(buffers.pop(0))
+            if nbytes:
+                buffers[0] = buffers[0][nbytes:]
+
+    # Hold back partial packets while a frame is written in several send calls
+    @contextlib.contextmanager
+    def corked(self):
+        if not self.cork:
+            yield
+            return
+        self.sock.setsockopt(socket.IPPROTO_TCP, TCP_CORK, 1)
+        try:
+            yield
+        finally:
+            self.sock.setsockopt(socket.IPPROTO_TCP, TCP_CORK, 0)
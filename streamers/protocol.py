@@ -0,0 +1,126 @@
+import struct
+import time
+from collections import namedtuple
+import numpy as np
+
+MAGIC = b'D360'
+PROTOCOL_VERSION = 3
+
+CODEC_BASIC = 0
+CODEC_MJPEG = 1
+CODEC_WEBP = 2
+CODEC_TILED = 3
+CODEC_H264 = 4
+CODEC_NAMES = {
+    CODEC_BASIC: 'basic',
+    CODEC_MJPEG: 'mjpeg',
+    CODEC_WEBP: 'webp',
+    CODEC_TILED: 'tiled',
+    CODEC_H264: 'h264',
+}
+
+STATUS_OK = 0
+STATUS_BAD_VERSION = 1
+STATUS_BAD_CODEC = 2
+
+# Sent once by the client after connecting:
+# magic, protocol version, codec, quality, fps, width, height, bitrate in kbps (H.264 only)
+HELLO = struct.Struct('!4sBBBBHHI')
+Hello = namedtuple('Hello', ['magic', 'version', 'codec', 'quality', 'fps', 'width', 'height', 'bitrate'])
+
+# Server reply to HELLO: magic, the server's protocol version, status, number of
+# TIME_SYNC rounds that follow before the first frame, the ID the server gave this
+# connection (0 if the HELLO was rejected)
+WELCOME = struct.Struct('!4sBBBxI')
+Welcome = namedtuple('Welcome', ['magic', 'version', 'status', 'sync_rounds', 'session_id'])
+TIME_SYNC_ROUNDS = 5
+
+# Prefixes every frame:
+# codec, quality, tile rows, tile columns, flags, width, height, sequence number,
+# client capture/send timestamp, payload length.
+# Tiled frames have a payload length of 0 and are followed by rows * cols tiles,
+# each prefixed with a TILE_HEADER, so tiles can be sent as soon as they are encoded.
+FRAME_HEADER = struct.Struct('!BBBBHHHIdI')
+FrameHeader = namedtuple('FrameHeader', ['codec', 'quality', 'rows', 'cols', 'flags', 'width', 'height', 'seq', 'timestamp', 'length'])
+TILE_HEADER = struct.Struct('!I')
+
+# Frame header flags
+# The header is followed by the per-tile feature densities the client computed for its
+# compression profile, rows * cols big-endian uint16s in row-major order scaled so 65535
+# is a density of 1. They come before the tiles.
+FLAG_TILE_DENSITIES = 0x1
+# The client wants a FEEDBACK_ACK for this frame
+FLAG_FEEDBACK = 0x2
+# Not a frame but the client's reply to a FEEDBACK_TIME_SYNC probe. The header carries the
+# probe's sequence number and the client time the reply was sent, the payload is a
+# TIME_SYNC_REPLY.
+FLAG_TIME_SYNC = 0x4
+# Server send time echoed from the probe, client time the probe was received
+TIME_SYNC_REPLY = struct.Struct('!dd')
+
+# Server to client messages on the frame connection: kind, sequence number (of the frame
+# for acks, which are only sent for frames with FLAG_FEEDBACK), then three values
+# depending on the kind.
+# FEEDBACK_ACK: payload bytes received, server receive duration in seconds, server time
+# when the ack was sent.
+# FEEDBACK_TIME_SYNC: server time the probe was sent, the server's current estimate of the
+# client clock offset and of the round-trip delay (0 before the first round). Sent during
+# the handshake and then periodically, the client answers each with a FLAG_TIME_SYNC frame.
+FEEDBACK = struct.Struct('!BIddd')
+Feedback = namedtuple('Feedback', ['kind', 'seq', 'a', 'b', 'c'])
+FEEDBACK_ACK = 0
+FEEDBACK_TIME_SYNC = 1
+
+def densities_size(rows, cols):
+    return rows * cols * 2
+
+def pack_densities(densities):
+    return (np.clip(np.asarray(densities), 0, 1) * 65535).round().astype('>u2').tobytes()
+
+def unpack_densities(data, rows, cols):
+    return np.frombuffer(data, dtype='>u2', count=rows * cols).reshape(rows, cols) / 65535
+
+def pack_time_sync_reply(codec, probe, receive_time, send_time=None):
+    send_time = time.time() if send_time is None else send_time
+    return (FRAME_HEADER.pack(codec, 0, 0, 0, FLAG_TIME_SYNC, 0, 0, probe.seq, send_time, TIME_SYNC_REPLY.size)
+            + TIME_SYNC_REPLY.pack(probe.a, receive_time))
+
+# Also answers the handshake's TIME_SYNC rounds with timestamps from `now`, so the
+# connection is ready for frames
+def send_hello(sock, codec, quality, fps, width, height, bitrate=0, now=time.time):
+    sock.sendall(HELLO.pack(MAGIC, PROTOCOL_VERSION, codec, quality, int(fps), int(width), int(height), int(bitrate)))
+    welcome = Welcome._make(WELCOME.unpack(recv_exactly(sock, WELCOME.size)))
+    if welcome.magic != MAGIC:
+        raise ConnectionError('Server did not answer with the streaming protocol')
+    if welcome.status == STATUS_BAD_VERSION:
+        raise ConnectionError(f'Server speaks protocol version {welcome.version}, client speaks {PROTOCOL_VERSION}')
+    if welcome.status == STATUS_BAD_CODEC:
+        raise ConnectionError(f'Server does not support {CODEC_NAMES.get(codec, codec)}')
+    for _ in range(welcome.sync_rounds):
+        probe = Feedback._make(FEEDBACK.unpack(recv_exactly(sock, FEEDBACK.size)))
+        sock.sendall(pack_time_sync_reply(codec, probe, now(), now()))
+    return welcome
+
+def parse_hello(data):
+    hello = Hello._make(HELLO.unpack(data))
+    if hello.magic != MAGIC:
+        return hello, None
+    if hello.version != PROTOCOL_VERSION:
+        return hello, STATUS_BAD_VERSION
+    if hello.codec not in CODEC_NAMES:
+        return hello, STATUS_BAD_CODEC
+    return hello, STATUS_OK
+
+def pack_welcome(status, session_id=0, sync_rounds=TIME_SYNC_ROUNDS):
+    return WELCOME.pack(MAGIC, PROTOCOL_VERSION, status, sync_rounds if status == STATUS_OK else 0, session_id)
+
+def recv_exactly(sock, nbytes):
+    data = bytearray(nbytes)
+    view = memoryview(data)
+    received = 0
+    while received < nbytes:
+        chunk = sock.recv_into(view[received:], nbytes - received)
+        if chunk == 0:
+            raise ConnectionResetError
+        received += chunk
+    return data
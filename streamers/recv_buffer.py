@@ -0,0 +1,47 @@
+HEADER_SIZE = 64
+
+# Per-connection receive buffers filled in place with sock.recv_into.
+# Payloads are handed out as memoryviews into a small ring of preallocated slots, so
+# nothing is copied or reallocated once the slots have grown to the largest frame seen.
+# A view stays valid until the ring wraps around, i.e. for `pool_size - 1` more payloads.
+class RecvBuffer:
+    def __init__(self, sock, pool_size=2):
+        self.sock = sock
+        self.header = bytearray(HEADER_SIZE)
+        self.header_view = memoryview(self.header)
+        self.slots = [bytearray() for _ in range(pool_size)]
+        self.slot_idx = 0
+        self.nallocs = 0
+
+    def ensure_pool(self, pool_size):
+        while len(self.slots) < pool_size:
+            self.slots.append(bytearray())
+
+    def recv_into(self, view):
+        received = 0
+        nbytes_total = len(view)
+        while received < nbytes_total:
+            nbytes = self.sock.recv_into(view[received:], nbytes_total - received)
+            if nbytes == 0: # socket closed
+                return False
+            received += nbytes
+        return True
+
+    def recv_header(self, header_struct):
+        view = self.header_view[:header_struct.size]
+        if not self.recv_into(view):
+            return None
+        return header_struct.unpack_from(self.header)
+
+    def recv_payload(self, data_length):
+        slot = self.slots[self.slot_idx]
+        if len(slot) < data_length:
+            slot = bytearray(data_length)
+            self.slots[self.slot_idx] = slot
+            self.nallocs += 1
+        self.slot_idx = (self.slot_idx + 1) % len(self.slots)
+
+        view = memoryview(slot)[:data_length]
+        if not self.recv_into(view):
+            return None
+        return view
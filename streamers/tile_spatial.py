@@ -1,17 +1,25 @@
-import struct
+import asyncio
 import cv2
+import os
 import numpy as np
 import time
-from feature import calculate_compression_profile
-import datetime
-
-class TileSpatial:
-    def __init__(self, sock, logger=None):
-        self.sock = sock
-        self.logger = logger
-        self.send_frame_idx = 0
-        self.recv_frame_idx = 0
-        self.nbytes_received = 0
+from concurrent.futures import ThreadPoolExecutor, wait
+from feature import ProfileCache
+from streamers.base import Streamer
+from streamers.protocol import CODEC_TILED, TILE_HEADER, FLAG_TILE_DENSITIES, densities_size, pack_densities, unpack_densities
+
+class TileSpatial(Streamer):
+    codec = CODEC_TILED
+    frame_reused = True
+    lazy_decode = False # tiles are decoded as they arrive
+
+    def __init__(self, sock, logger=None, nodelay=True, cork=False, encode_workers=None):
+        super().__init__(sock, logger=logger, nodelay=nodelay, cork=cork)
+        self.encode_workers = encode_workers or os.cpu_count()
+        self.encode_pool = None
+        self.frame_pool = [None] * 4
+        self.frame_pool_idx = 0
+        self.profile_cache = ProfileCache(2, 4)
 
     @staticmethod
     def cap_compression_profile(matrix):
@@ -20,113 +28,193 @@ class TileSpatial:
         transformed_matrix = transformed_matrix.astype(int)
         return transformed_matrix
 
-    def send_tile(self, tile, quality):
+    def encode_tile(self, tile, quality):
         encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
         _, tile_encoded = cv2.imencode('.jpg', tile, encode_param)
-        tile_data = tile_encoded.tobytes()
-        header = struct.pack('!I', len(tile_data))
-        self.sock.sendall(header)
-        self.sock.sendall(tile_data)
+        return tile_encoded.tobytes()
 
-    def send_image(self, image, qualities):
+    # cv2.imencode releases the GIL, so tiles encode in parallel on a thread pool.
+    # Returns one future per tile in row-major order.
+    def submit_tiles(self, image, qualities):
+        if self.encode_pool is None:
+            self.encode_pool = ThreadPoolExecutor(max_workers=self.encode_workers)
         rows = len(qualities)
         cols = len(qualities[0])
         h, w, _ = image.shape
         tile_height, tile_width = h // rows, w // cols
+        futures = []
         for i in range(rows):
             for j in range(cols):
                 tile = image[i * tile_height:(i + 1) * tile_height, j * tile_width:(j + 1) * tile_width]
-                self.send_tile(tile, qualities[i][j])
+                futures.append(self.encode_pool.submit(self.encode_tile, tile, qualities[i][j]))
+        return futures
+
+    def encode_image(self, image, qualities):
+        return [future.result() for future in self.submit_tiles(image, qualities)]
+
+    # Only submits the tile encodes, send_encoded writes each tile as it finishes
+    def encode_frame(self, frame):
+        self.adapt()
+        # qualities = [[100, 100, 100, 100], [100, 100, 100, 100]]
+        profile = self.profile_cache.get(frame)
+        qualities = self.cap_compression_profile(profile)
 
-    def send_frame(self, frame):
+        print("Compression Profile:\n", qualities)
+
+        # The timestamp is taken before encoding, so the send duration covers the tile encodes
+        start_time = self.now()
+        return frame, (profile, qualities, start_time, self.submit_tiles(frame, qualities))
+
+    # `encode_duration` only covers the profile and submitting the tiles, the tile encodes
+    # finish while the frame is going out
+    def send_encoded(self, frame, frame_data, capture_time=None, encode_duration=None):
+        profile, qualities, start_time, futures = frame_data
         try:
-            # qualities = [[100, 100, 100, 100], [100, 100, 100, 100]]
-            qualities = self.cap_compression_profile(calculate_compression_profile(frame, 2, 4))
-            
-            print("Compression Profile:\n", qualities)
-            # Send the number of rows and columns
             num_rows, num_cols = len(qualities), len(qualities[0])
 
-            # Send the timestamp
-            start_time = time.time()
-            self.sock.sendall(struct.pack('!d', start_time))
-            
-            self.sock.sendall(struct.pack('B', num_rows))
-            self.sock.sendall(struct.pack('B', num_cols))
-            
-            self.send_image(frame, qualities)
-            end_time = time.time()
-
-            log = {}
-
-            log['frame'] = self.send_frame_idx
-            log['client_send_start_time'] = start_time
-            log['client_send_end_time'] = end_time
-            log['client_send_duration'] = f'{end_time - start_time:.4f}'
-
-            if self.logger:
-                self.logger.log(log)
-            self.send_frame_idx += 1
+            # Tiles go out in order as soon as they are encoded, each prefixed by its length.
+            # Whatever has finished by the time the next tile is still pending is written
+            # with one sendmsg, so a frame that encodes quickly still costs a single call.
+            # The densities go along so the server can pick where to run detection
+            buffers = [self.pack_header(frame, start_time, 0, rows=num_rows, cols=num_cols, flags=FLAG_TILE_DENSITIES), pack_densities(profile)]
+            with self.send_lock, self.sender.corked():
+                for future in futures:
+                    if buffers and not future.done():
+                        self.sender.send(buffers)
+                        buffers = []
+                    tile_data = future.result()
+                    buffers += [TILE_HEADER.pack(len(tile_data)), tile_data]
+                encoded_time = self.now()
+                self.sender.send(buffers)
+            end_time = self.now()
+
+            self.log_send(start_time, end_time, {
+                'profile_tiles_computed': self.profile_cache.last_computed,
+                'profile_hit_rate': self.profile_cache.hit_rate,
+                'profile_staleness': self.profile_cache.staleness,
+                'client_encode_in_send_duration': encoded_time - start_time
+            }, capture_time, (encode_duration or 0) + encoded_time - start_time)
         except TimeoutError:
-            print("Unable to send frame, connection timed out...")
-            if self.logger:
-                datetime_obj = datetime.fromtimestamp(time.time())
-                readable_time = datetime_obj.strftime("%Y-%m-%d %H:%M:%S")
-                self.logger.log({
-                    'Connection timed out': readable_time
-                })
+            self.log_timeout()
+
+    def decode_tile(self, tile_data):
+        return cv2.imdecode(np.frombuffer(tile_data, np.uint8), cv2.IMREAD_COLOR)
+
+    # Decodes one tile straight into its slice of the output frame, no hstack/vstack copies
+    def decode_tile_into(self, frame, tile_data, tile_idx, num_rows, num_cols):
+        tile_height, tile_width = frame.shape[0] // num_rows, frame.shape[1] // num_cols
+        i, j = divmod(tile_idx, num_cols)
+        frame[i * tile_height:(i + 1) * tile_height, j * tile_width:(j + 1) * tile_width] = self.decode_tile(tile_data)
+
+    # Output frames come from a ring of four, so a frame is overwritten four receives later
+    # (frame_reused). The ingest loops copy each frame once before publishing it to the
+    # FrameStore and FrameWriter, anything else that keeps frames has to copy them too.
+    # The sender crops the frame to a whole number of tiles, so the output is cropped the same way.
+    def next_output_frame(self, header):
+        shape = (header.height // header.rows * header.rows, header.width // header.cols * header.cols, 3)
+        frame = self.frame_pool[self.frame_pool_idx]
+        if frame is None or frame.shape != shape:
+            frame = np.empty(shape, dtype=np.uint8)
+            self.frame_pool[self.frame_pool_idx] = frame
+        self.frame_pool_idx = (self.frame_pool_idx + 1) % len(self.frame_pool)
+        return frame
 
     def receive_tile(self):
-        header = self.sock.recv(4)
-        tile_data_length = struct.unpack('!I', header)[0]
-
-        tile_data = b''
-        while len(tile_data) < tile_data_length:
-            chunk = self.sock.recv(min(tile_data_length - len(tile_data), 4096))
-            tile_data += chunk
-        
+        header = self.recv_buffer.recv_header(TILE_HEADER)
+        if header is None: # socket closed
+            return None
+        tile_data_length = header[0]
+
+        tile_data = self.recv_buffer.recv_payload(tile_data_length)
+        if tile_data is None: # socket closed
+            return None
+
         self.frame_data_length += tile_data_length
-        tile = cv2.imdecode(np.frombuffer(tile_data, np.uint8), cv2.IMREAD_COLOR)
-        return tile
+        return tile_data
 
+    # Each tile is handed to the decode pool as soon as it has been received, so decoding
+    # overlaps with receiving the rest of the frame
     def get_frame(self):
-        client_send_start_time = struct.unpack('!d', self.sock.recv(8))[0]
-        
+        self.flush_frame_log()
+        header = self.read_header()
+        if header is None:
+            return None
+        num_rows, num_cols = header.rows, header.cols
+        num_tiles = num_rows * num_cols
+
         server_recv_start_time = time.time()
 
-        num_rows = struct.unpack('B', self.sock.recv(1))[0]
-        num_cols = struct.unpack('B', self.sock.recv(1))[0]
+        # Every tile of the frame needs its own receive slot until it has been decoded
+        self.recv_buffer.ensure_pool(num_tiles)
+        self.last_densities = None
+        if header.flags & FLAG_TILE_DENSITIES:
+            data = self.recv_buffer.recv_payload(densities_size(num_rows, num_cols))
+            if data is None: # socket closed
+                return None
+            self.last_densities = unpack_densities(data, num_rows, num_cols)
+        frame = self.next_output_frame(header)
+        decode_pool = get_decode_pool()
 
         self.frame_data_length = 0
-        tiles = [self.receive_tile() for _ in range(num_rows * num_cols)]
+        futures = []
+        for tile_idx in range(num_tiles):
+            tile_data = self.receive_tile()
+            if tile_data is None:
+                wait(futures)
+                return None
+            futures.append(decode_pool.submit(self.decode_tile_into, frame, tile_data, tile_idx, num_rows, num_cols))
         server_recv_end_time = time.time()
 
-        self.nbytes_received += self.frame_data_length
+        for future in futures:
+            future.result()
+
+        self.last_header, self.last_payload = header, None
+        self.log_frame(header, self.frame_data_length, server_recv_start_time, server_recv_end_time)
+        self.frame_decoded()
 
-        combined_rows = []
-        index = 0
-        for i in range(num_rows):
-            row_tiles = [tiles[index + j] for j in range(num_cols)]
-            combined_rows.append(np.hstack(row_tiles))
-            index += num_cols
-        frame = np.vstack(combined_rows)
+        return frame
 
-        log = {}
+    # Non-blocking variant for the asyncio ingest server, tiles are decoded on `executor`
+    # as they arrive
+    async def get_frame_async(self, reader, executor=None):
+        self.flush_frame_log()
+        loop = asyncio.get_running_loop()
+        decodes = []
+        try:
+            header = await self.read_header_async(reader)
+            num_rows, num_cols = header.rows, header.cols
+            server_recv_start_time = time.time()
+
+            self.last_densities = None
+            if header.flags & FLAG_TILE_DENSITIES:
+                data = await reader.readexactly(densities_size(num_rows, num_cols))
+                self.last_densities = unpack_densities(data, num_rows, num_cols)
+
+            frame = self.next_output_frame(header)
+            self.frame_data_length = 0
+            for tile_idx in range(num_rows * num_cols):
+                tile_data_length = TILE_HEADER.unpack(await reader.readexactly(TILE_HEADER.size))[0]
+                tile_data = await reader.readexactly(tile_data_length)
+                decodes.append(loop.run_in_executor(executor, self.decode_tile_into, frame, tile_data, tile_idx, num_rows, num_cols))
+                self.frame_data_length += tile_data_length
+        except asyncio.IncompleteReadError: # socket closed
+            await asyncio.gather(*decodes, return_exceptions=True)
+            return None
+
+        server_recv_end_time = time.time()
+        await asyncio.gather(*decodes)
 
-        network_duration = server_recv_end_time - client_send_start_time
-        bandwidth = self.frame_data_length / network_duration
+        self.last_header, self.last_payload = header, None
+        self.log_frame(header, self.frame_data_length, server_recv_start_time, server_recv_end_time)
+        self.frame_decoded()
 
-        log['frame'] = self.recv_frame_idx
-        log['frame_size'] = f'{self.frame_data_length / 1000} KB'
-        log['client_send_start_time'] = client_send_start_time
-        log['server_recv_start_time'] = server_recv_start_time
-        log['server_recv_end_time'] = server_recv_end_time
-        log['server_recv_duration'] = server_recv_end_time - server_recv_start_time
-        log['network_duration'] = f'{network_duration * 1000:.4f} ms'
-        log['bandwidth'] = f'{(bandwidth * 8) / (1000 * 1000):.4f} Mbps'
+        return frame
 
-        if self.logger:
-            self.logger.log(log)
-        self.recv_frame_idx += 1
+decode_pool = None
 
-        return frame
\ No newline at end of file
+# Shared by every TileSpatial connection so the number of decode threads does not grow with cameras
+def get_decode_pool():
+    global decode_pool
+    if decode_pool is None:
+        decode_pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+    return decode_pool
@@ -129,8 +129,83 @@ def test_read_frame_and_tile_compression():
         if time_to_wait > 0:
             time.sleep(time_to_wait)
 
+class ListLogger:
+    def __init__(self):
+        self.logs = []
+
+    def log(self, data):
+        self.logs.append(data)
+
+# Runs a client whose clock is off by each offset on a thread, with the offset clock
+# injected as the streamer's `now`, and checks that the server's time sync recovers the
+# offset and the corrected one-way latency
+def test_clock_offset(offsets=(-2.5, 0.0, 3.7), num_frames=20, fps=20):
+    import threading
+    from streamers import protocol
+    from streamers.clock import ClockSync
+
+    frame = np.random.default_rng(0).integers(0, 256, (480, 960, 3), dtype=np.uint8)
+    for offset in offsets:
+        server_sock, client_sock = socket.socketpair()
+
+        def client(offset=offset):
+            streamer = mjpeg.Mjpeg(client_sock, qf=50)
+            streamer.now = lambda: time.time() + offset
+            streamer.handshake(frame.shape[1], frame.shape[0], fps)
+            for _ in range(num_frames):
+                streamer.send_frame(frame)
+                time.sleep(1 / fps)
+            client_sock.close()
+        client_thread = threading.Thread(target=client)
+        client_thread.start()
+
+        hello, status = protocol.parse_hello(protocol.recv_exactly(server_sock, protocol.HELLO.size))
+        assert status == protocol.STATUS_OK
+        server_sock.sendall(protocol.pack_welcome(status))
+        logger = ListLogger()
+        streamer = mjpeg.Mjpeg(server_sock, qf=hello.quality, logger=logger)
+        streamer.clock = ClockSync(interval=0.2) # so the periodic refresh happens during the test
+        streamer.sync_clock()
+        while streamer.get_frame() is not None:
+            pass
+        server_sock.close()
+        client_thread.join()
+
+        raw = np.array([log['network_duration_ms'] for log in logger.logs])
+        corrected = np.array([log['corrected_network_duration_ms'] for log in logger.logs])
+        print(f'Injected offset {offset * 1000:.1f} ms, estimated {streamer.clock.offset * 1000:.3f} ms '
+              f'after {streamer.clock.rounds} rounds, raw latency {raw.mean():.1f} ms, corrected {corrected.mean():.3f} ms')
+        assert len(logger.logs) == num_frames
+        assert streamer.clock.rounds > protocol.TIME_SYNC_ROUNDS
+        assert abs(streamer.clock.offset - offset) < 0.005
+        assert np.all(corrected > 0) and np.all(corrected < 100)
+
+# Tiles the ProfileCache recomputes on their own have to score the same as in a full
+# profile of the frame, including when the strongest corner in the frame moved
+def test_profile_cache():
+    from bench.common import synthetic_frame
+    from feature import ProfileCache
+
+    frame = synthetic_frame()
+    moved = frame.copy()
+    cv2.rectangle(moved, (1500, 600), (1900, 1100), (30, 200, 90), -1)
+    cv2.circle(moved, (1700, 850), 120, (250, 250, 250), 8)
+
+    cache = ProfileCache(2, 4)
+    cache.get(frame)
+    assert np.array_equal(cache.get(frame), calculate_compression_profile(frame, 2, 4)) # tiles reused
+
+    cache = ProfileCache(2, 4, threshold=-1) # every tile counts as changed
+    for image in [frame, frame, moved, frame]:
+        profile, expected = cache.get(image), calculate_compression_profile(image, 2, 4)
+        print(f'Tiles recomputed: {cache.last_computed}, max difference {np.abs(profile - expected).max():.2e}')
+        assert np.allclose(profile, expected, atol=1e-3)
+        assert np.array_equal(cap_compression_profile(profile), cap_compression_profile(expected))
+
 if __name__ == '__main__':
-    main()
+    # These two need no video files or server
+    test_clock_offset()
+    test_profile_cache()
     # test_read_frame()
     # test_read_frame_and_tile_compression()
     # test_read_frame_and_compression()
\ No newline at end of file